@@ -0,0 +1,50 @@
+"""
+Cost of creating and rehydrating many domain objects with each lock factory
+
+Run from the repository root with:
+
+    python -m benchmarks.bench_domain_object_locks
+"""
+import multiprocessing
+import threading
+import time
+
+from eventsourcing.DomainObject import DomainObject, NoLock
+
+
+class CounterDomainObject(DomainObject):
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def increment(self):
+        self.mutate("incremented", 1)
+
+    def on_incremented(self, event):
+        self.count += event
+
+
+def run(lock_factory, nb_objects, nb_events):
+    CounterDomainObject.lock_factory = lock_factory
+    source = CounterDomainObject()
+    for _ in range(nb_events - 1):
+        source.increment()
+    events = list(source.event_stream)
+
+    start = time.perf_counter()
+    for _ in range(nb_objects):
+        CounterDomainObject().rehydrate(events)
+    return nb_objects / (time.perf_counter() - start)
+
+
+def main(nb_objects=100000, nb_events=10):
+    print("{:>24} {:>14}".format("lock", "objects/s"))
+    for name, lock_factory in (
+            ("multiprocessing.Lock", multiprocessing.Lock),
+            ("threading.Lock", threading.Lock),
+            ("NoLock", NoLock)):
+        print("{:>24} {:>14.0f}".format(name, run(lock_factory, nb_objects, nb_events)))
+
+
+if __name__ == "__main__":
+    main()
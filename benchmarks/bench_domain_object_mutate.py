@@ -0,0 +1,48 @@
+"""
+Throughput of DomainObject.mutate for each event validation mode
+
+Run from the repository root with:
+
+    python -m benchmarks.bench_domain_object_mutate
+"""
+import time
+
+from eventsourcing.DomainObject import DomainObject, JSON_VALIDATION, CACHED_JSON_VALIDATION, \
+    STRUCTURAL_VALIDATION, NO_VALIDATION
+
+
+class OrderDomainObject(DomainObject):
+    def __init__(self):
+        super().__init__()
+        self.lines = 0
+
+    def add_line(self, product, quantity, price):
+        self.mutate("line_added", {
+            "product": product,
+            "quantity": quantity,
+            "price": price,
+            "tags": ["promo", "web"],
+            "customer": {"id": 42, "country": "FR"}})
+
+    def on_line_added(self, event):
+        self.lines += 1
+
+
+def run(validation, nb_events):
+    OrderDomainObject.event_validation = validation
+    obj = OrderDomainObject()
+
+    start = time.perf_counter()
+    for i in range(nb_events):
+        obj.add_line("product-{}".format(i % 100), i % 7, 9.99)
+    return nb_events / (time.perf_counter() - start)
+
+
+def main(nb_events=100000):
+    print("{:>12} {:>14}".format("validation", "events/s"))
+    for validation in (JSON_VALIDATION, CACHED_JSON_VALIDATION, STRUCTURAL_VALIDATION, NO_VALIDATION):
+        print("{:>12} {:>14.0f}".format(validation, run(validation, nb_events)))
+
+
+if __name__ == "__main__":
+    main()
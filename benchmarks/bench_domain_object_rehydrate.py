@@ -0,0 +1,58 @@
+"""
+Throughput of DomainObject.rehydrate, compared to the former dispatch that looked handlers up in dir()
+
+Run from the repository root with:
+
+    python -m benchmarks.bench_domain_object_rehydrate
+"""
+import time
+
+from eventsourcing.DomainObject import DomainObject
+
+
+class OrderDomainObject(DomainObject):
+    def __init__(self):
+        super().__init__()
+        self.lines = 0
+
+    def add_line(self, product, quantity):
+        self.mutate("line_added", {"product": product, "quantity": quantity})
+
+    def on_line_added(self, event):
+        self.lines += 1
+
+
+def dir_dispatch(obj, events):
+    # What __apply_event used to do for each event
+    for event in events:
+        function_name = "on_{}".format(event["event_name"])
+        if function_name in obj.__dir__():
+            getattr(obj, function_name)(event["event"])
+
+
+def run(nb_events):
+    obj = OrderDomainObject()
+    for i in range(nb_events - 1):
+        obj.add_line("product-{}".format(i % 100), i % 7)
+    events = [event.to_dict() for event in obj.event_stream]
+
+    start = time.perf_counter()
+    dir_dispatch(OrderDomainObject(), events)
+    dir_rate = nb_events / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    OrderDomainObject().rehydrate(events)
+    rehydrate_rate = nb_events / (time.perf_counter() - start)
+
+    return dir_rate, rehydrate_rate
+
+
+def main(nb_events=100000):
+    dir_rate, rehydrate_rate = run(nb_events)
+    print("{:>24} {:>14}".format("", "events/s"))
+    print("{:>24} {:>14.0f}".format("dir() dispatch only", dir_rate))
+    print("{:>24} {:>14.0f}".format("rehydrate", rehydrate_rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Scaling benchmark for InMemoryEventSourceRepository
+
+Run from the repository root with:
+
+    python -m benchmarks.bench_inmemory_repository
+
+Every aggregate is saved, checked and loaded once; the time per aggregate
+should stay flat as the number of aggregates already in the store grows.
+"""
+import time
+
+from eventsourcing.DomainObject import DomainObject
+from eventsourcing.EventSourceRepository import InMemoryEventSourceRepository
+
+
+class AddDomainObject(DomainObject):
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def add(self, a, b):
+        self.mutate("adding", a + b)
+
+    def on_adding(self, event):
+        self.value = event
+
+
+class AddInMemoryRepository(InMemoryEventSourceRepository):
+    def create_blank_domain_object(self):
+        return AddDomainObject()
+
+
+def run(nb_objects, events_per_object=10):
+    repo = AddInMemoryRepository()
+    objects = list()
+    for _ in range(nb_objects):
+        obj = AddDomainObject()
+        for i in range(events_per_object - 1):
+            obj.add(i, 1)
+        objects.append(obj)
+
+    start = time.perf_counter()
+    for obj in objects:
+        repo.save(obj)
+    save_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for obj in objects:
+        repo.exists(obj.object_id)
+        repo.max_version_for_object(obj.object_id)
+    lookup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for obj in objects:
+        repo.load(obj.object_id)
+    load_time = time.perf_counter() - start
+
+    return save_time, lookup_time, load_time
+
+
+def main():
+    print("{:>10} {:>14} {:>14} {:>14}".format(
+        "objects", "save us/obj", "lookup us/obj", "load us/obj"))
+    for nb_objects in (1000, 2000, 4000, 8000):
+        save_time, lookup_time, load_time = run(nb_objects)
+        print("{:>10} {:>14.2f} {:>14.2f} {:>14.2f}".format(
+            nb_objects,
+            save_time / nb_objects * 1e6,
+            lookup_time / nb_objects * 1e6,
+            load_time / nb_objects * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,644 @@
+"""
+asyncio counterparts of the event sourced repositories
+
+"""
+import abc
+import asyncio
+import json
+from .DomainEventListener import DomainEventListener, AsyncioDomainEventListener, ApplicationDomainEventPublisher
+from .DomainObject import DomainObject
+from .EventRecord import EventRecord, copy_for_listeners
+from .EventSourceRepository import ConcurrencyError, _MONGO_UNNUMBERED_EVENTS, _MONGO_SAVE_ORDER, \
+    _MYSQL_INIT_POSITION, _MYSQL_CHECK_POSITION_COLUMN, _MYSQL_ADD_POSITIONS, _number_mongo_events
+from pymongo import AsyncMongoClient, ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError
+import aiomysql
+import pymysql.err
+
+
+class AsyncRepository(metaclass=abc.ABCMeta):
+    stream_batch_size = 1000
+
+    @abc.abstractmethod
+    async def load(self, object_id):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def exists(self, object_id):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def save(self, obj, expected_version=None):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def get_event_stream_for(self, object_id, after_version=0):
+        raise NotImplementedError()
+
+    async def get_event_streams_for(self, after_versions):
+        """
+        Fetch the streams of many objects at once, see Repository.get_event_streams_for
+        """
+        object_ids = list(after_versions)
+        streams = await asyncio.gather(*[
+            self.get_event_stream_for(object_id, after_versions[object_id]) for object_id in object_ids])
+
+        result = dict()
+        for object_id, stream in zip(object_ids, streams):
+            if len(stream) > 0:
+                stream.sort(key=lambda x: x["version"])
+                result[object_id] = stream
+        return result
+
+    @abc.abstractmethod
+    async def max_version_for_object(self, object_id):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def read_all(self, from_position=0, batch_size=None):
+        """
+        Asynchronously iterate over the events of every object of the store, see Repository.read_all
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def last_position(self):
+        """
+        Return the position of the last stored event, 0 if the store is empty
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def create_blank_domain_object(self):
+        raise NotImplementedError()
+
+
+class AsyncEventPublisherRepository(AsyncRepository, metaclass=abc.ABCMeta):
+    def __init__(self):
+        self.listeners = list()
+        self.register_listener(ApplicationDomainEventPublisher().instance)
+
+    async def load(self, object_id):
+        obj = self.create_blank_domain_object()
+        assert isinstance(obj, DomainObject)
+
+        stream = await self.get_event_stream_for(object_id)
+        obj.rehydrate(stream)
+
+        return obj
+
+    async def load_many(self, object_ids):
+        """
+        Load many objects at once
+
+        :return: a dict giving the loaded object of each object_id, the unknown ones are left out
+        """
+        streams = await self.get_event_streams_for({object_id: 0 for object_id in object_ids})
+
+        objs = dict()
+        for object_id, stream in streams.items():
+            obj = self.create_blank_domain_object()
+            assert isinstance(obj, DomainObject)
+
+            obj.rehydrate(stream)
+            objs[object_id] = obj
+
+        return objs
+
+    async def save(self, obj, expected_version=None):
+        """
+        Append the new events of obj to its stream and publish them
+
+        :param obj: the domain object to save
+        :param expected_version: the version the stream must be at, None to append whatever the
+        stored version is
+        :raise ConcurrencyError: if the stream is not at the expected version
+        """
+        to_emit = await self.append_to_stream(obj, expected_version)
+
+        assert to_emit is not None
+
+        if len(to_emit) == 0:
+            return
+        obj.mark_committed(to_emit[-1]["version"])
+
+        publisher = ApplicationDomainEventPublisher().instance
+        for listener in self.listeners:
+            if listener is publisher:
+                await publisher.domainEventsPublishedAsync(to_emit)
+            elif isinstance(listener, AsyncioDomainEventListener):
+                await listener.domainEventsPublished(to_emit)
+            else:
+                # A synchronous listener must not block the event loop
+                await asyncio.get_running_loop().run_in_executor(None, listener.domainEventsPublished, to_emit)
+
+    def register_listener(self, listener):
+        assert listener is not None
+        assert isinstance(listener, DomainEventListener) or \
+            isinstance(listener, AsyncioDomainEventListener)
+
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    @abc.abstractmethod
+    async def append_to_stream(self, obj, expected_version=None):
+        raise NotImplementedError()
+
+
+class AsyncMongoEventSourceRepository(AsyncEventPublisherRepository, metaclass=abc.ABCMeta):
+    def __init__(
+        self, host="localhost", port=27017, database="fenrys", collection="event_store"
+    ):
+        super().__init__()
+        self.__client = AsyncMongoClient(host, port)
+        self.__db = self.__client[database]
+        self.__collection = self.__db[collection]
+        self.__positions = self.__db["{}_position".format(collection)]
+        self.__index_created = False
+
+    async def __create_index(self):
+        if not self.__index_created:
+            await self.__collection.create_index(
+                [("object_id", ASCENDING), ("version", ASCENDING)], unique=True
+            )
+            await self.__collection.create_index("position", unique=True, sparse=True)
+            await self.__add_positions()
+            self.__index_created = True
+
+    async def __add_positions(self):
+        # The same one-time numbering as MongoEventSourceRepository
+        counter = await self.__positions.find_one({"_id": "position"})
+        if counter is not None and counter.get("numbered", False):
+            return
+
+        last_event = await self.__collection.find_one(
+            {"position": {"$exists": True}},
+            {"_id": False, "position": True},
+            sort=[("position", DESCENDING)],
+        )
+        await self.__positions.update_one(
+            {"_id": "position"},
+            {"$max": {"position": last_event["position"] if last_event is not None else 0}},
+            upsert=True,
+        )
+
+        nb_events = await self.__collection.count_documents(_MONGO_UNNUMBERED_EVENTS)
+        if nb_events > 0:
+            counter = await self.__positions.find_one_and_update(
+                {"_id": "position"},
+                {"$inc": {"position": nb_events}},
+                return_document=ReturnDocument.AFTER,
+            )
+            position = counter["position"] - nb_events + 1
+
+            documents = (
+                self.__collection.find(_MONGO_UNNUMBERED_EVENTS, {"_id": True}, allow_disk_use=True)
+                .sort(_MONGO_SAVE_ORDER)
+                .batch_size(self.stream_batch_size)
+            )
+            batch = list()
+            async for document in documents:
+                batch.append(document)
+                if len(batch) >= self.stream_batch_size:
+                    await self.__collection.bulk_write(_number_mongo_events(batch, position), ordered=False)
+                    position += len(batch)
+                    batch = list()
+
+            if len(batch) > 0:
+                await self.__collection.bulk_write(_number_mongo_events(batch, position), ordered=False)
+
+        await self.__positions.update_one({"_id": "position"}, {"$set": {"numbered": True}})
+
+    async def __reserve_positions(self, events):
+        # The same counter document as MongoEventSourceRepository
+        if len(events) == 0:
+            return events
+
+        counter = await self.__positions.find_one_and_update(
+            {"_id": "position"},
+            {"$inc": {"position": len(events)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        first_position = counter["position"] - len(events) + 1
+        return [event.with_position(first_position + index) for index, event in enumerate(events)]
+
+    async def append_to_stream(self, obj, expected_version=None):
+        assert obj is not None
+        assert isinstance(obj, DomainObject)
+
+        await self.__create_index()
+
+        # The unique index only catches a stream that went past expected_version, not one behind it. A new
+        # stream, expected at version 0, is the exception.
+        if expected_version != 0:
+            max_known_version = await self.max_version_for_object(obj.object_id)
+            if expected_version is None:
+                expected_version = max_known_version
+            elif expected_version != max_known_version:
+                raise ConcurrencyError(obj.object_id, expected_version)
+
+        events_to_add = await self.__reserve_positions(obj.events_after(expected_version))
+
+        if len(events_to_add) > 0:
+            try:
+                await self.__collection.insert_many(
+                    [event.to_dict() for event in events_to_add], ordered=True
+                )
+            except BulkWriteError as e:
+                if any(
+                    error["code"] == 11000
+                    for error in e.details.get("writeErrors", ())
+                ):
+                    raise ConcurrencyError(obj.object_id, expected_version) from e
+                raise e
+
+        return copy_for_listeners(events_to_add)
+
+    async def exists(self, object_id):
+        return (
+            await self.__collection.find_one({"object_id": object_id}, {"_id": True})
+            is not None
+        )
+
+    async def get_event_stream_for(self, object_id, after_version=0):
+        stream = list()
+
+        objects = self.__collection.find(
+            {"object_id": object_id, "version": {"$gt": after_version}}, {"_id": False}
+        )
+        async for event in objects:
+            stream.append(EventRecord.from_mapping(event))
+
+        return stream
+
+    async def get_event_streams_for(self, after_versions):
+        if len(after_versions) == 0:
+            return dict()
+
+        if all(after_version <= 0 for after_version in after_versions.values()):
+            query = {"object_id": {"$in": list(after_versions)}}
+        else:
+            query = {
+                "$or": [
+                    {"object_id": object_id, "version": {"$gt": after_version}}
+                    for object_id, after_version in after_versions.items()
+                ]
+            }
+
+        streams = dict()
+        events = self.__collection.find(query, {"_id": False}).sort(
+            [("object_id", ASCENDING), ("version", ASCENDING)]
+        )
+        async for event in events:
+            streams.setdefault(event["object_id"], list()).append(
+                EventRecord.from_mapping(event)
+            )
+
+        return streams
+
+    async def max_version_for_object(self, object_id):
+        last_event = await self.__collection.find_one(
+            {"object_id": object_id},
+            {"_id": False, "version": True},
+            sort=[("version", DESCENDING)],
+        )
+
+        return last_event["version"] if last_event is not None else 0
+
+    async def read_all(self, from_position=0, batch_size=None):
+        await self.__create_index()
+
+        cursor = (
+            self.__collection.find({"position": {"$gt": from_position}}, {"_id": False})
+            .sort("position", ASCENDING)
+            .batch_size(batch_size or self.stream_batch_size)
+        )
+
+        try:
+            async for event in cursor:
+                yield EventRecord.from_mapping(event)
+        finally:
+            await cursor.close()
+
+    async def last_position(self):
+        await self.__create_index()
+
+        last_event = await self.__collection.find_one(
+            {"position": {"$exists": True}},
+            {"_id": False, "position": True},
+            sort=[("position", DESCENDING)],
+        )
+
+        return last_event["position"] if last_event is not None else 0
+
+    async def close(self):
+        await self.__client.close()
+
+
+class AsyncMySQLSourceRepository(AsyncEventPublisherRepository, metaclass=abc.ABCMeta):
+
+    __CREATE_STREAM = """create table if not exists `{}`(`object_id` varchar(255) not null, `version` int not null, `event_name` varchar(255) not null, `event` longtext not null, `event_timestamp` double not null, `position` bigint not null, primary key(`object_id`, `version`), unique key(`position`))"""
+    __CREATE_POSITION = """create table if not exists `{}_position`(`id` tinyint not null, `position` bigint not null, primary key(`id`))"""
+    __RESERVE_POSITIONS = "update `{}_position` set position = last_insert_id(position + %s) where id = 1"
+    __SELECT_RESERVED_POSITION = "select last_insert_id()"
+    __SELECT_OBJECT_STREAM = "select * from `{}` where object_id = %s and version > %s"
+    __SELECT_OBJECTS_STREAMS = "select * from `{}` where {} order by object_id, version"
+    __SELECT_MAX_VERSION = "select max(version) as max_version from `{}` where object_id = %s"
+    __SELECT_EXISTS = "select 1 from `{}` where object_id = %s limit 1"
+    __SELECT_ALL = "select * from `{}` where position > %s order by position"
+    __SELECT_LAST_POSITION = "select max(position) as position from `{}`"
+    __INSERT_OBJECT_STREAM = "insert into `{}`(`object_id`, `version`, `event_name`, `event`, `event_timestamp`, `position`) values(%s, %s, %s, %s, %s, %s)"
+    __LOCK_MAX_VERSION = __SELECT_MAX_VERSION + " for update"
+    __DUPLICATE_ENTRY = 1062
+    __DEADLOCK = 1213
+    __MAX_OBJECTS_PER_QUERY = 500
+
+    def __init__(
+        self,
+        user="fenrys",
+        password="fenrys",
+        host="localhost",
+        database="fenrys",
+        table="event_store",
+        minsize=1,
+        maxsize=10,
+    ):
+        super().__init__()
+        self.__pool_parameters = dict(
+            host=host,
+            user=user,
+            password=password,
+            db=database,
+            charset="utf8mb4",
+            minsize=minsize,
+            maxsize=maxsize,
+        )
+        self.__table = table
+        self.__pool = None
+        self.__pool_lock = asyncio.Lock()
+
+    async def __get_pool(self):
+        # The pool can only be created from a running event loop
+        async with self.__pool_lock:
+            if self.__pool is None:
+                pool = await aiomysql.create_pool(**self.__pool_parameters)
+                async with pool.acquire() as connection:
+                    async with connection.cursor() as cursor:
+                        await cursor.execute(
+                            AsyncMySQLSourceRepository.__CREATE_STREAM.format(self.__table)
+                        )
+                        # A table created before events had a position is migrated as MySQLSourceRepository
+                        # does it
+                        await cursor.execute(_MYSQL_CHECK_POSITION_COLUMN.format(self.__table))
+                        if await cursor.fetchone() is None:
+                            for statement in _MYSQL_ADD_POSITIONS:
+                                await cursor.execute(statement.format(self.__table))
+                        await cursor.execute(
+                            AsyncMySQLSourceRepository.__CREATE_POSITION.format(self.__table)
+                        )
+                        await cursor.execute(_MYSQL_INIT_POSITION.format(self.__table))
+                    await connection.commit()
+                self.__pool = pool
+
+        return self.__pool
+
+    async def close(self):
+        if self.__pool is not None:
+            self.__pool.close()
+            await self.__pool.wait_closed()
+            self.__pool = None
+
+    async def append_to_stream(self, obj, expected_version=None):
+        assert obj is not None
+        assert isinstance(obj, DomainObject)
+
+        pool = await self.__get_pool()
+        async with pool.acquire() as connection:
+            try:
+                async with connection.cursor() as cursor:
+                    # The stored version is read in the transaction of the insert, see MySQLSourceRepository
+                    await cursor.execute(
+                        AsyncMySQLSourceRepository.__LOCK_MAX_VERSION.format(self.__table), (obj.object_id,)
+                    )
+                    result = await cursor.fetchone()
+                    max_known_version = int(result[0] or 0) if result is not None else 0
+                    if expected_version is None:
+                        expected_version = max_known_version
+                    elif expected_version != max_known_version:
+                        raise ConcurrencyError(obj.object_id, expected_version)
+
+                    events_to_add = obj.events_after(expected_version)
+                    if len(events_to_add) > 0:
+                        # The position row stays locked until the commit, see MySQLSourceRepository
+                        await cursor.execute(
+                            AsyncMySQLSourceRepository.__RESERVE_POSITIONS.format(self.__table),
+                            (len(events_to_add),),
+                        )
+                        await cursor.execute(AsyncMySQLSourceRepository.__SELECT_RESERVED_POSITION)
+                        first_position = int((await cursor.fetchone())[0]) - len(events_to_add) + 1
+                        events_to_add = [
+                            event.with_position(first_position + index)
+                            for index, event in enumerate(events_to_add)
+                        ]
+
+                        await cursor.executemany(
+                            AsyncMySQLSourceRepository.__INSERT_OBJECT_STREAM.format(
+                                self.__table
+                            ),
+                            [
+                                AsyncMySQLSourceRepository.__to_row(
+                                    event, obj.encoded_events.get(event["version"])
+                                )
+                                for event in events_to_add
+                            ],
+                        )
+                await connection.commit()
+            except pymysql.err.IntegrityError as e:
+                await connection.rollback()
+                if e.args[0] == AsyncMySQLSourceRepository.__DUPLICATE_ENTRY:
+                    raise ConcurrencyError(obj.object_id, expected_version) from e
+                raise e
+            except pymysql.err.OperationalError as e:
+                await connection.rollback()
+                if e.args[0] == AsyncMySQLSourceRepository.__DEADLOCK:
+                    raise ConcurrencyError(obj.object_id, expected_version) from e
+                raise e
+            except Exception as e:
+                await connection.rollback()
+                raise e
+
+        return copy_for_listeners(events_to_add)
+
+    async def exists(self, object_id):
+        return await self.__fetchone(
+            AsyncMySQLSourceRepository.__SELECT_EXISTS, (object_id,)
+        ) is not None
+
+    async def get_event_stream_for(self, object_id, after_version=0):
+        stream = list()
+
+        pool = await self.__get_pool()
+        async with pool.acquire() as connection:
+            async with connection.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(
+                    AsyncMySQLSourceRepository.__SELECT_OBJECT_STREAM.format(self.__table),
+                    (object_id, after_version),
+                )
+                results = await cursor.fetchall()
+            await connection.commit()
+
+        for result in results:
+            stream.append(AsyncMySQLSourceRepository.__to_event(result))
+
+        return stream
+
+    async def get_event_streams_for(self, after_versions):
+        streams = dict()
+        items = list(after_versions.items())
+
+        pool = await self.__get_pool()
+        async with pool.acquire() as connection:
+            async with connection.cursor(aiomysql.DictCursor) as cursor:
+                for start in range(0, len(items), AsyncMySQLSourceRepository.__MAX_OBJECTS_PER_QUERY):
+                    chunk = items[start:start + AsyncMySQLSourceRepository.__MAX_OBJECTS_PER_QUERY]
+                    if all(after_version <= 0 for _, after_version in chunk):
+                        condition = "object_id in ({})".format(", ".join(["%s"] * len(chunk)))
+                        parameters = [object_id for object_id, _ in chunk]
+                    else:
+                        condition = " or ".join(["(object_id = %s and version > %s)"] * len(chunk))
+                        parameters = [value for item in chunk for value in item]
+
+                    await cursor.execute(
+                        AsyncMySQLSourceRepository.__SELECT_OBJECTS_STREAMS.format(self.__table, condition),
+                        parameters,
+                    )
+                    for result in await cursor.fetchall():
+                        event = AsyncMySQLSourceRepository.__to_event(result)
+                        streams.setdefault(event["object_id"], list()).append(event)
+            await connection.commit()
+
+        return streams
+
+    @staticmethod
+    def __to_row(event, encoded_event=None):
+        return (
+            event["object_id"],
+            int(event["version"]),
+            event["event_name"],
+            encoded_event if encoded_event is not None else json.dumps(event["event"]),
+            "{:10.15f}".format(float(event["event_timestamp"])),
+            event.position,
+        )
+
+    @staticmethod
+    def __to_event(result):
+        return EventRecord(
+            result["object_id"],
+            int(result["version"]),
+            result["event_name"],
+            json.loads(result["event"]),
+            float(result["event_timestamp"]),
+            int(result["position"]) if result.get("position") is not None else None,
+        )
+
+    async def max_version_for_object(self, object_id):
+        result = await self.__fetchone(
+            AsyncMySQLSourceRepository.__SELECT_MAX_VERSION, (object_id,)
+        )
+
+        if result is None or result["max_version"] is None:
+            return 0
+
+        return int(result["max_version"])
+
+    async def read_all(self, from_position=0, batch_size=None):
+        batch_size = batch_size or self.stream_batch_size
+
+        pool = await self.__get_pool()
+        async with pool.acquire() as connection:
+            # An unbuffered cursor streams the rows from the server instead of loading them all
+            async with connection.cursor(aiomysql.SSDictCursor) as cursor:
+                await cursor.execute(
+                    AsyncMySQLSourceRepository.__SELECT_ALL.format(self.__table), (from_position,)
+                )
+                while True:
+                    results = await cursor.fetchmany(batch_size)
+                    if len(results) == 0:
+                        break
+                    for result in results:
+                        yield AsyncMySQLSourceRepository.__to_event(result)
+            await connection.commit()
+
+    async def last_position(self):
+        result = await self.__fetchone(AsyncMySQLSourceRepository.__SELECT_LAST_POSITION, ())
+
+        if result is None or result["position"] is None:
+            return 0
+
+        return int(result["position"])
+
+    async def __fetchone(self, query, parameters):
+        pool = await self.__get_pool()
+        async with pool.acquire() as connection:
+            async with connection.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(query.format(self.__table), parameters)
+                result = await cursor.fetchone()
+            await connection.commit()
+
+        return result
+
+
+class AsyncInMemoryEventSourceRepository(AsyncEventPublisherRepository, metaclass=abc.ABCMeta):
+    def __init__(self):
+        super().__init__()
+        self.__streams = dict()
+        self.__max_versions = dict()
+        self.__log = list()
+
+    async def append_to_stream(self, obj, expected_version=None):
+        assert obj is not None
+        assert isinstance(obj, DomainObject)
+
+        # Nothing is awaited between the check and the append, which makes it atomic on the event loop
+        max_known_version = self.__max_versions.get(obj.object_id, 0)
+        if expected_version is None:
+            expected_version = max_known_version
+        elif expected_version != max_known_version:
+            raise ConcurrencyError(obj.object_id, expected_version)
+
+        # The log of every event gives them their position
+        events_to_add = [
+            event.with_position(len(self.__log) + index + 1)
+            for index, event in enumerate(obj.events_after(expected_version))
+        ]
+
+        if len(events_to_add) > 0:
+            self.__streams.setdefault(obj.object_id, list()).extend(events_to_add)
+            self.__max_versions[obj.object_id] = events_to_add[-1]["version"]
+            self.__log.extend(events_to_add)
+
+        return copy_for_listeners(events_to_add)
+
+    async def exists(self, object_id):
+        return object_id in self.__streams
+
+    async def get_event_stream_for(self, object_id, after_version=0):
+        stream = self.__streams.get(object_id, ())
+
+        index = len(stream)
+        while index > 0 and stream[index - 1]["version"] > after_version:
+            index -= 1
+
+        return list(stream[index:])
+
+    async def max_version_for_object(self, object_id):
+        return self.__max_versions.get(object_id, 0)
+
+    async def read_all(self, from_position=0, batch_size=None):
+        # Events appended while iterating are not returned
+        for event in self.__log[max(from_position, 0):]:
+            yield event
+
+    async def last_position(self):
+        return len(self.__log)
@@ -0,0 +1,212 @@
+"""
+Identity map with LRU eviction in front of a repository
+
+"""
+from collections import OrderedDict
+from threading import Lock
+from .DomainObject import DomainObject
+from .EventSourceRepository import Repository, UnitOfWork
+
+
+class CachedRepository(Repository):
+    """
+    Keep the recently loaded domain objects in memory
+
+    On a hit only the events newer than the cached version are fetched from the wrapped repository.
+    The cache is an identity map: the same instance is returned to every caller, so an object that is
+    mutated must be saved through this repository (or evicted) to keep the cache coherent.
+    """
+
+    def __init__(self, repository, max_size=1000, max_events=None):
+        """
+        :param repository: the wrapped repository
+        :param max_size: the maximum number of cached objects, None for no limit
+        :param max_events: the maximum number of events held by the cached objects, None for no limit
+        """
+        assert repository is not None
+        assert isinstance(repository, Repository)
+        assert max_size is None or max_size > 0
+        assert max_events is None or max_events > 0
+
+        self.repository = repository
+        self.max_size = max_size
+        self.max_events = max_events
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.__cache = OrderedDict()
+        self.__nb_events = 0
+        self.__lock = Lock()
+
+    def load(self, object_id):
+        with self.__lock:
+            entry = self.__cache.get(object_id)
+            if entry is not None:
+                self.__cache.move_to_end(object_id)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is None:
+            obj = self.repository.load(object_id)
+            if obj.version_number > 0 and obj.object_id == object_id:
+                self.__put(obj)
+            return obj
+
+        obj, _, replay_lock = entry
+        # Concurrent loads of the same object must not replay the same events twice
+        with replay_lock:
+            version_number = obj.version_number
+            obj.replay(self.repository.iter_event_stream_for(object_id, version_number))
+        if obj.version_number > version_number:
+            self.__put(obj)
+
+        return obj
+
+    def load_many(self, object_ids):
+        cached = dict()
+        missing = list()
+        with self.__lock:
+            for object_id in object_ids:
+                entry = self.__cache.get(object_id)
+                if entry is not None:
+                    self.__cache.move_to_end(object_id)
+                    self.hits += 1
+                    cached[object_id] = entry
+                else:
+                    self.misses += 1
+                    missing.append(object_id)
+
+        objs = dict()
+        if len(cached) > 0:
+            streams = self.repository.get_event_streams_for(
+                {object_id: entry[0].version_number for object_id, entry in cached.items()}
+            )
+            for object_id, (obj, _, replay_lock) in cached.items():
+                if object_id in streams:
+                    # Another load may have replayed some of the events meanwhile
+                    with replay_lock:
+                        obj.replay(
+                            [event for event in streams[object_id] if event["version"] > obj.version_number]
+                        )
+                    self.__put(obj)
+                objs[object_id] = obj
+
+        if len(missing) > 0:
+            loaded = self.repository.load_many(missing)
+            for obj in loaded.values():
+                self.__put(obj)
+            objs.update(loaded)
+
+        return objs
+
+    def exists(self, object_id):
+        with self.__lock:
+            if object_id in self.__cache:
+                return True
+
+        return self.repository.exists(object_id)
+
+    def save(self, obj, expected_version=None):
+        assert obj is not None
+        assert isinstance(obj, DomainObject)
+
+        try:
+            self.repository.save(obj, expected_version)
+        except Exception as e:
+            self.evict(obj.object_id)
+            raise e
+
+        self.__put(obj)
+
+    def save_all(self, objs, expected_versions=None):
+        objs = list(objs)
+
+        try:
+            self.repository.save_all(objs, expected_versions)
+        except Exception as e:
+            for obj in objs:
+                self.evict(obj.object_id)
+            raise e
+
+        for obj in objs:
+            self.__put(obj)
+
+    def unit_of_work(self):
+        return UnitOfWork(self)
+
+    def get_event_stream_for(self, object_id, after_version=0):
+        return self.repository.get_event_stream_for(object_id, after_version)
+
+    def get_event_streams_for(self, after_versions):
+        return self.repository.get_event_streams_for(after_versions)
+
+    def iter_event_stream_for(self, object_id, after_version=0, batch_size=None):
+        return self.repository.iter_event_stream_for(object_id, after_version, batch_size)
+
+    def max_version_for_object(self, object_id):
+        return self.repository.max_version_for_object(object_id)
+
+    def read_all(self, from_position=0, batch_size=None):
+        return self.repository.read_all(from_position, batch_size)
+
+    def last_position(self):
+        return self.repository.last_position()
+
+    def create_blank_domain_object(self):
+        return self.repository.create_blank_domain_object()
+
+    def evict(self, object_id):
+        with self.__lock:
+            entry = self.__cache.pop(object_id, None)
+            if entry is not None:
+                self.__nb_events -= entry[1]
+
+    def clear(self):
+        with self.__lock:
+            self.__cache.clear()
+            self.__nb_events = 0
+
+    def stats(self):
+        with self.__lock:
+            return {
+                "size": len(self.__cache),
+                "events": self.__nb_events,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def __len__(self):
+        return len(self.__cache)
+
+    def __contains__(self, object_id):
+        return object_id in self.__cache
+
+    def __getattr__(self, name):
+        if name == "repository":
+            raise AttributeError(name)
+        return getattr(self.repository, name)
+
+    def __put(self, obj):
+        weight = len(obj.event_stream) + 1
+
+        with self.__lock:
+            previous = self.__cache.pop(obj.object_id, None)
+            if previous is not None:
+                self.__nb_events -= previous[1]
+
+            # The replay lock belongs to the cached instance
+            replay_lock = previous[2] if previous is not None and previous[0] is obj else Lock()
+            self.__cache[obj.object_id] = (obj, weight, replay_lock)
+            self.__nb_events += weight
+
+            while len(self.__cache) > 1 and (
+                (self.max_size is not None and len(self.__cache) > self.max_size)
+                or (self.max_events is not None and self.__nb_events > self.max_events)
+            ):
+                _, evicted = self.__cache.popitem(last=False)
+                self.__nb_events -= evicted[1]
+                self.evictions += 1
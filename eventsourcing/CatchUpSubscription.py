@@ -0,0 +1,154 @@
+"""
+Subscription that replays the events of a store from a position, then follows the live events
+
+"""
+from threading import Lock
+import time
+from .DomainEventListener import DomainEventListener, ApplicationDomainEventPublisher
+from .EventSourceRepository import Repository
+
+
+class CatchUpSubscription(DomainEventListener):
+    """
+    Feed a listener with the events of a repository stored after from_position, in batches read with
+    read_all, then with the events published by ApplicationDomainEventPublisher
+
+    The subscription is registered with the publisher before reading the store, and the events published
+    while it catches up are kept aside: none is lost and none is delivered twice. It relies on the
+    positions of the events, so the application must publish the events of that repository only.
+
+    position is the position of the last event delivered to the listener, it can be stored to start a
+    later subscription from it.
+
+    The positions skipped while catching up are accepted if they are published later. At most max_gaps of
+    them are kept, the lowest ones are given up first. Once gap_timeout seconds have passed, the next
+    published events make the subscription read the store again for them: those that became visible are
+    delivered and the others are given up.
+    """
+
+    def __init__(
+        self, repository, listener, from_position=0, batch_size=None, max_gaps=1000, gap_timeout=5.0
+    ):
+        assert repository is not None
+        assert isinstance(repository, Repository)
+        assert listener is not None
+        assert isinstance(listener, DomainEventListener)
+        assert from_position >= 0
+        assert max_gaps > 0
+        assert gap_timeout >= 0
+
+        self.repository = repository
+        self.listener = listener
+        self.position = from_position
+        self.batch_size = batch_size or repository.stream_batch_size
+        self.max_gaps = max_gaps
+        self.gap_timeout = gap_timeout
+
+        self.__lock = Lock()
+        self.__live = False
+        self.__pending = list()
+        self.__caught_up_position = from_position
+        self.__gaps = set()
+        self.__gaps_since = None
+
+    def start(self):
+        """
+        Catch up with the store then switch to the live events. Returns once the subscription is live.
+        """
+        publisher = ApplicationDomainEventPublisher().instance
+        publisher.register_listener(self)
+
+        try:
+            self.__catch_up()
+
+            with self.__lock:
+                pending, self.__pending = self.__pending, list()
+                self.__deliver_live(pending)
+                self.__live = True
+        except Exception as e:
+            publisher.unregister_listener(self)
+            raise e
+
+    def stop(self):
+        ApplicationDomainEventPublisher().instance.unregister_listener(self)
+        with self.__lock:
+            self.__live = False
+            self.__pending = list()
+
+    def is_live(self):
+        return self.__live
+
+    def __catch_up(self):
+        batch = list()
+        for event in self.repository.read_all(self.position, self.batch_size):
+            # A position skipped by the store may belong to an event that was not visible yet, it will
+            # be accepted if it is published
+            self.__add_gaps(self.__caught_up_position + 1, event.position)
+            self.__caught_up_position = event.position
+
+            batch.append(event)
+            if len(batch) >= self.batch_size:
+                self.__deliver(batch)
+                batch = list()
+
+        if len(batch) > 0:
+            self.__deliver(batch)
+
+    def __add_gaps(self, start, stop):
+        if start >= stop:
+            return
+
+        self.__gaps.update(range(max(start, stop - self.max_gaps), stop))
+        if len(self.__gaps) > self.max_gaps:
+            self.__gaps = set(sorted(self.__gaps)[-self.max_gaps:])
+        if self.__gaps_since is None:
+            self.__gaps_since = time.monotonic()
+
+    def __settle_gaps(self):
+        # The events of the gaps that are still not visible in the store are given up
+        gaps, self.__gaps, self.__gaps_since = self.__gaps, set(), None
+
+        found = list()
+        for event in self.repository.read_all(min(gaps) - 1, self.batch_size):
+            if event.position > max(gaps):
+                break
+            if event.position in gaps:
+                found.append(event)
+
+        if len(found) > 0:
+            self.__deliver(found)
+
+    def __deliver_live(self, events):
+        # Events read while catching up are dropped, the others are delivered in publication order
+        to_deliver = list()
+        for event in events:
+            position = getattr(event, "position", None)
+            if position is None or position > self.__caught_up_position:
+                to_deliver.append(event)
+            elif position in self.__gaps:
+                self.__gaps.discard(position)
+                to_deliver.append(event)
+
+        if len(self.__gaps) == 0:
+            self.__gaps_since = None
+
+        if len(to_deliver) > 0:
+            self.__deliver(to_deliver)
+
+    def __deliver(self, events):
+        self.listener.domainEventsPublished(events)
+        positions = [event.position for event in events if getattr(event, "position", None) is not None]
+        if len(positions) > 0:
+            self.position = max(self.position, max(positions))
+
+    def domainEventPublished(self, event):
+        self.domainEventsPublished([event])
+
+    def domainEventsPublished(self, events):
+        with self.__lock:
+            if self.__live:
+                self.__deliver_live(events)
+                if len(self.__gaps) > 0 and time.monotonic() - self.__gaps_since >= self.gap_timeout:
+                    self.__settle_gaps()
+            else:
+                self.__pending.extend(events)
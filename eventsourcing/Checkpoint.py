@@ -0,0 +1,105 @@
+"""
+Checkpoints of projections: the position of the last event each of them has handled
+
+"""
+import abc
+import datetime
+from pymongo import MongoClient
+from .MySQLConnectionPool import MySQLConnectionPool
+
+
+class CheckpointStore(metaclass=abc.ABCMeta):
+    @abc.abstractmethod
+    def get_checkpoint(self, name):
+        """
+        Return the position of the last event handled by the projection called name, 0 if it has none
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def save_checkpoint(self, name, position):
+        raise NotImplementedError()
+
+
+class InMemoryCheckpointStore(CheckpointStore):
+    def __init__(self):
+        self.__checkpoints = dict()
+
+    def get_checkpoint(self, name):
+        return self.__checkpoints.get(name, 0)
+
+    def save_checkpoint(self, name, position):
+        assert name is not None
+        self.__checkpoints[name] = position
+
+
+class MongoCheckpointStore(CheckpointStore):
+    def __init__(
+        self, host="localhost", port=27017, database="fenrys", collection="checkpoints"
+    ):
+        self.__client = MongoClient(host, port)
+        self.__db = self.__client[database]
+        self.__collection = self.__db[collection]
+
+    def get_checkpoint(self, name):
+        checkpoint = self.__collection.find_one({"_id": name})
+        return checkpoint["position"] if checkpoint is not None else 0
+
+    def save_checkpoint(self, name, position):
+        assert name is not None
+
+        self.__collection.replace_one(
+            {"_id": name},
+            {
+                "position": position,
+                "checkpoint_timestamp": datetime.datetime.now().timestamp(),
+            },
+            upsert=True,
+        )
+
+
+class MySQLCheckpointStore(CheckpointStore):
+
+    __CREATE_CHECKPOINTS = """create table if not exists `{}`(`name` varchar(255) not null, `position` bigint not null, `checkpoint_timestamp` double not null, primary key(`name`))"""
+    __SELECT_CHECKPOINT = "select position from `{}` where name = %s"
+    __REPLACE_CHECKPOINT = "replace into `{}`(`name`, `position`, `checkpoint_timestamp`) values(%s, %s, %s)"
+
+    def __init__(
+        self,
+        user="fenrys",
+        password="fenrys",
+        host="localhost",
+        database="fenrys",
+        table="checkpoints",
+        min_pool_size=1,
+        max_pool_size=10,
+    ):
+        self.__pool = MySQLConnectionPool.for_dsn(
+            user, password, host, database, min_size=min_pool_size, max_size=max_pool_size
+        )
+        self.__table = table
+
+        with self.__pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(MySQLCheckpointStore.__CREATE_CHECKPOINTS.format(self.__table))
+
+    def get_checkpoint(self, name):
+        with self.__pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(
+                MySQLCheckpointStore.__SELECT_CHECKPOINT.format(self.__table), (name,)
+            )
+            result = cursor.fetchone()
+
+        return int(result["position"]) if result is not None else 0
+
+    def save_checkpoint(self, name, position):
+        assert name is not None
+
+        with self.__pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(
+                MySQLCheckpointStore.__REPLACE_CHECKPOINT.format(self.__table),
+                (
+                    name,
+                    int(position),
+                    "{:10.15f}".format(datetime.datetime.now().timestamp()),
+                ),
+            )
@@ -1,7 +1,16 @@
 import abc
-from queue import Empty
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import logging
+import multiprocessing
+import os
+from queue import Full
+import threading
 from threading import Thread
-from multiprocessing import Queue
+import time
+import zlib
+from .EventQueue import EventQueue, BLOCK
 
 
 class DomainEventListener(metaclass=abc.ABCMeta):
@@ -10,28 +19,73 @@ class DomainEventListener(metaclass=abc.ABCMeta):
     def domainEventPublished(self, event):
         raise NotImplementedError()
 
+    def domainEventsPublished(self, events):
+        """
+        Receive the events saved together, in order. Override it to handle them as a batch.
+        """
+        for event in events:
+            self.domainEventPublished(event)
+
 
 class AsyncDomainEventListener(Thread, metaclass=abc.ABCMeta):
+    """
+    Listener running in its own thread, fed by ApplicationDomainEventPublisher through an in-process queue
 
-    def __init__(self):
+    The thread waits for events, then up to batch_wait seconds for batch_size events to be queued, and
+    hands them to domainEventsPublished. post_publish is called after each batch.
+
+    The queue is unbounded unless max_queue_size is given, see EventQueue for the overflow policies. With
+    BLOCK, the thread must not save domain objects itself or it would wait for its own queue.
+    """
+
+    def __init__(self, batch_size=100, batch_wait=0.01, max_queue_size=None, overflow=BLOCK,
+                 spill_directory=None):
         Thread.__init__(self)
+        assert batch_size > 0
+        assert batch_wait >= 0
 
-        self.queue = Queue()
-        self.__must_run = True
+        self.queue = EventQueue(max_queue_size, overflow, spill_directory)
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
         self.__is_running = True
 
+        self.__nb_events = 0
+        self.__nb_batches = 0
+        self.__last_latency = 0.0
+        self.__max_latency = 0.0
+        self.__total_latency = 0.0
+
     def run(self):
-        while self.__must_run:
-            try:
-                event = self.queue.get(timeout=5)
-                self.domainEventPublished(event)
-            except Empty:
-                pass
+        while True:
+            events, enqueued_at = self.queue.get_batch(self.batch_size, self.batch_wait)
+            if len(events) == 0:
+                break
+
+            self.domainEventsPublished(events)
             self.post_publish()
+            self.__record_batch(events, enqueued_at)
         self.__is_running = False
 
+    def __record_batch(self, events, enqueued_at):
+        # The latency of a batch is the time its oldest event spent between the publisher and its handling
+        latency = time.monotonic() - enqueued_at
+        self.__nb_events += len(events)
+        self.__nb_batches += 1
+        self.__last_latency = latency
+        self.__max_latency = max(self.__max_latency, latency)
+        self.__total_latency += latency
+
+    def publish(self, events):
+        """
+        Queue events for the thread, called by ApplicationDomainEventPublisher
+        """
+        self.queue.put(events)
+
     def terminate(self):
-        self.__must_run = False
+        """
+        Stop the thread once the events already queued are handled
+        """
+        self.queue.close()
 
     def post_publish(self):
         pass
@@ -39,10 +93,193 @@ class AsyncDomainEventListener(Thread, metaclass=abc.ABCMeta):
     def is_running(self):
         return self.__is_running
 
+    def stats(self):
+        stats = self.queue.stats()
+        stats.update({
+            "events": self.__nb_events,
+            "batches": self.__nb_batches,
+            "last_latency": self.__last_latency,
+            "max_latency": self.__max_latency,
+            "mean_latency": self.__total_latency / self.__nb_batches if self.__nb_batches > 0 else 0.0,
+        })
+        return stats
+
+    @abc.abstractmethod
+    def domainEventPublished(self, event):
+        raise NotImplementedError()
+
+    def domainEventsPublished(self, events):
+        """
+        Receive the events saved together, in order. Override it to handle them as a batch.
+        """
+        for event in events:
+            self.domainEventPublished(event)
+
+
+class ProcessPoolDomainEventListener(metaclass=abc.ABCMeta):
+    """
+    Listener whose handlers run in nb_workers processes, so that CPU bound listeners use several cores
+
+    The events are partitioned by a hash of their object_id: the events of an object are all handled by
+    the same worker, in order. Each worker reads a queue of at most max_queue_size batches; when it is
+    full, the publisher blocks until the worker catches up.
+
+    The handlers run on a copy of the listener in each worker, so they can not update the listener of the
+    publishing process. Attributes that can not be sent to a worker must be left out by __getstate__.
+    """
+
+    def __init__(self, nb_workers=None, max_queue_size=100):
+        nb_workers = nb_workers if nb_workers is not None else (os.cpu_count() or 1)
+        assert nb_workers > 0
+        assert max_queue_size > 0
+
+        self.nb_workers = nb_workers
+        self.max_queue_size = max_queue_size
+        self.__queues = list()
+        self.__processes = list()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_ProcessPoolDomainEventListener__queues"] = list()
+        state["_ProcessPoolDomainEventListener__processes"] = list()
+        return state
+
+    def start(self):
+        """
+        Start the worker processes
+        """
+        assert len(self.__processes) == 0
+
+        for index in range(self.nb_workers):
+            queue = multiprocessing.Queue(self.max_queue_size)
+            process = multiprocessing.Process(
+                target=_run_worker, args=(self, queue), name="{}-{}".format(type(self).__name__, index),
+                daemon=True)
+            self.__queues.append(queue)
+            self.__processes.append(process)
+            process.start()
+
+    def publish(self, events):
+        """
+        Send the events to the workers of their objects, called by ApplicationDomainEventPublisher
+
+        :raise RuntimeError: if the workers are not started
+        """
+        if len(self.__queues) == 0:
+            raise RuntimeError("The workers of the listener are not started")
+
+        partitions = dict()
+        for event in events:
+            partition = zlib.crc32(event["object_id"].encode("utf-8")) % self.nb_workers
+            partitions.setdefault(partition, list()).append(event)
+
+        for partition, partition_events in partitions.items():
+            self.__queues[partition].put(partition_events)
+
+    def terminate(self, timeout=None):
+        """
+        Stop the workers once they have handled the events already sent, and wait for them
+
+        :param timeout: the time to wait for each worker before killing it, None to wait until it stops
+        """
+        for queue, process in zip(self.__queues, self.__processes):
+            # A dead worker no longer empties its queue, waiting for room there would block forever
+            while process.is_alive():
+                try:
+                    queue.put(None, timeout=0.1)
+                    break
+                except Full:
+                    pass
+
+        for process in self.__processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+        for queue, process in zip(self.__queues, self.__processes):
+            queue.close()
+            if process.exitcode != 0:
+                # What is left in the queue of a dead worker is never read, it must not be waited for
+                queue.cancel_join_thread()
+            queue.join_thread()
+
+        self.__queues = list()
+        self.__processes = list()
+
+    def is_running(self):
+        return any(process.is_alive() for process in self.__processes)
+
+    def post_publish(self):
+        """
+        Called in the worker after each batch
+        """
+        pass
+
+    def handle_error(self, events, error):
+        """
+        Called in the worker when handling a batch failed. The worker goes on with the next batch.
+        """
+        logging.getLogger(__name__).error(
+            "%s failed to handle %d events", type(self).__name__, len(events), exc_info=error)
+
     @abc.abstractmethod
     def domainEventPublished(self, event):
         raise NotImplementedError()
 
+    def domainEventsPublished(self, events):
+        """
+        Receive, in a worker, events of the objects of its partition, in order. Override it to handle them
+        as a batch.
+        """
+        for event in events:
+            self.domainEventPublished(event)
+
+
+def _run_worker(listener, queue):
+    while True:
+        events = queue.get()
+        if events is None:
+            break
+
+        try:
+            listener.domainEventsPublished(events)
+            listener.post_publish()
+        except Exception as e:
+            listener.handle_error(events, e)
+
+
+class AsyncioDomainEventListener(metaclass=abc.ABCMeta):
+    """
+    Listener run on the asyncio event loop of the publisher
+
+    It is only notified by the async repositories, through ApplicationDomainEventPublisher.domainEventsPublishedAsync
+    """
+
+    @abc.abstractmethod
+    async def domainEventPublished(self, event):
+        raise NotImplementedError()
+
+    async def domainEventsPublished(self, events):
+        """
+        Receive the events saved together, in order. Override it to handle them as a batch.
+        """
+        for event in events:
+            await self.domainEventPublished(event)
+
+
+class ListenerDispatchError(Exception):
+    """
+    Raised when listeners dispatched in parallel failed, once all of them have been called
+
+    errors holds a (listener, exception) pair for each failure.
+    """
+
+    def __init__(self, errors):
+        super().__init__("{} listener(s) failed: {}".format(
+            len(errors), ", ".join(repr(error) for _, error in errors)))
+        self.errors = errors
+
 
 class ApplicationDomainEventPublisher:
 
@@ -50,45 +287,155 @@ class ApplicationDomainEventPublisher:
 
         def __init__(self):
             self.__sync_listeners = list()
+            self.__sync_groups = list()
             self.__async_listeners = list()
+            self.__asyncio_listeners = list()
+            self.__executor = None
+            self.__dispatching = threading.local()
+
+        def enable_parallel_dispatch(self, max_workers=None):
+            """
+            Run the synchronous listeners of a same order concurrently, on a thread pool shared by every
+            publication. Their errors are then raised together as a ListenerDispatchError.
+
+            :param max_workers: the size of the thread pool, see ThreadPoolExecutor
+            """
+            self.disable_parallel_dispatch()
+            self.__executor = ThreadPoolExecutor(max_workers, thread_name_prefix="domain-event-listener")
+
+        def disable_parallel_dispatch(self):
+            """
+            Go back to calling the synchronous listeners one after another, in the caller thread
+            """
+            executor, self.__executor = self.__executor, None
+            if executor is not None:
+                executor.shutdown(wait=True)
 
         def domainEventPublished(self, event):
+            self.domainEventsPublished([event])
+
+        def domainEventsPublished(self, events):
+            events = list(events)
+            if len(events) == 0:
+                return
+
+            # A single queue item per batch, rather than one per event
             for listener in self.__async_listeners:
-                listener.put(event)
+                listener.publish(events)
+
+            # A listener that publishes from a pool thread is dispatched inline, so that it does not
+            # wait for a pool it may be exhausting
+            if self.__executor is None or getattr(self.__dispatching, "active", False):
+                for group in self.__sync_groups:
+                    for listener in group:
+                        listener.domainEventsPublished(events)
+            else:
+                self.__dispatch_in_parallel(events)
+
+        def __dispatch_in_parallel(self, events):
+            errors = list()
+            for group in self.__sync_groups:
+                futures = [
+                    (listener, self.__executor.submit(self.__dispatch_to, listener, events))
+                    for listener in group[1:]]
 
-            for listener in self.__sync_listeners:
-                assert isinstance(listener, DomainEventListener)
-                listener.domainEventPublished(event)
+                # The first listener of the group runs in the caller thread while the others run in the pool
+                try:
+                    listener = group[0]
+                    self.__dispatch_to(listener, events)
+                except Exception as e:
+                    errors.append((listener, e))
 
-        def register_listener(self, obj):
+                for listener, future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        errors.append((listener, e))
+
+            if len(errors) > 0:
+                raise ListenerDispatchError(errors)
+
+        def __dispatch_to(self, listener, events):
+            was_dispatching = getattr(self.__dispatching, "active", False)
+            self.__dispatching.active = True
+            try:
+                listener.domainEventsPublished(events)
+            finally:
+                self.__dispatching.active = was_dispatching
+
+        async def domainEventsPublishedAsync(self, events):
+            """
+            Publish events saved by an async repository: the synchronous listeners, the queues of the
+            threaded listeners included, run on a thread of the default executor so that they do not block the
+            event loop, then the asyncio listeners are awaited
+            """
+            events = list(events)
+            if len(events) == 0:
+                return
+
+            if len(self.__sync_groups) > 0 or len(self.__async_listeners) > 0:
+                await asyncio.get_running_loop().run_in_executor(None, self.domainEventsPublished, events)
+
+            # Each asyncio listener receives the events in order, listeners run concurrently
+            await asyncio.gather(*[
+                listener.domainEventsPublished(events) for listener in self.__asyncio_listeners])
+
+        def register_listener(self, obj, order=0):
+            """
+            :param order: synchronous listeners are called by increasing order. With parallel dispatch, the
+            listeners of a same order run concurrently, after the ones of lower orders have finished.
+            """
             assert obj is not None
             assert isinstance(obj, DomainEventListener) or\
-                   isinstance(obj, AsyncDomainEventListener)
+                   isinstance(obj, AsyncDomainEventListener) or \
+                   isinstance(obj, AsyncioDomainEventListener) or \
+                   isinstance(obj, ProcessPoolDomainEventListener)
 
             if isinstance(obj, DomainEventListener):
-                self.__sync_listeners.append(obj)
+                self.__sync_listeners.append((order, obj))
+                self.__update_sync_groups()
+            elif isinstance(obj, AsyncioDomainEventListener):
+                self.__asyncio_listeners.append(obj)
             else:
-                self.__async_listeners.append(obj.queue)
+                self.__async_listeners.append(obj)
 
         def unregister_listener(self, listener):
             assert listener is not None
             assert isinstance(listener, DomainEventListener) or \
-                   isinstance(listener, AsyncDomainEventListener)
+                   isinstance(listener, AsyncDomainEventListener) or \
+                   isinstance(listener, AsyncioDomainEventListener) or \
+                   isinstance(listener, ProcessPoolDomainEventListener)
 
             if isinstance(listener, DomainEventListener):
-                self.__sync_listeners.remove(listener)
+                index = [registered for _, registered in self.__sync_listeners].index(listener)
+                del self.__sync_listeners[index]
+                self.__update_sync_groups()
+            elif isinstance(listener, AsyncioDomainEventListener):
+                self.__asyncio_listeners.remove(listener)
             else:
-                self.__async_listeners.remove(listener.queue)
+                self.__async_listeners.remove(listener)
 
         def contains_listener(self, listener):
             assert listener is not None
             assert isinstance(listener, DomainEventListener) or \
-                   isinstance(listener, AsyncDomainEventListener)
+                   isinstance(listener, AsyncDomainEventListener) or \
+                   isinstance(listener, AsyncioDomainEventListener) or \
+                   isinstance(listener, ProcessPoolDomainEventListener)
 
             if isinstance(listener, DomainEventListener):
-                return listener in self.__sync_listeners
+                return any(registered == listener for _, registered in self.__sync_listeners)
+            elif isinstance(listener, AsyncioDomainEventListener):
+                return listener in self.__asyncio_listeners
             else:
-                return listener.queue in self.__async_listeners
+                return listener in self.__async_listeners
+
+        def __update_sync_groups(self):
+            # Sorting is stable: listeners of a same order keep their registration order
+            groups = list()
+            for order, listeners in itertools.groupby(
+                    sorted(self.__sync_listeners, key=lambda x: x[0]), key=lambda x: x[0]):
+                groups.append([listener for _, listener in listeners])
+            self.__sync_groups = groups
 
     instance = None
 
@@ -2,11 +2,55 @@
 This package is aimed to manage a DDD domain object with event sourcing
 
 """
-from collections import Iterable
-from multiprocessing import Lock
+from collections.abc import Iterable
+from threading import Lock
 import datetime
+import inspect
+from types import FunctionType
 import uuid
 import json
+from .EventRecord import EventRecord, freeze, is_frozen
+
+# How DomainObject.mutate checks that events are JSON serializable
+JSON_VALIDATION = "json"
+CACHED_JSON_VALIDATION = "cached_json"
+STRUCTURAL_VALIDATION = "structural"
+NO_VALIDATION = "none"
+
+
+class NoLock:
+    """
+    A lock that does not lock, for domain objects only used by one thread at a time
+    """
+
+    __slots__ = ()
+
+    def acquire(self, blocking=True, timeout=-1):
+        return True
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        return True
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+def handles(*event_names):
+    """
+    Declare a method of a DomainObject subclass as the handler of the given events, whatever its name
+
+    :param event_names: the names of the events the method applies
+    """
+    assert len(event_names) > 0
+
+    def decorator(function):
+        function.handled_events = getattr(function, "handled_events", ()) + event_names
+        return function
+
+    return decorator
 
 
 class DomainObject:
@@ -18,8 +62,59 @@ class DomainObject:
     - store events together with their version number
     - store its version
     - be rehydrated from its events
+
+    event_validation selects how events are checked to be JSON serializable:
+    - JSON_VALIDATION encodes them with json.dumps and throws the result away
+    - CACHED_JSON_VALIDATION encodes them and keeps the result in encoded_events, for the stores to reuse it.
+      The encoding is taken by mutate: a payload modified afterwards is stored as it was then by the MySQL
+      stores, so payloads must not be modified once applied, which freeze_events enforces.
+    - STRUCTURAL_VALIDATION only walks them to check they are made of JSON types
+    - NO_VALIDATION does not check them
+
+    Events are applied by handlers: the methods named on_<event name> and the methods decorated with
+    handles. They are looked up once per class, when it is created. An on_<event name> attribute set on an
+    instance is only used for the events its class has no handler for.
+
+    lock_factory builds the lock that guards the event stream of each object:
+    - threading.Lock, the default, for objects shared by several threads
+    - NoLock for objects only used by one thread, e.g. in batch jobs
+    The lock is not shared between processes.
+
+    uncommitted_events holds the events applied since the object was last saved or loaded, and
+    committed_version the version it was saved or loaded at. The repositories call mark_committed once the
+    events are stored. When retain_event_stream is False, event_stream only keeps the uncommitted events:
+    the loaded and committed ones are dropped, so that the memory used by long-lived objects is bounded.
+
+    When freeze_events is True, the payloads of the events are made immutable once applied, so that the
+    repositories hand them to the listeners without copying them. Event handlers must then not modify the
+    events they receive.
     """
 
+    event_validation = JSON_VALIDATION
+    freeze_events = False
+    lock_factory = Lock
+    retain_event_stream = True
+
+    __event_handlers = dict()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        # Walk the hierarchy from the base classes down so that subclasses override their parents
+        handler_names = dict()
+        for klass in reversed(cls.__mro__):
+            for name in vars(klass):
+                # Resolved on the class, so that classmethods and staticmethods count as callables
+                if name.startswith("on_") and callable(getattr(cls, name, None)):
+                    handler_names[name[3:]] = name
+            for name, attribute in vars(klass).items():
+                for event_name in getattr(attribute, "handled_events", ()):
+                    handler_names[event_name] = name
+
+        cls.__event_handlers = {
+            event_name: _handler(cls, name) for event_name, name in handler_names.items()
+        }
+
     def __init__(self):
         """
         Initialises this with it's first event that should be a kind of ObjectCreatedEvent
@@ -27,8 +122,11 @@ class DomainObject:
 
         self.object_id = "{}-{}".format(self.__class__.__name__, str(uuid.uuid4()))
         self.version_number = 0
+        self.committed_version = 0
         self.event_stream = list()
-        self.lock = Lock()
+        self.uncommitted_events = list()
+        self.encoded_events = dict()
+        self.lock = type(self).lock_factory()
         self.mutate("DomainObjectCreated", {"id": self.object_id})
 
     def mutate(self, event_name, event):
@@ -41,21 +139,36 @@ class DomainObject:
         """
         assert event_name is not None
         assert isinstance(event_name, str)
+        assert event is not None
 
-        if not self.__is_json_serializable(event):
-            raise ValueError("Event must be JSON serializable")
-
-        self.lock.acquire()
+        encoded_event = None
+        if self.event_validation == JSON_VALIDATION:
+            if not self.__is_json_serializable(event):
+                raise ValueError("Event must be JSON serializable")
+        elif self.event_validation == CACHED_JSON_VALIDATION:
+            try:
+                encoded_event = json.dumps(event)
+            except (TypeError, ValueError, RecursionError):
+                raise ValueError("Event must be JSON serializable")
+        elif self.event_validation == STRUCTURAL_VALIDATION:
+            if not self.__is_json_structure(event):
+                raise ValueError("Event must be JSON serializable")
 
-        self.version_number += 1
-        self.event_stream.append({
-            "object_id": self.object_id,
-            "version": self.version_number,
-            "event_name": event_name,
-            "event": event,
-            "event_timestamp": datetime.datetime.now().timestamp()})
+        if self.freeze_events:
+            event = freeze(event)
 
-        self.lock.release()
+        with self.lock:
+            self.version_number += 1
+            if encoded_event is not None:
+                self.encoded_events[self.version_number] = encoded_event
+            record = EventRecord(
+                self.object_id,
+                self.version_number,
+                event_name,
+                event,
+                datetime.datetime.now().timestamp())
+            self.event_stream.append(record)
+            self.uncommitted_events.append(record)
 
         self.__apply_event(event_name, event)
 
@@ -63,42 +176,186 @@ class DomainObject:
         """
         Rehydrate the object from it's event list
 
-        :param event_list: the list of events for rehydratation
+        :param event_list: the list of events for rehydratation. A list is sorted by version first,
+        any other iterable is consumed once and must already be sorted by version.
+        :raise ValueError: if the events are not sorted by version
+        """
+        assert isinstance(event_list, Iterable)
+
+        event_list = self.__sorted(event_list)
+
+        with self.lock:
+            self.__clear_stream()
+            self.__replay(event_list)
+            self.committed_version = self.version_number
+
+    def rehydrate_from_snapshot(self, snapshot, event_list):
+        """
+        Rehydrate the object from a snapshot and the events that followed it
+
+        :param snapshot: a snapshot as returned by take_snapshot
+        :param event_list: the events whose version is greater than the snapshot one, see rehydrate
+        """
+        assert snapshot is not None
+        assert isinstance(event_list, Iterable)
+
+        event_list = self.__sorted(event_list)
+
+        with self.lock:
+            self.__clear_stream()
+            self.object_id = snapshot["object_id"]
+            self.version_number = snapshot["version"]
+            self.restore_snapshot_state(snapshot["state"])
+            self.__replay(event_list)
+            self.committed_version = self.version_number
+
+    def replay(self, event_list):
+        """
+        Apply events that happened after the current version of the object, without clearing it first
+
+        :param event_list: the events whose version is greater than the current one, see rehydrate
         """
         assert isinstance(event_list, Iterable)
 
-        event_list.sort(key=lambda x: x["version"])
+        event_list = self.__sorted(event_list)
 
-        self.lock.acquire()
+        with self.lock:
+            last_version = self.__replay(event_list)
+            # The events applied before the replay and not saved yet stay uncommitted
+            if last_version is not None:
+                self.committed_version = max(self.committed_version, last_version)
 
-        self.__clear_stream()
+    def events_after(self, version):
+        """
+        Return the events of the stream whose version is greater than the given one
+
+        :param version: the last version already known
+        :return: the list of events, sorted by version
+        :raise ValueError: if the events after version are no longer held, see retain_event_stream
+        """
+        if version >= self.committed_version:
+            stream = self.uncommitted_events
+        elif self.retain_event_stream:
+            stream = self.event_stream
+        else:
+            raise ValueError("The events up to version {} are no longer held, got asked for version {}".format(
+                self.committed_version,
+                version))
+
+        # New events are at the tail of the stream: only walk them
+        index = len(stream)
+        while index > 0 and stream[index - 1]["version"] > version:
+            index -= 1
+
+        return stream[index:]
+
+    def mark_committed(self, version=None):
+        """
+        Record that the events up to version have been stored: they leave uncommitted_events, their cached
+        encodings are dropped and, unless retain_event_stream, they leave event_stream
+
+        :param version: the version of the last stored event, defaults to the current version
+        """
+        with self.lock:
+            version = self.version_number if version is None else version
+            self.committed_version = max(self.committed_version, version)
+
+            del self.uncommitted_events[:_count_up_to(self.uncommitted_events, version)]
+            if not self.retain_event_stream:
+                del self.event_stream[:_count_up_to(self.event_stream, version)]
+            self.__forget_encoded_events(version)
+
+    def forget_encoded_events(self, version):
+        """
+        Drop the cached encodings of the events up to version, once they have been persisted
+        """
+        with self.lock:
+            self.__forget_encoded_events(version)
+
+    def __forget_encoded_events(self, version):
+        for encoded_version in list(self.encoded_events):
+            if encoded_version > version:
+                break
+            del self.encoded_events[encoded_version]
+
+    def take_snapshot(self):
+        """
+        Capture the current state of the object
+
+        :return: a dict holding the object_id, the version, the state and the snapshot timestamp
+        """
+        return {
+            "object_id": self.object_id,
+            "version": self.version_number,
+            "state": self.snapshot_state(),
+            "snapshot_timestamp": datetime.datetime.now().timestamp()}
+
+    def snapshot_state(self):
+        """
+        Return the state of the object. Subclasses that want to be snapshotted must override it.
+
+        :return: the state of the object. That object must be JSON serializable.
+        """
+        raise NotImplementedError()
+
+    def restore_snapshot_state(self, state):
+        """
+        Restore the state returned by snapshot_state. Subclasses that want to be snapshotted must override it.
+
+        :param state: the state to restore
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    def __sorted(event_list):
+        if isinstance(event_list, list):
+            event_list.sort(key=lambda x: x["version"])
+        return event_list
+
+    def __replay(self, event_list):
+        previous_version = None
         for event in event_list:
-            if event["version"] < self.version_number:
+            # Records are immutable, so the stream shares them instead of copying them
+            event = EventRecord.from_mapping(event)
+            if self.freeze_events and not is_frozen(event.event):
+                event = EventRecord(
+                    event.object_id, event.version, event.event_name, freeze(event.event), event.event_timestamp,
+                    event.position)
+            if event.version < self.version_number:
                 raise ValueError("Rehydrated version number is {} but actual version number is {}".format(
                     event["version"],
                     self.version_number))
+            if previous_version is not None and event["version"] <= previous_version:
+                raise ValueError("Rehydrated events must be sorted by version, got {} after {}".format(
+                    event["version"],
+                    previous_version))
+            previous_version = event["version"]
 
-            self.__apply_event(event["event_name"], event["event"])
+            self.__apply_event(event.event_name, event.event)
 
             self.version_number += 1
-            self.object_id = event["object_id"]
-            self.event_stream.append({
-                "object_id": self.object_id,
-                "version": event["version"],
-                "event_name": event["event_name"],
-                "event": event["event"],
-                "event_timestamp": event["event_timestamp"]})
+            self.object_id = event.object_id
+            if self.retain_event_stream:
+                self.event_stream.append(event)
 
-        self.lock.release()
+        return previous_version
 
     def __clear_stream(self):
         self.event_stream = list()
+        self.uncommitted_events = list()
+        self.encoded_events = dict()
         self.version_number = 0
 
     def __apply_event(self, event_name, event):
-        function_name = "on_{}".format(event_name)
-        if function_name in self.__dir__():
-            getattr(self, function_name)(event)
+        handler = self.__event_handlers.get(event_name)
+        if handler is not None:
+            handler(self, event)
+            return
+
+        # Handlers set on the instance are not in the table of the class
+        handler = self.__dict__.get("on_" + event_name)
+        if handler is not None:
+            handler(event)
 
     @staticmethod
     def __is_json_serializable(event):
@@ -109,4 +366,49 @@ class DomainObject:
         except:
             return False
 
+    @staticmethod
+    def __is_json_structure(event):
+        try:
+            return _is_json_value(event)
+        except RecursionError:
+            return False
+
+
+def _count_up_to(events, version):
+    # The events are sorted by version, the committed ones are at the head
+    count = 0
+    while count < len(events) and events[count]["version"] <= version:
+        count += 1
+    return count
+
+
+def _handler(cls, name):
+    # Plain methods are called directly, anything else (staticmethod, callable object...) is
+    # resolved on the instance as getattr would do
+    function = inspect.getattr_static(cls, name)
+    if isinstance(function, FunctionType):
+        return function
+    return lambda obj, event: getattr(obj, name)(event)
+
+
+_JSON_SCALARS = (str, int, float, bool, type(None))
+
+
+def _is_json_value(value):
+    # Exact type checks first: they are much cheaper than isinstance on the common types
+    value_type = type(value)
+    if value_type is str or value_type is int or value_type is float or value_type is bool or value is None:
+        return True
+    if value_type is dict or isinstance(value, dict):
+        for key, item in value.items():
+            if not isinstance(key, _JSON_SCALARS) or not _is_json_value(item):
+                return False
+        return True
+    if value_type is list or isinstance(value, (list, tuple)):
+        for item in value:
+            if not _is_json_value(item):
+                return False
+        return True
+    return isinstance(value, _JSON_SCALARS)
+
 
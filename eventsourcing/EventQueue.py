@@ -0,0 +1,180 @@
+"""
+In-process queue of published events, drained in batches by the listener threads
+
+"""
+from collections import deque
+from threading import Condition
+import pickle
+import tempfile
+import time
+
+# What EventQueue.put does when the queue holds max_size events
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+SPILL_TO_DISK = "spill_to_disk"
+
+
+class EventQueue:
+    """
+    A thread-safe FIFO of events, for a producer and a consumer living in the same process
+
+    Unlike multiprocessing.Queue, events are neither pickled nor sent through a pipe: the consumer
+    receives the very objects that were put.
+
+    When max_size is given, at most max_size events are kept in memory and overflow selects what happens
+    to the others:
+    - BLOCK makes put wait for the consumer to make room
+    - DROP_OLDEST drops the events at the head of the queue
+    - SPILL_TO_DISK pickles them to a temporary file in spill_directory, they are read back in order when
+      the consumer catches up
+    """
+
+    def __init__(self, max_size=None, overflow=BLOCK, spill_directory=None):
+        assert max_size is None or max_size > 0
+        assert overflow in (BLOCK, DROP_OLDEST, SPILL_TO_DISK)
+
+        self.max_size = max_size
+        self.overflow = overflow
+        self.spill_directory = spill_directory
+
+        self.__items = deque()
+        self.__condition = Condition()
+        self.__closed = False
+
+        self.__spill_file = None
+        self.__spilled = 0
+        self.__spill_read_position = 0
+
+        self.dropped = 0
+        self.high_water_mark = 0
+
+    def put(self, events):
+        """
+        Append events at the end of the queue
+
+        With the BLOCK overflow, waits until the consumer made room for all of them.
+
+        :param events: the events saved together, in order
+        :return: False if the queue is closed and the events were dropped
+        """
+        enqueued_at = time.monotonic()
+        with self.__condition:
+            if self.__closed:
+                return False
+
+            if self.max_size is None:
+                self.__items.extend((enqueued_at, event) for event in events)
+            elif self.overflow == BLOCK:
+                for event in events:
+                    while len(self.__items) >= self.max_size and not self.__closed:
+                        self.__condition.notify_all()
+                        self.__condition.wait()
+                    if self.__closed:
+                        return False
+                    self.__items.append((enqueued_at, event))
+            elif self.overflow == DROP_OLDEST:
+                self.__items.extend((enqueued_at, event) for event in events)
+                while len(self.__items) > self.max_size:
+                    self.__items.popleft()
+                    self.dropped += 1
+            else:
+                for event in events:
+                    # Once events are spilled, the following ones must be spilled too to keep the order
+                    if self.__spilled > 0 or len(self.__items) >= self.max_size:
+                        self.__spill((enqueued_at, event))
+                    else:
+                        self.__items.append((enqueued_at, event))
+
+            self.high_water_mark = max(self.high_water_mark, len(self))
+            self.__condition.notify_all()
+            return True
+
+    def get_batch(self, max_events, max_wait=0.0):
+        """
+        Wait for events and remove up to max_events of them from the head of the queue
+
+        Once an event is available, up to max_wait seconds are spent waiting for the batch to fill.
+
+        :return: the events and the time the oldest of them was put, as given by time.monotonic. The list
+        is only empty once the queue is closed and drained.
+        """
+        assert max_events > 0
+
+        with self.__condition:
+            while len(self) == 0 and not self.__closed:
+                self.__condition.wait()
+
+            if max_wait > 0:
+                deadline = time.monotonic() + max_wait
+                while len(self) < max_events and not self.__closed and not self.__is_full():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.__condition.wait(remaining)
+
+            self.__unspill()
+            if len(self.__items) == 0:
+                if self.__spill_file is not None:
+                    self.__spill_file.close()
+                    self.__spill_file = None
+                return [], None
+
+            enqueued_at = self.__items[0][0]
+            events = [self.__items.popleft()[1] for _ in range(min(max_events, len(self.__items)))]
+            self.__unspill()
+
+            # Wake the producers blocked on a full queue
+            self.__condition.notify_all()
+
+        return events, enqueued_at
+
+    def __is_full(self):
+        return self.max_size is not None and len(self.__items) >= self.max_size
+
+    def __spill(self, item):
+        if self.__spill_file is None:
+            self.__spill_file = tempfile.TemporaryFile(dir=self.spill_directory)
+
+        self.__spill_file.seek(0, 2)
+        pickle.dump(item, self.__spill_file, pickle.HIGHEST_PROTOCOL)
+        self.__spilled += 1
+
+    def __unspill(self):
+        if self.__spilled == 0:
+            return
+
+        self.__spill_file.seek(self.__spill_read_position)
+        while self.__spilled > 0 and len(self.__items) < self.max_size:
+            self.__items.append(pickle.load(self.__spill_file))
+            self.__spilled -= 1
+        self.__spill_read_position = self.__spill_file.tell()
+
+        if self.__spilled == 0:
+            # Everything has been read back, the file can be reused from its start
+            self.__spill_file.seek(0)
+            self.__spill_file.truncate()
+            self.__spill_read_position = 0
+
+    def close(self):
+        """
+        Refuse new events and wake the consumer up: it drains the queue, then get_batch returns no event
+        """
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+    @property
+    def closed(self):
+        return self.__closed
+
+    def stats(self):
+        with self.__condition:
+            return {
+                "depth": len(self),
+                "spilled": self.__spilled,
+                "dropped": self.dropped,
+                "high_water_mark": self.high_water_mark,
+            }
+
+    def __len__(self):
+        return len(self.__items) + self.__spilled
@@ -0,0 +1,194 @@
+"""
+Compact and immutable record of an event of a domain object
+
+"""
+from collections.abc import Mapping
+from copy import deepcopy
+import sys
+
+# The keys of the mapping, position is kept apart as it is only known once the event is stored
+_KEYS = ("object_id", "version", "event_name", "event", "event_timestamp")
+
+
+class EventRecord(Mapping):
+    """
+    An event of a domain object, as stored in its stream and in the repositories
+
+    It is read-only and keeps its fields in slots instead of a per-event dict; object_id and event_name
+    are interned so that the records of a stream share them. It is a Mapping, so that it can be used as
+    the dict it replaces: event["version"], event.get("event"), dict(event) and comparison with a dict
+    all work.
+
+    position is the place of the event in the whole store, assigned by the repository that stored it and
+    None before. It is an attribute only: it is not one of the keys of the mapping and records that only
+    differ by their position are equal.
+    """
+
+    __slots__ = _KEYS + ("position",)
+
+    def __init__(self, object_id, version, event_name, event, event_timestamp, position=None):
+        set_field = object.__setattr__
+        set_field(self, "object_id", sys.intern(object_id))
+        set_field(self, "version", version)
+        set_field(self, "event_name", sys.intern(event_name))
+        set_field(self, "event", event)
+        set_field(self, "event_timestamp", event_timestamp)
+        set_field(self, "position", position)
+
+    @classmethod
+    def from_mapping(cls, event):
+        """
+        Build a record from a dict holding the fields of an event, or return it if it already is a record
+        """
+        if type(event) is cls:
+            return event
+
+        return cls(
+            event["object_id"],
+            event["version"],
+            event["event_name"],
+            event["event"],
+            event["event_timestamp"],
+            event.get("position"))
+
+    def with_position(self, position):
+        """
+        Return a copy of the record placed at position in the store, sharing its payload
+        """
+        return EventRecord(
+            self.object_id, self.version, self.event_name, self.event, self.event_timestamp, position)
+
+    def to_dict(self):
+        """
+        Return the fields as a new dict, with the position once it is known
+        """
+        fields = {
+            "object_id": self.object_id,
+            "version": self.version,
+            "event_name": self.event_name,
+            "event": self.event,
+            "event_timestamp": self.event_timestamp}
+        if self.position is not None:
+            fields["position"] = self.position
+        return fields
+
+    def __getitem__(self, key):
+        try:
+            return _FIELDS[key].__get__(self)
+        except (KeyError, TypeError):
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter(_KEYS)
+
+    def __len__(self):
+        return len(_KEYS)
+
+    def __contains__(self, key):
+        return key in _FIELDS
+
+    def __eq__(self, other):
+        if type(other) is EventRecord:
+            return (self.object_id == other.object_id and
+                    self.version == other.version and
+                    self.event_name == other.event_name and
+                    self.event == other.event and
+                    self.event_timestamp == other.event_timestamp)
+        return Mapping.__eq__(self, other)
+
+    __hash__ = None
+
+    def __setattr__(self, name, value):
+        raise AttributeError("EventRecord is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("EventRecord is immutable")
+
+    def __reduce__(self):
+        return (EventRecord, (
+            self.object_id, self.version, self.event_name, self.event, self.event_timestamp, self.position))
+
+    def __repr__(self):
+        return "EventRecord({!r}, {!r}, {!r}, {!r}, {!r}, position={!r})".format(
+            self.object_id, self.version, self.event_name, self.event, self.event_timestamp, self.position)
+
+
+_FIELDS = {name: getattr(EventRecord, name) for name in _KEYS}
+
+
+def _immutable(*args, **kwargs):
+    raise TypeError("Frozen event payloads can not be modified")
+
+
+class FrozenDict(dict):
+    """
+    A dict that can not be modified once built. It still is a dict for json, pymongo and comparisons.
+    """
+
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+class FrozenList(list):
+    """
+    A list that can not be modified once built. It still is a list for json, pymongo and comparisons.
+    """
+
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = extend = insert = pop = remove = reverse = sort = clear = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (FrozenList, (list(self),))
+
+
+_SCALARS = (str, int, float, bool, type(None))
+
+
+def freeze(value):
+    """
+    Return a deeply immutable equivalent of a JSON-like value: dicts become FrozenDict, lists and tuples
+    become FrozenList
+    """
+    value_type = type(value)
+    if value_type is FrozenDict or value_type is FrozenList or isinstance(value, _SCALARS):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return FrozenList(freeze(item) for item in value)
+    return value
+
+
+def is_frozen(value):
+    """
+    Tell if a value can be shared without being copied: a scalar, or a value returned by freeze
+    """
+    value_type = type(value)
+    return value_type is FrozenDict or value_type is FrozenList or isinstance(value, _SCALARS)
+
+
+def copy_for_listeners(events):
+    """
+    Return events that can be handed to listeners: the records whose payload is frozen are shared,
+    the others are deep-copied so that a listener can not alter the stored events
+    """
+    return [event if is_frozen(event.event) else deepcopy(event) for event in events]
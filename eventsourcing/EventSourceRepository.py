@@ -1,54 +1,262 @@
 import abc
-from collections import Iterable
-from copy import deepcopy
+from collections.abc import Iterable
+import itertools
+from threading import Lock
 from .DomainEventListener import DomainEventListener, ApplicationDomainEventPublisher
 from .DomainObject import DomainObject
-from pymongo import MongoClient
+from .EventRecord import EventRecord, copy_for_listeners
+from .MySQLConnectionPool import MySQLConnectionPool
+from .Snapshot import SnapshotStore, SnapshotPolicy
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 import pymysql.cursors
 import json
 
 
+class ConcurrencyError(Exception):
+    """
+    Raised when the stream of an object is not at the version expected by an append
+
+    When several streams are appended to at once, object_id and expected_version are None if the store
+    can not tell which stream conflicted, and saved_events holds the events a store that can not roll
+    back had already written.
+    """
+
+    def __init__(self, object_id, expected_version, saved_events=None):
+        if object_id is None:
+            message = "One of the streams is not at its expected version"
+        else:
+            message = "Stream of {} is not at expected version {}".format(
+                object_id, expected_version
+            )
+        super().__init__(message)
+        self.object_id = object_id
+        self.expected_version = expected_version
+        self.saved_events = saved_events if saved_events is not None else list()
+
+
 class Repository(metaclass=abc.ABCMeta):
+    stream_batch_size = 1000
+
     @abc.abstractmethod
     def load(self, object_id):
         raise NotImplementedError()
 
+    def load_many(self, object_ids):
+        """
+        Load many objects at once
+
+        :return: a dict giving the loaded object of each object_id, the unknown ones are left out
+        """
+        objs = dict()
+        for object_id in object_ids:
+            obj = self.load(object_id)
+            if obj.version_number > 0 and obj.object_id == object_id:
+                objs[object_id] = obj
+        return objs
+
     @abc.abstractmethod
     def exists(self, object_id):
         raise NotImplementedError()
 
     @abc.abstractmethod
-    def save(self, obj):
+    def save(self, obj, expected_version=None):
         raise NotImplementedError()
 
     @abc.abstractmethod
-    def get_event_stream_for(self, object_id):
+    def get_event_stream_for(self, object_id, after_version=0):
         raise NotImplementedError()
 
+    def get_event_streams_for(self, after_versions):
+        """
+        Fetch the streams of many objects at once
+
+        :param after_versions: a dict giving, for each object_id, the version after which events are fetched
+        :return: a dict giving the list of events of each object_id, sorted by version. Objects without
+        events are left out.
+        """
+        streams = dict()
+        for object_id, after_version in after_versions.items():
+            stream = self.get_event_stream_for(object_id, after_version)
+            if len(stream) > 0:
+                stream.sort(key=lambda x: x["version"])
+                streams[object_id] = stream
+        return streams
+
+    def iter_event_stream_for(self, object_id, after_version=0, batch_size=None):
+        """
+        Iterate over the events of an object, sorted by version
+
+        Implementations fetch the events by batches of batch_size (stream_batch_size by default) so that
+        the whole stream is never held in memory.
+        """
+        stream = self.get_event_stream_for(object_id, after_version)
+        stream.sort(key=lambda x: x["version"])
+        return iter(stream)
+
     @abc.abstractmethod
     def max_version_for_object(self, object_id):
         raise NotImplementedError()
 
+    def max_versions_for_objects(self, object_ids):
+        """
+        Return a dict giving the max version of each object, objects without events are left out
+        """
+        versions = dict()
+        for object_id in object_ids:
+            version = self.max_version_for_object(object_id)
+            if version > 0:
+                versions[object_id] = version
+        return versions
+
+    @abc.abstractmethod
+    def read_all(self, from_position=0, batch_size=None):
+        """
+        Iterate over the events of every object of the store, sorted by position
+
+        Implementations fetch the events by batches of batch_size (stream_batch_size by default).
+
+        :param from_position: the position of the last event already read, 0 to read from the start
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def last_position(self):
+        """
+        Return the position of the last stored event, 0 if the store is empty
+        """
+        raise NotImplementedError()
+
     @abc.abstractmethod
     def create_blank_domain_object(self):
         raise NotImplementedError()
 
 
 class EventPublisherRepository(Repository, metaclass=abc.ABCMeta):
-    def __init__(self):
+    def __init__(self, snapshot_store=None, snapshot_policy=None):
+        assert snapshot_store is None or isinstance(snapshot_store, SnapshotStore)
+        assert snapshot_policy is None or isinstance(snapshot_policy, SnapshotPolicy)
+        assert snapshot_policy is None or snapshot_store is not None
+
         self.listeners = list()
+        self.snapshot_store = snapshot_store
+        self.snapshot_policy = snapshot_policy
         self.register_listener(ApplicationDomainEventPublisher().instance)
 
-    def save(self, obj):
-        to_emit = self.append_to_stream(obj)
+    def load(self, object_id):
+        obj = self.create_blank_domain_object()
+        assert isinstance(obj, DomainObject)
+
+        snapshot = None
+        if self.snapshot_store is not None:
+            snapshot = self.snapshot_store.get_latest_snapshot(object_id)
+
+        if snapshot is None:
+            stream = self.iter_event_stream_for(object_id)
+            obj.rehydrate(stream)
+        else:
+            stream = self.iter_event_stream_for(object_id, snapshot["version"])
+            obj.rehydrate_from_snapshot(snapshot, stream)
+
+        return obj
+
+    def load_many(self, object_ids):
+        object_ids = list(object_ids)
+
+        snapshots = dict()
+        if self.snapshot_store is not None:
+            snapshots = self.snapshot_store.get_latest_snapshots(object_ids)
+
+        streams = self.get_event_streams_for(
+            {
+                object_id: snapshots[object_id]["version"] if object_id in snapshots else 0
+                for object_id in object_ids
+            }
+        )
+
+        objs = dict()
+        for object_id in object_ids:
+            if object_id not in snapshots and object_id not in streams:
+                continue
+
+            obj = self.create_blank_domain_object()
+            assert isinstance(obj, DomainObject)
+
+            if object_id in snapshots:
+                obj.rehydrate_from_snapshot(snapshots[object_id], streams.get(object_id, []))
+            else:
+                obj.rehydrate(streams[object_id])
+            objs[object_id] = obj
+
+        return objs
+
+    def save(self, obj, expected_version=None):
+        """
+        Append the new events of obj to its stream and publish them
+
+        :param obj: the domain object to save
+        :param expected_version: the version the stream must be at, None to append whatever the
+        stored version is
+        :raise ConcurrencyError: if the stream is not at the expected version
+        """
+        to_emit = self.append_to_stream(obj, expected_version)
 
         assert to_emit is not None
         assert isinstance(to_emit, Iterable)
 
-        for event in to_emit:
-            for listener in self.listeners:
-                assert isinstance(listener, DomainEventListener)
-                listener.domainEventPublished(event)
+        if len(to_emit) > 0:
+            obj.mark_committed(to_emit[-1]["version"])
+        # The events are stored, so they are published even if the snapshot fails
+        self.__publish(to_emit)
+        self.__snapshot_if_needed(obj, to_emit)
+
+    def save_all(self, objs, expected_versions=None):
+        """
+        Append the new events of many objects in a single write, then publish them
+
+        :param objs: the domain objects to save
+        :param expected_versions: a dict giving the version the stream of an object_id must be at.
+        The objects that are not in it are appended whatever their stored version is.
+        :raise ConcurrencyError: if one of the streams is not at its expected version
+        """
+        objs = list(objs)
+        assert len(set(obj.object_id for obj in objs)) == len(objs)
+
+        try:
+            new_events = self.append_to_streams(objs, expected_versions or dict())
+        except ConcurrencyError as e:
+            # What a store could not roll back has been saved, so it must still be published
+            self.__publish(e.saved_events)
+            raise e
+
+        to_emit = list()
+        for obj in objs:
+            if len(new_events[obj.object_id]) > 0:
+                obj.mark_committed(new_events[obj.object_id][-1]["version"])
+            to_emit.extend(new_events[obj.object_id])
+
+        self.__publish(to_emit)
+        for obj in objs:
+            self.__snapshot_if_needed(obj, new_events[obj.object_id])
+
+    def unit_of_work(self):
+        return UnitOfWork(self)
+
+    def __snapshot_if_needed(self, obj, new_events):
+        if self.snapshot_policy is not None and self.snapshot_policy.should_snapshot(
+            obj, new_events, self.snapshot_store
+        ):
+            snapshot = obj.take_snapshot()
+            self.snapshot_store.save_snapshot(snapshot)
+            self.snapshot_policy.snapshot_taken(snapshot)
+
+    def __publish(self, events):
+        if len(events) == 0:
+            return
+
+        for listener in self.listeners:
+            assert isinstance(listener, DomainEventListener)
+            listener.domainEventsPublished(events)
 
     def register_listener(self, listener):
         assert listener is not None
@@ -58,76 +266,402 @@ class EventPublisherRepository(Repository, metaclass=abc.ABCMeta):
             self.listeners.append(listener)
 
     @abc.abstractmethod
-    def append_to_stream(self, obj):
+    def append_to_stream(self, obj, expected_version=None):
         raise NotImplementedError()
 
+    def append_to_streams(self, objs, expected_versions):
+        """
+        Append the new events of many objects. Stores override it to write them all at once.
+
+        :return: a dict giving the list of appended events of each object_id
+        """
+        new_events = dict()
+        saved_events = list()
+        for obj in objs:
+            try:
+                new_events[obj.object_id] = self.append_to_stream(
+                    obj, expected_versions.get(obj.object_id)
+                )
+            except ConcurrencyError as e:
+                e.saved_events = saved_events
+                raise e
+            saved_events.extend(new_events[obj.object_id])
+
+        return new_events
+
+
+def _check_expected_versions(objs, expected_versions, max_versions):
+    """
+    Raise a ConcurrencyError, before anything is written, for the first object whose stored version is
+    not the expected one
+    """
+    for obj in objs:
+        expected_version = expected_versions.get(obj.object_id)
+        if expected_version is not None and expected_version != max_versions.get(obj.object_id, 0):
+            raise ConcurrencyError(obj.object_id, expected_version)
+
+
+class UnitOfWork:
+    """
+    Collect the domain objects touched by a command and save them together
+
+    Used as a context manager, it saves the registered objects when the block exits without error and
+    forgets them otherwise.
+    """
+
+    def __init__(self, repository):
+        assert repository is not None
+        assert isinstance(repository, Repository)
+
+        self.repository = repository
+        self.__objects = dict()
+        self.__expected_versions = dict()
+
+    def register(self, obj, expected_version=None):
+        assert obj is not None
+        assert isinstance(obj, DomainObject)
+
+        self.__objects[obj.object_id] = obj
+        if expected_version is not None:
+            self.__expected_versions[obj.object_id] = expected_version
+
+    def commit(self):
+        objs = list(self.__objects.values())
+        expected_versions = self.__expected_versions
+        self.rollback()
+
+        if len(objs) > 0:
+            self.repository.save_all(objs, expected_versions)
+
+    def rollback(self):
+        self.__objects = dict()
+        self.__expected_versions = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
+# The events stored before positions existed, numbered once in the order they were saved. Shared with
+# the async stores.
+_MONGO_UNNUMBERED_EVENTS = {"position": {"$exists": False}}
+_MONGO_SAVE_ORDER = [("event_timestamp", ASCENDING), ("object_id", ASCENDING), ("version", ASCENDING)]
+
+_MYSQL_INIT_POSITION = "insert ignore into `{0}_position`(`id`, `position`) select 1, coalesce(max(position), 0) from `{0}`"
+_MYSQL_CHECK_POSITION_COLUMN = "show columns from `{}` like 'position'"
+_MYSQL_ADD_POSITIONS = (
+    "alter table `{}` add column `position` bigint null, add unique key(`position`)",
+    "set @position := 0",
+    "update `{}` set position = (@position := @position + 1) where position is null order by event_timestamp, object_id, version",
+)
+
+
+def _number_mongo_events(documents, first_position):
+    """
+    Return the updates giving positions from first_position to the documents, unless another migration
+    numbered them first
+    """
+    return [
+        UpdateOne(
+            {"_id": document["_id"], "position": {"$exists": False}},
+            {"$set": {"position": first_position + index}},
+        )
+        for index, document in enumerate(documents)
+    ]
+
 
 class MongoEventSourceRepository(EventPublisherRepository, metaclass=abc.ABCMeta):
     def __init__(
-        self, host="localhost", port=27017, database="fenrys", collection="event_store"
+        self,
+        host="localhost",
+        port=27017,
+        database="fenrys",
+        collection="event_store",
+        snapshot_store=None,
+        snapshot_policy=None,
     ):
-        super().__init__()
+        super().__init__(snapshot_store, snapshot_policy)
         self.__client = MongoClient(host, port)
         self.__db = self.__client[database]
         self.__collection = self.__db[collection]
+        self.__collection.create_index(
+            [("object_id", ASCENDING), ("version", ASCENDING)], unique=True
+        )
+        # Events stored before positions existed have none until __add_positions numbers them
+        self.__collection.create_index("position", unique=True, sparse=True)
+        self.__positions = self.__db["{}_position".format(collection)]
 
-    def append_to_stream(self, obj):
+        self.__add_positions()
+
+    def __add_positions(self):
+        """
+        Migrate a collection created before events had a position: number the stored events in the order
+        they were saved, after the positions already given
+
+        The counter document remembers the collection was numbered, so that this is only done once.
+        """
+        counter = self.__positions.find_one({"_id": "position"})
+        if counter is not None and counter.get("numbered", False):
+            return
+
+        self.__positions.update_one(
+            {"_id": "position"}, {"$max": {"position": self.last_position()}}, upsert=True
+        )
+
+        nb_events = self.__collection.count_documents(_MONGO_UNNUMBERED_EVENTS)
+        if nb_events > 0:
+            counter = self.__positions.find_one_and_update(
+                {"_id": "position"},
+                {"$inc": {"position": nb_events}},
+                return_document=ReturnDocument.AFTER,
+            )
+            position = counter["position"] - nb_events + 1
+
+            documents = (
+                self.__collection.find(_MONGO_UNNUMBERED_EVENTS, {"_id": True}, allow_disk_use=True)
+                .sort(_MONGO_SAVE_ORDER)
+                .batch_size(self.stream_batch_size)
+            )
+            batch = list()
+            for document in documents:
+                batch.append(document)
+                if len(batch) >= self.stream_batch_size:
+                    self.__collection.bulk_write(_number_mongo_events(batch, position), ordered=False)
+                    position += len(batch)
+                    batch = list()
+
+            if len(batch) > 0:
+                self.__collection.bulk_write(_number_mongo_events(batch, position), ordered=False)
+
+        self.__positions.update_one({"_id": "position"}, {"$set": {"numbered": True}})
+
+    def __reserve_positions(self, events):
+        """
+        Give events consecutive positions, taken from a counter document
+
+        Positions are reserved before the insert: a failed insert leaves a gap, and concurrent writers
+        may make their events visible in a different order than their positions.
+        """
+        if len(events) == 0:
+            return events
+
+        counter = self.__positions.find_one_and_update(
+            {"_id": "position"},
+            {"$inc": {"position": len(events)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        first_position = counter["position"] - len(events) + 1
+        return [event.with_position(first_position + index) for index, event in enumerate(events)]
+
+    def append_to_stream(self, obj, expected_version=None):
+        """
+        A save reads the stored version, reserves positions then inserts: three round trips. The unique
+        index only catches a stream that went past expected_version, not one behind it, so the version is
+        only left unread for a new stream, when expected_version is 0.
+        """
         assert obj is not None
         assert isinstance(obj, DomainObject)
 
-        max_known_version = self.max_version_for_object(obj.object_id)
+        if expected_version != 0:
+            max_known_version = self.max_version_for_object(obj.object_id)
+            if expected_version is None:
+                expected_version = max_known_version
+            elif expected_version != max_known_version:
+                raise ConcurrencyError(obj.object_id, expected_version)
 
-        events_to_add = list()
-        if obj.version_number > max_known_version:
-            for event in obj.event_stream:
-                if event["version"] > max_known_version:
-                    events_to_add.append(deepcopy(event))
+        events_to_add = self.__reserve_positions(obj.events_after(expected_version))
 
         if len(events_to_add) > 0:
-            self.__collection.insert_many(events_to_add)
+            # The unique (object_id, version) index rejects the first event if another writer got
+            # there first, and an ordered insert stops at that error. pymongo adds an _id to the
+            # documents it inserts, so it is given fresh dicts rather than the records.
+            try:
+                self.__collection.insert_many(
+                    [event.to_dict() for event in events_to_add], ordered=True
+                )
+            except BulkWriteError as e:
+                if any(
+                    error["code"] == 11000
+                    for error in e.details.get("writeErrors", ())
+                ):
+                    raise ConcurrencyError(obj.object_id, expected_version) from e
+                raise e
 
-        return deepcopy(events_to_add)
+        return copy_for_listeners(events_to_add)
 
-    def load(self, object_id):
-        obj = self.create_blank_domain_object()
-        assert isinstance(obj, DomainObject)
+    def append_to_streams(self, objs, expected_versions):
+        versions = self.max_versions_for_objects([obj.object_id for obj in objs])
+        _check_expected_versions(objs, expected_versions, versions)
 
-        stream = self.get_event_stream_for(object_id)
-        obj.rehydrate(stream)
+        events_to_add = list()
+        for obj in objs:
+            events_to_add.extend(obj.events_after(versions.get(obj.object_id, 0)))
+        events_to_add = self.__reserve_positions(events_to_add)
 
-        return obj
+        new_events = {obj.object_id: list() for obj in objs}
+        for event in events_to_add:
+            new_events[event.object_id].append(event)
+
+        if len(events_to_add) > 0:
+            # Without a transaction, the events before the first conflict stay written
+            try:
+                self.__collection.insert_many(
+                    [event.to_dict() for event in events_to_add], ordered=True
+                )
+            except BulkWriteError as e:
+                conflicts = [
+                    error
+                    for error in e.details.get("writeErrors", ())
+                    if error["code"] == 11000
+                ]
+                if len(conflicts) > 0:
+                    index = conflicts[0]["index"]
+                    object_id = events_to_add[index]["object_id"]
+                    raise ConcurrencyError(
+                        object_id,
+                        versions.get(object_id, 0),
+                        copy_for_listeners(events_to_add[:index]),
+                    ) from e
+                raise e
+
+        return {
+            object_id: copy_for_listeners(events)
+            for object_id, events in new_events.items()
+        }
 
     def exists(self, object_id):
-        return len(self.get_event_stream_for(object_id)) > 0
+        return (
+            self.__collection.find_one({"object_id": object_id}, {"_id": True})
+            is not None
+        )
 
-    def get_event_stream_for(self, object_id):
+    def get_event_stream_for(self, object_id, after_version=0):
         stream = list()
 
-        objects = self.__collection.find({"object_id": object_id})
+        objects = self.__collection.find(
+            {"object_id": object_id, "version": {"$gt": after_version}}, {"_id": False}
+        )
         for event in objects:
-            event.pop("_id")
-            stream.append(event)
+            stream.append(EventRecord.from_mapping(event))
 
         return stream
 
+    def get_event_streams_for(self, after_versions):
+        if len(after_versions) == 0:
+            return dict()
+
+        if all(after_version <= 0 for after_version in after_versions.values()):
+            query = {"object_id": {"$in": list(after_versions)}}
+        else:
+            query = {
+                "$or": [
+                    {"object_id": object_id, "version": {"$gt": after_version}}
+                    for object_id, after_version in after_versions.items()
+                ]
+            }
+
+        streams = dict()
+        events = (
+            self.__collection.find(query, {"_id": False})
+            .sort([("object_id", ASCENDING), ("version", ASCENDING)])
+            .batch_size(self.stream_batch_size)
+        )
+        for event in events:
+            streams.setdefault(event["object_id"], list()).append(
+                EventRecord.from_mapping(event)
+            )
+
+        return streams
+
+    def iter_event_stream_for(self, object_id, after_version=0, batch_size=None):
+        cursor = (
+            self.__collection.find(
+                {"object_id": object_id, "version": {"$gt": after_version}},
+                {"_id": False},
+            )
+            .sort("version", ASCENDING)
+            .batch_size(batch_size or self.stream_batch_size)
+        )
+
+        try:
+            for event in cursor:
+                yield EventRecord.from_mapping(event)
+        finally:
+            cursor.close()
+
     def max_version_for_object(self, object_id):
-        max_known_version = 0
-        stream = self.get_event_stream_for(object_id)
+        last_event = self.__collection.find_one(
+            {"object_id": object_id},
+            {"_id": False, "version": True},
+            sort=[("version", DESCENDING)],
+        )
+
+        return last_event["version"] if last_event is not None else 0
+
+    def max_versions_for_objects(self, object_ids):
+        if len(object_ids) == 0:
+            return dict()
+
+        results = self.__collection.aggregate(
+            [
+                {"$match": {"object_id": {"$in": list(object_ids)}}},
+                {"$group": {"_id": "$object_id", "max_version": {"$max": "$version"}}},
+            ]
+        )
 
-        for event in stream:
-            if event["version"] > max_known_version:
-                max_known_version = event["version"]
+        return {result["_id"]: result["max_version"] for result in results}
 
-        return max_known_version
+    def read_all(self, from_position=0, batch_size=None):
+        cursor = (
+            self.__collection.find({"position": {"$gt": from_position}}, {"_id": False})
+            .sort("position", ASCENDING)
+            .batch_size(batch_size or self.stream_batch_size)
+        )
+
+        try:
+            for event in cursor:
+                yield EventRecord.from_mapping(event)
+        finally:
+            cursor.close()
+
+    def last_position(self):
+        last_event = self.__collection.find_one(
+            {"position": {"$exists": True}},
+            {"_id": False, "position": True},
+            sort=[("position", DESCENDING)],
+        )
+
+        return last_event["position"] if last_event is not None else 0
 
 
 class MySQLSourceRepository(EventPublisherRepository, metaclass=abc.ABCMeta):
 
-    __CREATE_STREAM = """create table `{}`(`object_id` varchar(255) not null, `version` int not null, `event_name` varchar(255) not null, `event` longtext not null, `event_timestamp` double not null, primary key(`object_id`, `version`))"""
-    __SELECT_OBJECT_STREAM = "select * from `{}` where object_id = %s"
-    __INSERT_OBJECT_STREAM = "insert into `{}`(`object_id`, `version`, `event_name`, `event`, `event_timestamp`) values(%s, %s, %s, %s, %s)"
+    __CREATE_STREAM = """create table `{}`(`object_id` varchar(255) not null, `version` int not null, `event_name` varchar(255) not null, `event` longtext not null, `event_timestamp` double not null, `position` bigint not null, primary key(`object_id`, `version`), unique key(`position`))"""
+    __CREATE_POSITION = """create table if not exists `{}_position`(`id` tinyint not null, `position` bigint not null, primary key(`id`))"""
+    __RESERVE_POSITIONS = "update `{}_position` set position = last_insert_id(position + %s) where id = 1"
+    __SELECT_RESERVED_POSITION = "select last_insert_id() as position"
+    __SELECT_ALL = "select * from `{}` where position > %s order by position"
+    __SELECT_LAST_POSITION = "select max(position) as position from `{}`"
+    __SELECT_OBJECT_STREAM = "select * from `{}` where object_id = %s and version > %s"
+    __SELECT_ORDERED_OBJECT_STREAM = "select * from `{}` where object_id = %s and version > %s order by version"
+    __SELECT_MAX_VERSION = "select max(version) as max_version from `{}` where object_id = %s"
+    __SELECT_OBJECTS_STREAMS = "select * from `{}` where {} order by object_id, version"
+    __SELECT_MAX_VERSIONS = "select object_id, max(version) as max_version from `{}` where object_id in ({}) group by object_id"
+    __SELECT_EXISTS = "select 1 from `{}` where object_id = %s limit 1"
+    __INSERT_OBJECT_STREAM = "insert into `{}`(`object_id`, `version`, `event_name`, `event`, `event_timestamp`, `position`) values(%s, %s, %s, %s, %s, %s)"
     __CHECK_TABLE_EXISTS = "show tables like %s"
     __TABLE_EXISTS = False
+    __LOCK_MAX_VERSION = __SELECT_MAX_VERSION + " for update"
+    __LOCK_MAX_VERSIONS = __SELECT_MAX_VERSIONS + " for update"
+    __DUPLICATE_ENTRY = 1062
+    __DEADLOCK = 1213
+    __MAX_OBJECTS_PER_QUERY = 500
 
     def __init__(
         self,
@@ -136,38 +670,64 @@ class MySQLSourceRepository(EventPublisherRepository, metaclass=abc.ABCMeta):
         host="localhost",
         database="fenrys",
         table="event_store",
+        snapshot_store=None,
+        snapshot_policy=None,
+        min_pool_size=1,
+        max_pool_size=10,
     ):
-        super().__init__()
-        self.__connection = pymysql.connect(
-            host=host,
-            user=user,
-            password=password,
-            db=database,
-            charset="utf8mb4",
-            cursorclass=pymysql.cursors.DictCursor,
+        super().__init__(snapshot_store, snapshot_policy)
+        self.__pool = MySQLConnectionPool.for_dsn(
+            user, password, host, database, min_size=min_pool_size, max_size=max_pool_size
         )
         self.__table = table
 
         self.__create_table()
 
-    def __del__(self):
-        self.__connection.close()
-
     def __create_table(self):
         if not self.__table_exists():
-            try:
-                with self.__connection.cursor() as cursor:
-                    cursor.execute(
-                        MySQLSourceRepository.__CREATE_STREAM.format(self.__table)
-                    )
-                self.__connection.commit()
-            except Exception as e:
-                self.__connection.rollback()
-                raise e
+            with self.__pool.connection() as connection, connection.cursor() as cursor:
+                cursor.execute(
+                    MySQLSourceRepository.__CREATE_STREAM.format(self.__table)
+                )
+        else:
+            self.__add_positions()
+
+        with self.__pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(MySQLSourceRepository.__CREATE_POSITION.format(self.__table))
+            cursor.execute(_MYSQL_INIT_POSITION.format(self.__table))
+
+    def __add_positions(self):
+        """
+        Migrate a table created before events had a position: add the column and number the stored events
+        in the order they were saved, before the position table is seeded from them
+
+        The column stays nullable there, as the sparse position index of the Mongo store.
+        """
+        with self.__pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(_MYSQL_CHECK_POSITION_COLUMN.format(self.__table))
+            if cursor.fetchone() is not None:
+                return
+
+            for statement in _MYSQL_ADD_POSITIONS:
+                cursor.execute(statement.format(self.__table))
+
+    def __reserve_positions(self, cursor, events):
+        """
+        Give events consecutive positions, taken from the position table in the transaction of cursor
+
+        The position row stays locked until the transaction ends, so that events are committed in the
+        order of their positions.
+        """
+        cursor.execute(
+            MySQLSourceRepository.__RESERVE_POSITIONS.format(self.__table), (len(events),)
+        )
+        cursor.execute(MySQLSourceRepository.__SELECT_RESERVED_POSITION)
+        first_position = int(cursor.fetchone()["position"]) - len(events) + 1
+        return [event.with_position(first_position + index) for index, event in enumerate(events)]
 
     def __table_exists(self):
         if not MySQLSourceRepository.__TABLE_EXISTS:
-            with self.__connection.cursor() as cursor:
+            with self.__pool.connection() as connection, connection.cursor() as cursor:
                 cursor.execute(
                     MySQLSourceRepository.__CHECK_TABLE_EXISTS, (self.__table)
                 )
@@ -180,126 +740,337 @@ class MySQLSourceRepository(EventPublisherRepository, metaclass=abc.ABCMeta):
         else:
             return True
 
-    def append_to_stream(self, obj):
+    def append_to_stream(self, obj, expected_version=None):
+        """
+        The stored version is read in the transaction of the insert, locking the rows of the stream: the
+        primary key only catches a stream that went past expected_version, not one behind it
+        """
         assert obj is not None
         assert isinstance(obj, DomainObject)
 
-        max_known_version = self.max_version_for_object(obj.object_id)
-
-        events_to_add = list()
-        if obj.version_number > max_known_version:
-            for event in obj.event_stream:
-                if event["version"] > max_known_version:
-                    events_to_add.append(deepcopy(event))
-
-        if len(events_to_add) > 0:
-            try:
-                with self.__connection.cursor() as cursor:
+        try:
+            with self.__pool.connection() as connection, connection.cursor() as cursor:
+                cursor.execute(
+                    MySQLSourceRepository.__LOCK_MAX_VERSION.format(self.__table), (obj.object_id,)
+                )
+                result = cursor.fetchone()
+                max_known_version = int(result["max_version"] or 0) if result is not None else 0
+                if expected_version is None:
+                    expected_version = max_known_version
+                elif expected_version != max_known_version:
+                    raise ConcurrencyError(obj.object_id, expected_version)
+
+                events_to_add = obj.events_after(expected_version)
+                if len(events_to_add) > 0:
+                    events_to_add = self.__reserve_positions(cursor, events_to_add)
                     cursor.executemany(
                         MySQLSourceRepository.__INSERT_OBJECT_STREAM.format(
                             self.__table
                         ),
-                        map(
-                            lambda event: (
-                                event["object_id"],
-                                int(event["version"]),
-                                event["event_name"],
-                                json.dumps(event["event"]),
-                                "{:10.15f}".format(float(event["event_timestamp"])),
-                            ),
-                            events_to_add,
+                        [
+                            MySQLSourceRepository.__to_row(
+                                event, obj.encoded_events.get(event["version"])
+                            )
+                            for event in events_to_add
+                        ],
+                    )
+        except pymysql.err.IntegrityError as e:
+            # The (object_id, version) primary key rejects events another writer already appended
+            if e.args[0] == MySQLSourceRepository.__DUPLICATE_ENTRY:
+                raise ConcurrencyError(obj.object_id, expected_version) from e
+            raise e
+        except pymysql.err.OperationalError as e:
+            # Writers creating the same stream lock the same gap, one of them is chosen as the deadlock victim
+            if e.args[0] == MySQLSourceRepository.__DEADLOCK:
+                raise ConcurrencyError(obj.object_id, expected_version) from e
+            raise e
+
+        return copy_for_listeners(events_to_add)
+
+    def append_to_streams(self, objs, expected_versions):
+        object_ids = [obj.object_id for obj in objs]
+        if len(object_ids) == 0:
+            return dict()
+
+        new_events = {obj.object_id: list() for obj in objs}
+        try:
+            # A single transaction: the versions are checked with the rows of the streams locked, then either
+            # every stream is appended to or none is
+            with self.__pool.connection() as connection, connection.cursor() as cursor:
+                cursor.execute(
+                    MySQLSourceRepository.__LOCK_MAX_VERSIONS.format(
+                        self.__table, ", ".join(["%s"] * len(object_ids))
+                    ),
+                    tuple(object_ids),
+                )
+                versions = {
+                    result["object_id"]: int(result["max_version"]) for result in cursor.fetchall()
+                }
+                _check_expected_versions(objs, expected_versions, versions)
+
+                events_to_add = list()
+                encoded_events = dict()
+                for obj in objs:
+                    events_to_add.extend(obj.events_after(versions.get(obj.object_id, 0)))
+                    encoded_events[obj.object_id] = obj.encoded_events
+
+                if len(events_to_add) > 0:
+                    events_to_add = self.__reserve_positions(cursor, events_to_add)
+                    cursor.executemany(
+                        MySQLSourceRepository.__INSERT_OBJECT_STREAM.format(
+                            self.__table
                         ),
+                        [
+                            MySQLSourceRepository.__to_row(
+                                event, encoded_events[event.object_id].get(event["version"])
+                            )
+                            for event in events_to_add
+                        ],
                     )
-                self.__connection.commit()
-            except Exception as e:
-                self.__connection.rollback()
-                raise e
-
-        return deepcopy(events_to_add)
-
-    def load(self, object_id):
-        obj = self.create_blank_domain_object()
-        assert isinstance(obj, DomainObject)
-
-        stream = self.get_event_stream_for(object_id)
-        obj.rehydrate(stream)
-
-        return obj
+        except pymysql.err.IntegrityError as e:
+            if e.args[0] == MySQLSourceRepository.__DUPLICATE_ENTRY:
+                raise ConcurrencyError(None, None) from e
+            raise e
+        except pymysql.err.OperationalError as e:
+            if e.args[0] == MySQLSourceRepository.__DEADLOCK:
+                raise ConcurrencyError(None, None) from e
+            raise e
+
+        for event in events_to_add:
+            new_events[event.object_id].append(event)
+
+        return {
+            object_id: copy_for_listeners(events)
+            for object_id, events in new_events.items()
+        }
 
     def exists(self, object_id):
-        return len(self.get_event_stream_for(object_id)) > 0
+        with self.__pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(
+                MySQLSourceRepository.__SELECT_EXISTS.format(self.__table), (object_id,)
+            )
+            return cursor.fetchone() is not None
 
-    def get_event_stream_for(self, object_id):
+    def get_event_stream_for(self, object_id, after_version=0):
         stream = list()
 
-        with self.__connection.cursor() as cursor:
+        with self.__pool.connection() as connection, connection.cursor() as cursor:
             cursor.execute(
                 MySQLSourceRepository.__SELECT_OBJECT_STREAM.format(self.__table),
-                (object_id),
+                (object_id, after_version),
             )
             results = cursor.fetchall()
             for result in results:
-                r = dict()
-                r["object_id"] = result["object_id"]
-                r["version"] = int(result["version"])
-                r["event_name"] = result["event_name"]
-                r["event"] = json.loads(result["event"])
-                r["event_timestamp"] = float(result["event_timestamp"])
-                stream.append(r)
+                stream.append(MySQLSourceRepository.__to_event(result))
 
         return stream
 
+    def get_event_streams_for(self, after_versions):
+        streams = dict()
+        items = list(after_versions.items())
+
+        with self.__pool.connection() as connection, connection.cursor() as cursor:
+            for start in range(0, len(items), MySQLSourceRepository.__MAX_OBJECTS_PER_QUERY):
+                chunk = items[start:start + MySQLSourceRepository.__MAX_OBJECTS_PER_QUERY]
+                if all(after_version <= 0 for _, after_version in chunk):
+                    condition = "object_id in ({})".format(", ".join(["%s"] * len(chunk)))
+                    parameters = [object_id for object_id, _ in chunk]
+                else:
+                    condition = " or ".join(["(object_id = %s and version > %s)"] * len(chunk))
+                    parameters = [value for item in chunk for value in item]
+
+                cursor.execute(
+                    MySQLSourceRepository.__SELECT_OBJECTS_STREAMS.format(self.__table, condition),
+                    parameters,
+                )
+                for result in cursor.fetchall():
+                    event = MySQLSourceRepository.__to_event(result)
+                    streams.setdefault(event["object_id"], list()).append(event)
+
+        return streams
+
+    def iter_event_stream_for(self, object_id, after_version=0, batch_size=None):
+        batch_size = batch_size or self.stream_batch_size
+
+        # An unbuffered cursor streams the rows from the server instead of loading them all
+        with self.__pool.connection() as connection, connection.cursor(
+            pymysql.cursors.SSDictCursor
+        ) as cursor:
+            cursor.execute(
+                MySQLSourceRepository.__SELECT_ORDERED_OBJECT_STREAM.format(self.__table),
+                (object_id, after_version),
+            )
+            while True:
+                results = cursor.fetchmany(batch_size)
+                if len(results) == 0:
+                    break
+                for result in results:
+                    yield MySQLSourceRepository.__to_event(result)
+
+    @staticmethod
+    def __to_row(event, encoded_event=None):
+        return (
+            event["object_id"],
+            int(event["version"]),
+            event["event_name"],
+            encoded_event if encoded_event is not None else json.dumps(event["event"]),
+            "{:10.15f}".format(float(event["event_timestamp"])),
+            event.position,
+        )
+
+    @staticmethod
+    def __to_event(result):
+        return EventRecord(
+            result["object_id"],
+            int(result["version"]),
+            result["event_name"],
+            json.loads(result["event"]),
+            float(result["event_timestamp"]),
+            int(result["position"]) if result.get("position") is not None else None,
+        )
+
+    def read_all(self, from_position=0, batch_size=None):
+        batch_size = batch_size or self.stream_batch_size
+
+        with self.__pool.connection() as connection, connection.cursor(
+            pymysql.cursors.SSDictCursor
+        ) as cursor:
+            cursor.execute(
+                MySQLSourceRepository.__SELECT_ALL.format(self.__table), (from_position,)
+            )
+            while True:
+                results = cursor.fetchmany(batch_size)
+                if len(results) == 0:
+                    break
+                for result in results:
+                    yield MySQLSourceRepository.__to_event(result)
+
+    def last_position(self):
+        with self.__pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(
+                MySQLSourceRepository.__SELECT_LAST_POSITION.format(self.__table)
+            )
+            result = cursor.fetchone()
+
+        if result is None or result["position"] is None:
+            return 0
+
+        return int(result["position"])
+
     def max_version_for_object(self, object_id):
-        stream = self.get_event_stream_for(object_id)
+        with self.__pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(
+                MySQLSourceRepository.__SELECT_MAX_VERSION.format(self.__table),
+                (object_id,),
+            )
+            result = cursor.fetchone()
 
-        return max(map(lambda x: x["version"], stream)) if len(stream) > 0 else 0
+        if result is None or result["max_version"] is None:
+            return 0
 
+        return int(result["max_version"])
 
-class InMemoryEventSourceRepository(EventPublisherRepository, metaclass=abc.ABCMeta):
-    def __init__(self):
-        super().__init__()
-        self.__repo = list()
+    def max_versions_for_objects(self, object_ids):
+        if len(object_ids) == 0:
+            return dict()
+
+        with self.__pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(
+                MySQLSourceRepository.__SELECT_MAX_VERSIONS.format(
+                    self.__table, ", ".join(["%s"] * len(object_ids))
+                ),
+                tuple(object_ids),
+            )
+            results = cursor.fetchall()
 
-    def append_to_stream(self, obj):
+        return {result["object_id"]: int(result["max_version"]) for result in results}
+
+
+class InMemoryEventSourceRepository(EventPublisherRepository, metaclass=abc.ABCMeta):
+    def __init__(self, snapshot_store=None, snapshot_policy=None):
+        super().__init__(snapshot_store, snapshot_policy)
+        self.__streams = dict()
+        self.__max_versions = dict()
+        self.__log = list()
+        self.__lock = Lock()
+
+    def append_to_stream(self, obj, expected_version=None):
         assert obj is not None
         assert isinstance(obj, DomainObject)
 
-        max_known_version = self.max_version_for_object(obj.object_id)
+        with self.__lock:
+            max_known_version = self.max_version_for_object(obj.object_id)
+            if expected_version is None:
+                expected_version = max_known_version
+            elif expected_version != max_known_version:
+                raise ConcurrencyError(obj.object_id, expected_version)
+
+            events_to_add = self.__append(obj.object_id, obj.events_after(expected_version))
+
+        return copy_for_listeners(events_to_add)
+
+    def append_to_streams(self, objs, expected_versions):
+        with self.__lock:
+            # Every expected version is checked before anything is appended
+            for obj in objs:
+                expected_version = expected_versions.get(obj.object_id)
+                if expected_version is not None and expected_version != self.max_version_for_object(
+                    obj.object_id
+                ):
+                    raise ConcurrencyError(obj.object_id, expected_version)
+
+            new_events = dict()
+            for obj in objs:
+                new_events[obj.object_id] = self.__append(
+                    obj.object_id, obj.events_after(self.max_version_for_object(obj.object_id))
+                )
 
-        events_to_add = list()
-        if obj.version_number > max_known_version:
-            for event in obj.event_stream:
-                if event["version"] > max_known_version:
-                    events_to_add.append(event)
-                    self.__repo.append(event)
+        return {
+            object_id: copy_for_listeners(events)
+            for object_id, events in new_events.items()
+        }
 
-        return deepcopy(events_to_add)
+    def __append(self, object_id, events):
+        # The log of every event gives them their position
+        first_position = len(self.__log) + 1
+        events = [event.with_position(first_position + index) for index, event in enumerate(events)]
 
-    def load(self, object_id):
-        obj = self.create_blank_domain_object()
-        assert isinstance(obj, DomainObject)
+        if len(events) > 0:
+            self.__streams.setdefault(object_id, list()).extend(events)
+            self.__max_versions[object_id] = events[-1]["version"]
+            self.__log.extend(events)
 
-        stream = self.get_event_stream_for(object_id)
-        obj.rehydrate(stream)
+        return events
 
-        return obj
+    def read_all(self, from_position=0, batch_size=None):
+        # Events appended while iterating are not returned
+        return itertools.islice(self.__log, max(from_position, 0), len(self.__log))
+
+    def last_position(self):
+        return len(self.__log)
 
     def exists(self, object_id):
-        return len(self.get_event_stream_for(object_id)) > 0
+        return object_id in self.__streams
 
-    def get_event_stream_for(self, object_id):
-        stream = list()
-        for event in self.__repo:
-            if event["object_id"] == object_id:
-                stream.append(event)
-        return stream
+    def get_event_stream_for(self, object_id, after_version=0):
+        stream = self.__streams.get(object_id, ())
 
-    def max_version_for_object(self, object_id):
-        max_known_version = 0
-        stream = self.get_event_stream_for(object_id)
+        # Streams are sorted by version: only walk the events that are returned
+        index = len(stream)
+        while index > 0 and stream[index - 1]["version"] > after_version:
+            index -= 1
+
+        return list(stream[index:])
+
+    def iter_event_stream_for(self, object_id, after_version=0, batch_size=None):
+        stream = self.__streams.get(object_id, ())
 
-        for event in stream:
-            if event["version"] > max_known_version:
-                max_known_version = event["version"]
+        index = len(stream)
+        while index > 0 and stream[index - 1]["version"] > after_version:
+            index -= 1
 
-        return max_known_version
+        # Events appended while iterating are not returned
+        return itertools.islice(stream, index, len(stream))
+
+    def max_version_for_object(self, object_id):
+        return self.__max_versions.get(object_id, 0)
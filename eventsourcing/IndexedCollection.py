@@ -0,0 +1,185 @@
+"""
+In memory collection of documents indexed by a primary key and by secondary indexes
+
+"""
+from bisect import bisect_left, bisect_right, insort
+from threading import Lock
+
+HASH = "hash"
+SORTED = "sorted"
+
+
+class HashIndex:
+    """
+    Documents by value of a field, for lookups in O(1)
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.__keys = dict()
+
+    def add(self, key, value):
+        self.__keys.setdefault(value, dict())[key] = None
+
+    def remove(self, key, value):
+        keys = self.__keys[value]
+        del keys[key]
+        if len(keys) == 0:
+            del self.__keys[value]
+
+    def find(self, value):
+        return list(self.__keys.get(value, ()))
+
+
+class SortedIndex:
+    """
+    Documents sorted by value of a field, for lookups and range queries in O(log n)
+
+    The distinct values are kept sorted, each with the keys of its documents. The values of the field must
+    be comparable with each other.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.__values = list()
+        self.__keys = dict()
+
+    def add(self, key, value):
+        keys = self.__keys.get(value)
+        if keys is None:
+            keys = self.__keys[value] = dict()
+            insort(self.__values, value)
+        keys[key] = None
+
+    def remove(self, key, value):
+        keys = self.__keys[value]
+        del keys[key]
+        if len(keys) == 0:
+            del self.__keys[value]
+            del self.__values[bisect_left(self.__values, value)]
+
+    def find(self, value):
+        return list(self.__keys.get(value, ()))
+
+    def range(self, low=None, high=None, include_low=True, include_high=False):
+        if low is None:
+            start = 0
+        elif include_low:
+            start = bisect_left(self.__values, low)
+        else:
+            start = bisect_right(self.__values, low)
+
+        if high is None:
+            end = len(self.__values)
+        elif include_high:
+            end = bisect_right(self.__values, high)
+        else:
+            end = bisect_left(self.__values, high)
+
+        return [key for value in self.__values[start:end] for key in self.__keys[value]]
+
+
+_INDEX_TYPES = {HASH: HashIndex, SORTED: SortedIndex}
+
+
+def _create_index(field, index_type):
+    assert index_type in _INDEX_TYPES, "unknown index type {}".format(index_type)
+    return _INDEX_TYPES[index_type](field)
+
+
+class IndexedCollection:
+    """
+    Documents, which are mappings, stored by the value of their primary_key field
+
+    indexes maps fields to HASH or SORTED. A document without a field, or with None for it, is left out
+    of the index of that field. Indexes are updated on each upsert and delete, from the values indexed at
+    the previous upsert: a document returned by get can be modified then upserted again, but changes not
+    upserted are not seen by the indexes.
+
+    Writes and reads are guarded by a lock, so that the collection can be read while a projection updates it.
+    """
+
+    def __init__(self, primary_key, indexes=None):
+        assert primary_key is not None
+
+        self.primary_key = primary_key
+        self.__lock = Lock()
+        self.__documents = dict()
+        self.__indexed_values = dict()
+        self.__indexes = {
+            field: _create_index(field, index_type)
+            for field, index_type in (indexes or dict()).items()
+        }
+
+    def upsert(self, document):
+        """
+        Insert document, or replace the document with the same primary key
+        """
+        key = document[self.primary_key]
+        values = tuple(
+            (index, document.get(field))
+            for field, index in self.__indexes.items()
+            if document.get(field) is not None
+        )
+
+        with self.__lock:
+            self.__unindex(key)
+            self.__documents[key] = document
+            self.__indexed_values[key] = values
+            for index, value in values:
+                index.add(key, value)
+
+    def delete(self, key):
+        """
+        Remove the document with primary key key, return whether there was one
+        """
+        with self.__lock:
+            if self.__documents.pop(key, None) is None:
+                return False
+
+            self.__unindex(key)
+            return True
+
+    def __unindex(self, key):
+        for index, value in self.__indexed_values.pop(key, ()):
+            index.remove(key, value)
+
+    def get(self, key, default=None):
+        return self.__documents.get(key, default)
+
+    def find(self, field, value):
+        """
+        Return the documents whose field equals value, through its index if it has one
+        """
+        with self.__lock:
+            if field == self.primary_key:
+                document = self.__documents.get(value)
+                return [document] if document is not None else []
+
+            index = self.__indexes.get(field)
+            if index is None:
+                return [document for document in self.__documents.values() if document.get(field) == value]
+
+            return [self.__documents[key] for key in index.find(value)]
+
+    def range(self, field, low=None, high=None, include_low=True, include_high=False):
+        """
+        Return the documents whose field is between low and high, in the order of field
+
+        field must have a SORTED index, a None bound is open.
+        """
+        index = self.__indexes.get(field)
+        assert isinstance(index, SortedIndex), "{} has no sorted index".format(field)
+
+        with self.__lock:
+            return [self.__documents[key] for key in index.range(low, high, include_low, include_high)]
+
+    def __contains__(self, key):
+        return key in self.__documents
+
+    def __iter__(self):
+        with self.__lock:
+            return iter(list(self.__documents.values()))
+
+    def __len__(self):
+        return len(self.__documents)
@@ -0,0 +1,198 @@
+"""
+Bounded pool of pymysql connections, shared by the repositories that point at the same database
+
+"""
+from collections import deque
+from contextlib import contextmanager
+from threading import Condition, Lock
+import time
+import pymysql.cursors
+
+
+class PoolTimeoutError(Exception):
+    """
+    Raised when no connection could be acquired from the pool in time
+    """
+    pass
+
+
+class MySQLConnectionPool:
+    """
+    A thread-safe pool holding between min_size and max_size connections
+
+    A connection that has been idle for more than health_check_interval seconds is pinged before being
+    handed out, and reconnected if the server closed it. A connection that fails with an operational
+    error is discarded instead of being returned to the pool.
+    """
+
+    __pools = dict()
+    __pools_lock = Lock()
+
+    @classmethod
+    def for_dsn(cls, user, password, host, database, port=3306, min_size=1, max_size=10):
+        """
+        Return the pool shared by every caller pointing at the same server, database and user
+
+        The sizes are only used when the pool is created.
+        """
+        key = (host, port, user, password, database)
+
+        with cls.__pools_lock:
+            pool = cls.__pools.get(key)
+            if pool is None or pool.closed:
+                pool = cls(user, password, host, database, port, min_size, max_size)
+                cls.__pools[key] = pool
+
+        return pool
+
+    def __init__(
+        self,
+        user,
+        password,
+        host,
+        database,
+        port=3306,
+        min_size=1,
+        max_size=10,
+        timeout=30.0,
+        health_check_interval=30.0,
+    ):
+        assert 0 <= min_size <= max_size
+        assert max_size > 0
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+
+        self.__parameters = dict(
+            host=host,
+            port=port,
+            user=user,
+            password=password,
+            db=database,
+            charset="utf8mb4",
+            cursorclass=pymysql.cursors.DictCursor,
+            autocommit=False,
+        )
+        self.__idle = deque()
+        self.__size = 0
+        self.__condition = Condition()
+        self.closed = False
+
+        for _ in range(min_size):
+            self.__idle.append((self.__connect(), time.monotonic()))
+            self.__size += 1
+
+    def __connect(self):
+        return pymysql.connect(**self.__parameters)
+
+    def acquire(self, timeout=None):
+        """
+        Take a connection from the pool, opening a new one if the pool is not full
+
+        :param timeout: the maximum time to wait for a connection, defaults to the pool timeout
+        :raise PoolTimeoutError: if no connection is available in time
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        with self.__condition:
+            while len(self.__idle) == 0 and self.__size >= self.max_size and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.__condition.wait(remaining):
+                    if len(self.__idle) == 0 and self.__size >= self.max_size:
+                        raise PoolTimeoutError(
+                            "No MySQL connection available after {} seconds".format(timeout)
+                        )
+
+            if self.closed:
+                raise RuntimeError("The MySQL connection pool is closed")
+
+            if len(self.__idle) > 0:
+                connection, last_used = self.__idle.pop()
+            else:
+                connection, last_used = None, None
+                self.__size += 1
+
+        try:
+            if connection is None:
+                connection = self.__connect()
+            elif time.monotonic() - last_used > self.health_check_interval:
+                connection.ping(reconnect=True)
+        except Exception as e:
+            self.__discard(connection)
+            raise e
+
+        return connection
+
+    def release(self, connection, discard=False):
+        """
+        Give a connection back to the pool
+
+        :param discard: close the connection instead of keeping it, e.g. after a network error
+        """
+        if discard or self.closed or not connection.open:
+            self.__discard(connection)
+            return
+
+        with self.__condition:
+            self.__idle.append((connection, time.monotonic()))
+            self.__condition.notify()
+
+    def __discard(self, connection):
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+        with self.__condition:
+            self.__size -= 1
+            self.__condition.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Acquire a connection for the duration of a transaction
+
+        The transaction is committed when the block exits normally and rolled back otherwise.
+        """
+        connection = self.acquire()
+        try:
+            yield connection
+            connection.commit()
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError) as e:
+            self.release(connection, discard=True)
+            raise e
+        except BaseException as e:
+            try:
+                connection.rollback()
+            except Exception:
+                self.release(connection, discard=True)
+                raise e
+            self.release(connection)
+            raise e
+        else:
+            self.release(connection)
+
+    def close(self):
+        """
+        Close the idle connections. Connections in use are closed when they are released.
+        """
+        with self.__condition:
+            idle = list(self.__idle)
+            self.__idle.clear()
+            self.__size -= len(idle)
+            self.closed = True
+            self.__condition.notify_all()
+
+        for connection, _ in idle:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self.__condition:
+            return {"size": self.__size, "idle": len(self.__idle)}
@@ -1,5 +1,9 @@
-from pymongo import MongoClient
+from collections.abc import Mapping
+from threading import Lock
+import time
+from pymongo import MongoClient, IndexModel, InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
 from .DomainEventListener import DomainEventListener
+from .IndexedCollection import IndexedCollection
 import abc
 
 
@@ -16,8 +20,32 @@ class Projection(DomainEventListener):
     def project(self, obj_id, event_name, event):
         raise NotImplementedError()
 
+    def flush(self):
+        """
+        Make the projected events durable, called after each batch by the ProjectionRunner
+        """
+        pass
+
 
 class MongoProjection(Projection):
+    """
+    Projection into a Mongo collection, whose writes are buffered and sent with bulk_write
+
+    project() should write through insert_one, update_one, update_many, replace_one, delete_one and
+    delete_many rather than through the collection: the buffered writes are flushed once bulk_size of
+    them are waiting, once the oldest has waited flush_interval seconds, at the end of each published
+    batch, and on flush(). A projection that reads its collection must flush() before.
+
+    A batch is written unordered when none of its writes can depend on another one, that is when each of
+    them targets a different _id, ordered otherwise. ordered_writes forces either mode.
+
+    indexes lists the indexes created at startup, as IndexModel or as keys accepted by create_index.
+    """
+
+    indexes = ()
+    bulk_size = 1000
+    flush_interval = 1.0
+    ordered_writes = None
 
     def __init__(self, host="localhost", port=27017, database="fenrys", collection="event_store"):
         super().__init__()
@@ -25,16 +53,122 @@ class MongoProjection(Projection):
         self.__db = self.__client[database]
         self.collection = self.__db[collection]
 
+        self.__lock = Lock()
+        self.__writes = list()
+        self.__first_write_at = None
+
+        if len(self.indexes) > 0:
+            self.create_indexes()
+
+    def create_indexes(self):
+        self.collection.create_indexes([
+            index if isinstance(index, IndexModel) else IndexModel(index)
+            for index in self.indexes
+        ])
+
+    def domainEventsPublished(self, events):
+        super().domainEventsPublished(events)
+        self.flush()
+
     @abc.abstractmethod
     def project(self, obj_id, event_name, event):
         raise NotImplementedError()
 
+    def insert_one(self, document):
+        target = _target({"_id": document["_id"]}) if "_id" in document else _NEW_DOCUMENT
+        self.write(InsertOne(document), target)
+
+    def update_one(self, filter, update, upsert=False):
+        self.write(UpdateOne(filter, update, upsert=upsert), _target(filter))
+
+    def update_many(self, filter, update, upsert=False):
+        self.write(UpdateMany(filter, update, upsert=upsert))
+
+    def replace_one(self, filter, replacement, upsert=False):
+        self.write(ReplaceOne(filter, replacement, upsert=upsert), _target(filter))
+
+    def delete_one(self, filter):
+        self.write(DeleteOne(filter), _target(filter))
+
+    def delete_many(self, filter):
+        self.write(DeleteMany(filter))
+
+    def write(self, operation, target=None):
+        """
+        Buffer a pymongo write operation, target is the _id of the only document it writes if known
+        """
+        with self.__lock:
+            if self.__first_write_at is None:
+                self.__first_write_at = time.monotonic()
+            self.__writes.append((operation, target))
+
+            if len(self.__writes) < self.bulk_size and \
+                    time.monotonic() - self.__first_write_at < self.flush_interval:
+                return
+
+            self.__flush()
+
+    def pending_writes(self):
+        return len(self.__writes)
+
+    def flush(self):
+        with self.__lock:
+            self.__flush()
+
+    def __flush(self):
+        # The buffer is emptied first: after a failure, the writes are expected to be replayed
+        writes, self.__writes = self.__writes, list()
+        self.__first_write_at = None
+        if len(writes) == 0:
+            return
+
+        ordered = self.ordered_writes
+        if ordered is None:
+            ordered = not _independent([target for _, target in writes])
+
+        self.collection.bulk_write([operation for operation, _ in writes], ordered=ordered)
+
+
+_NEW_DOCUMENT = object()
+
+
+def _target(filter):
+    identifier = filter.get("_id") if len(filter) == 1 else None
+    try:
+        hash(identifier)
+    except TypeError:
+        return None
+    return None if isinstance(identifier, Mapping) else identifier
+
+
+def _independent(targets):
+    seen = set()
+    for target in targets:
+        if target is _NEW_DOCUMENT:
+            continue
+        if target is None or target in seen:
+            return False
+        seen.add(target)
+    return True
+
 
 class InMemoryProjection(Projection):
+    """
+    Projection kept in memory, in a list unless primary_key is set
+
+    With primary_key, collection is an IndexedCollection of the documents upserted by project(), with
+    the secondary indexes declared in indexes, which maps fields to HASH or SORTED.
+    """
+
+    primary_key = None
+    indexes = dict()
 
     def __init__(self):
         super().__init__()
-        self.collection = list()
+        if self.primary_key is None:
+            self.collection = list()
+        else:
+            self.collection = IndexedCollection(self.primary_key, self.indexes)
 
     @abc.abstractmethod
     def project(self, obj_id, event_name, event):
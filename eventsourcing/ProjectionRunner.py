@@ -0,0 +1,209 @@
+"""
+Runs a projection over the events of a store, from the checkpoint it reached last time
+
+"""
+from threading import Lock
+import time
+from .CatchUpSubscription import CatchUpSubscription
+from .Checkpoint import CheckpointStore
+from .DomainEventListener import DomainEventListener
+from .EventSourceRepository import Repository
+from .Projection import Projection
+
+
+class ProjectionRunner(DomainEventListener):
+    """
+    Feed a projection with the events of a repository, batch_size events at a time
+
+    After each batch, the projection is flushed and the checkpoint of the projection is saved under name:
+    the position below which every event has been projected. Events projected ahead of it, when they are
+    published out of position order, are remembered so that they are not projected twice. A runner started
+    again resumes after the checkpoint: since a crash can happen between a flush and the checkpoint, the
+    projection may see some events twice and must handle them idempotently.
+
+    Reading the store, the runner does not wait for the positions it skips: an event that only becomes
+    visible after the runner read past its position is left out, unless it is published while start()
+    follows the live events.
+
+    A position may never be published, e.g. one reserved by a save that failed or an event saved by another
+    process. Following the live events, the runner re-reads the store after the checkpoint once max_ahead
+    events are projected ahead of it, or once it has not moved for gap_timeout seconds while events are
+    published, and settles the skipped positions as run() does.
+
+    on_progress, when given, is called with progress() after each batch.
+    """
+
+    def __init__(
+        self,
+        repository,
+        projection,
+        checkpoint_store,
+        name=None,
+        batch_size=1000,
+        on_progress=None,
+        max_ahead=1000,
+        gap_timeout=5.0,
+    ):
+        assert repository is not None
+        assert isinstance(repository, Repository)
+        assert projection is not None
+        assert isinstance(projection, Projection)
+        assert checkpoint_store is not None
+        assert isinstance(checkpoint_store, CheckpointStore)
+        assert batch_size > 0
+        assert max_ahead > 0
+        assert gap_timeout >= 0
+
+        self.repository = repository
+        self.projection = projection
+        self.checkpoint_store = checkpoint_store
+        self.name = name if name is not None else type(projection).__name__
+        self.batch_size = batch_size
+        self.on_progress = on_progress
+        self.max_ahead = max_ahead
+        self.gap_timeout = gap_timeout
+
+        self.position = 0
+        self.__ahead = set()
+        self.__stalled_since = None
+        self.__lock = Lock()
+        self.__subscription = None
+        self.__target_position = 0
+        self.__nb_events = 0
+        self.__started_at = None
+
+    def run(self):
+        """
+        Project the events stored after the checkpoint, then return the progress
+
+        Events saved while it runs may be left for the next run.
+        """
+        self.__begin()
+        self.__catch_up()
+        return self.progress()
+
+    def start(self):
+        """
+        Project the events stored after the checkpoint, then keep projecting the published events
+        """
+        self.__begin()
+        self.__catch_up()
+        self.__subscription = CatchUpSubscription(
+            self.repository, self, self.position, self.batch_size, gap_timeout=self.gap_timeout
+        )
+        self.__subscription.start()
+
+    def stop(self):
+        if self.__subscription is not None:
+            self.__subscription.stop()
+            self.__subscription = None
+
+    def reset(self):
+        """
+        Forget the checkpoint, so that the next run projects every event again
+        """
+        self.checkpoint_store.save_checkpoint(self.name, 0)
+        self.position = 0
+        self.__ahead = set()
+        self.__stalled_since = None
+
+    def __begin(self):
+        self.position = self.checkpoint_store.get_checkpoint(self.name)
+        self.__ahead = set()
+        self.__stalled_since = None
+        self.__target_position = self.repository.last_position()
+        self.__nb_events = 0
+        self.__started_at = time.monotonic()
+
+    def __catch_up(self):
+        batch = list()
+        for event in self.repository.read_all(self.position, self.batch_size):
+            batch.append(event)
+            if len(batch) >= self.batch_size:
+                self.__project(batch, batch[-1].position)
+                batch = list()
+
+        if len(batch) > 0:
+            self.__project(batch, batch[-1].position)
+
+    def domainEventPublished(self, event):
+        self.domainEventsPublished([event])
+
+    def domainEventsPublished(self, events):
+        self.__project(events)
+
+        if self.__must_settle():
+            # The store tells which of the positions the checkpoint waits for will never be published
+            self.__catch_up()
+            with self.__lock:
+                if self.__stalled_since is not None:
+                    self.__stalled_since = time.monotonic()
+
+    def __must_settle(self):
+        with self.__lock:
+            return self.__stalled_since is not None and (
+                len(self.__ahead) >= self.max_ahead
+                or time.monotonic() - self.__stalled_since >= self.gap_timeout
+            )
+
+    def __project(self, events, read_up_to=None):
+        """
+        Project the events not projected yet, then save the checkpoint
+
+        read_up_to is the last position read from the store, the positions it skipped are not waited for.
+        """
+        with self.__lock:
+            events = [
+                event for event in events
+                if getattr(event, "position", None) is None
+                or (event.position > self.position and event.position not in self.__ahead)
+            ]
+
+            if len(events) > 0:
+                self.projection.domainEventsPublished(events)
+                self.projection.flush()
+
+            position = self.position
+            ahead = self.__ahead | set(
+                event.position for event in events if getattr(event, "position", None) is not None
+            )
+            if read_up_to is not None and read_up_to > position:
+                position = read_up_to
+                ahead = set(p for p in ahead if p > position)
+            while position + 1 in ahead:
+                position += 1
+                ahead.discard(position)
+
+            if position != self.position:
+                self.checkpoint_store.save_checkpoint(self.name, position)
+
+            if len(ahead) == 0:
+                self.__stalled_since = None
+            elif self.__stalled_since is None or position != self.position:
+                self.__stalled_since = time.monotonic()
+
+            self.position = position
+            self.__ahead = ahead
+            self.__nb_events += len(events)
+            self.__target_position = max([self.__target_position, self.position] + list(ahead))
+
+            if len(events) == 0:
+                return
+
+        if self.on_progress is not None:
+            self.on_progress(self.progress())
+
+    def progress(self):
+        """
+        Return the name, the checkpoint, the last position of the store when the run started, the number of
+        events projected by this run, its duration and its events per second
+        """
+        elapsed = time.monotonic() - self.__started_at if self.__started_at is not None else 0.0
+        return {
+            "name": self.name,
+            "position": self.position,
+            "target_position": self.__target_position,
+            "events": self.__nb_events,
+            "elapsed": elapsed,
+            "events_per_second": self.__nb_events / elapsed if elapsed > 0 else 0.0,
+        }
@@ -0,0 +1,253 @@
+"""
+Snapshots of domain objects, so that loading them does not replay their whole event stream
+
+"""
+import abc
+import datetime
+import json
+from pymongo import MongoClient
+from .MySQLConnectionPool import MySQLConnectionPool
+
+
+class SnapshotPolicy(metaclass=abc.ABCMeta):
+    @abc.abstractmethod
+    def should_snapshot(self, obj, new_events, snapshot_store):
+        """
+        Tell if a snapshot of obj must be taken after it has been saved
+
+        :param obj: the domain object that has just been saved
+        :param new_events: the events that have just been appended to its stream
+        :param snapshot_store: the store the snapshot would be saved to
+        """
+        raise NotImplementedError()
+
+    def snapshot_taken(self, snapshot):
+        """
+        Called by the repository once the snapshot it was told to take is saved
+        """
+        pass
+
+
+class EveryNEventsSnapshotPolicy(SnapshotPolicy):
+    def __init__(self, nb_events=100):
+        assert nb_events > 0
+        self.nb_events = nb_events
+
+    def should_snapshot(self, obj, new_events, snapshot_store):
+        if len(new_events) == 0:
+            return False
+
+        # A snapshot is due each time the stream crosses a multiple of nb_events
+        previous_version = new_events[0]["version"] - 1
+        return obj.version_number // self.nb_events > previous_version // self.nb_events
+
+
+class EveryTSecondsSnapshotPolicy(SnapshotPolicy):
+    """
+    Snapshot an object once seconds have passed and min_events have been saved since its last snapshot
+
+    The time and version of the last snapshot of an object are read from the store once, then kept by the
+    policy, for max_objects objects at most. Snapshots saved by other processes are not seen, which at worst
+    takes a snapshot early.
+    """
+
+    __NO_SNAPSHOT = (None, 0)
+
+    def __init__(self, seconds=60.0, min_events=1, max_objects=100000):
+        assert seconds >= 0
+        assert max_objects > 0
+        self.seconds = seconds
+        self.min_events = min_events
+        self.max_objects = max_objects
+        self.__last_snapshots = dict()
+
+    def should_snapshot(self, obj, new_events, snapshot_store):
+        if len(new_events) == 0:
+            return False
+
+        last_snapshot = self.__last_snapshots.get(obj.object_id)
+        if last_snapshot is None:
+            snapshot = snapshot_store.get_latest_snapshot(obj.object_id)
+            last_snapshot = (
+                (snapshot["snapshot_timestamp"], snapshot["version"]) if snapshot is not None
+                else EveryTSecondsSnapshotPolicy.__NO_SNAPSHOT
+            )
+            self.__remember(obj.object_id, last_snapshot)
+
+        timestamp, version = last_snapshot
+        if timestamp is None:
+            return obj.version_number >= self.min_events
+
+        now = datetime.datetime.now().timestamp()
+        return (now - timestamp >= self.seconds and
+                obj.version_number - version >= self.min_events)
+
+    def snapshot_taken(self, snapshot):
+        self.__remember(snapshot["object_id"], (snapshot["snapshot_timestamp"], snapshot["version"]))
+
+    def __remember(self, object_id, last_snapshot):
+        self.__last_snapshots.pop(object_id, None)
+        if len(self.__last_snapshots) >= self.max_objects:
+            # The object remembered first is forgotten first
+            del self.__last_snapshots[next(iter(self.__last_snapshots))]
+        self.__last_snapshots[object_id] = last_snapshot
+
+
+class SnapshotStore(metaclass=abc.ABCMeta):
+    @abc.abstractmethod
+    def get_latest_snapshot(self, object_id):
+        raise NotImplementedError()
+
+    def get_latest_snapshots(self, object_ids):
+        """
+        Return a dict giving the latest snapshot of each object_id, objects without snapshot are left out
+        """
+        snapshots = dict()
+        for object_id in object_ids:
+            snapshot = self.get_latest_snapshot(object_id)
+            if snapshot is not None:
+                snapshots[object_id] = snapshot
+        return snapshots
+
+    @abc.abstractmethod
+    def save_snapshot(self, snapshot):
+        raise NotImplementedError()
+
+
+class InMemorySnapshotStore(SnapshotStore):
+    def __init__(self):
+        self.__snapshots = dict()
+
+    def get_latest_snapshot(self, object_id):
+        return self.__snapshots.get(object_id)
+
+    def save_snapshot(self, snapshot):
+        assert snapshot is not None
+
+        # The state is serialized so later mutations of the object do not leak in the snapshot
+        self.__snapshots[snapshot["object_id"]] = {
+            "object_id": snapshot["object_id"],
+            "version": snapshot["version"],
+            "state": json.loads(json.dumps(snapshot["state"])),
+            "snapshot_timestamp": snapshot["snapshot_timestamp"],
+        }
+
+
+class MongoSnapshotStore(SnapshotStore):
+    def __init__(
+        self, host="localhost", port=27017, database="fenrys", collection="snapshot_store"
+    ):
+        self.__client = MongoClient(host, port)
+        self.__db = self.__client[database]
+        self.__collection = self.__db[collection]
+        self.__collection.create_index("object_id", unique=True)
+
+    def get_latest_snapshot(self, object_id):
+        return self.__collection.find_one({"object_id": object_id}, {"_id": False})
+
+    def get_latest_snapshots(self, object_ids):
+        if len(object_ids) == 0:
+            return dict()
+
+        return {
+            snapshot["object_id"]: snapshot
+            for snapshot in self.__collection.find(
+                {"object_id": {"$in": list(object_ids)}}, {"_id": False}
+            )
+        }
+
+    def save_snapshot(self, snapshot):
+        assert snapshot is not None
+
+        self.__collection.replace_one(
+            {"object_id": snapshot["object_id"]},
+            {
+                "object_id": snapshot["object_id"],
+                "version": snapshot["version"],
+                "state": snapshot["state"],
+                "snapshot_timestamp": snapshot["snapshot_timestamp"],
+            },
+            upsert=True,
+        )
+
+
+class MySQLSnapshotStore(SnapshotStore):
+
+    __CREATE_SNAPSHOTS = """create table if not exists `{}`(`object_id` varchar(255) not null, `version` int not null, `state` longtext not null, `snapshot_timestamp` double not null, primary key(`object_id`))"""
+    __SELECT_SNAPSHOT = "select * from `{}` where object_id = %s"
+    __SELECT_SNAPSHOTS = "select * from `{}` where object_id in ({})"
+    __REPLACE_SNAPSHOT = "replace into `{}`(`object_id`, `version`, `state`, `snapshot_timestamp`) values(%s, %s, %s, %s)"
+
+    def __init__(
+        self,
+        user="fenrys",
+        password="fenrys",
+        host="localhost",
+        database="fenrys",
+        table="snapshot_store",
+        min_pool_size=1,
+        max_pool_size=10,
+    ):
+        self.__pool = MySQLConnectionPool.for_dsn(
+            user, password, host, database, min_size=min_pool_size, max_size=max_pool_size
+        )
+        self.__table = table
+
+        self.__create_table()
+
+    def __create_table(self):
+        with self.__pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(MySQLSnapshotStore.__CREATE_SNAPSHOTS.format(self.__table))
+
+    def get_latest_snapshot(self, object_id):
+        with self.__pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(
+                MySQLSnapshotStore.__SELECT_SNAPSHOT.format(self.__table), (object_id,)
+            )
+            result = cursor.fetchone()
+
+        if result is None:
+            return None
+
+        return MySQLSnapshotStore.__to_snapshot(result)
+
+    def get_latest_snapshots(self, object_ids):
+        if len(object_ids) == 0:
+            return dict()
+
+        with self.__pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(
+                MySQLSnapshotStore.__SELECT_SNAPSHOTS.format(
+                    self.__table, ", ".join(["%s"] * len(object_ids))
+                ),
+                tuple(object_ids),
+            )
+            results = cursor.fetchall()
+
+        return {
+            result["object_id"]: MySQLSnapshotStore.__to_snapshot(result)
+            for result in results
+        }
+
+    @staticmethod
+    def __to_snapshot(result):
+        return {
+            "object_id": result["object_id"],
+            "version": int(result["version"]),
+            "state": json.loads(result["state"]),
+            "snapshot_timestamp": float(result["snapshot_timestamp"]),
+        }
+
+    def save_snapshot(self, snapshot):
+        assert snapshot is not None
+
+        with self.__pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(
+                MySQLSnapshotStore.__REPLACE_SNAPSHOT.format(self.__table),
+                (
+                    snapshot["object_id"],
+                    int(snapshot["version"]),
+                    json.dumps(snapshot["state"]),
+                    "{:10.15f}".format(float(snapshot["snapshot_timestamp"])),
+                ),
+            )
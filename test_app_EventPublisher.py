@@ -139,4 +139,40 @@ def test_registration():
     assert ApplicationDomainEventPublisher().instance.contains_listener(listener)
 
     ApplicationDomainEventPublisher().instance.unregister_listener(listener)
-    assert not(ApplicationDomainEventPublisher().instance.contains_listener(listener))
\ No newline at end of file
+    assert not(ApplicationDomainEventPublisher().instance.contains_listener(listener))
+
+
+class BatchAsyncAddDomainEventListener(AsyncDomainEventListener):
+
+    def __init__(self):
+        super().__init__(batch_size=10000)
+        self.batch_sizes = list()
+
+    def domainEventPublished(self, event):
+        raise AssertionError("Events must be published as a batch")
+
+    def domainEventsPublished(self, events):
+        self.batch_sizes.append(len(events))
+
+
+def test_async_batch():
+    listener = BatchAsyncAddDomainEventListener()
+    listener.start()
+
+    obj = AddDomainObject()
+    repo = AddInMemoryRepository()
+    ApplicationDomainEventPublisher().instance.register_listener(listener)
+    for i in range(0, 1000):
+        obj.add(i, i-1)
+    repo.save(obj)
+
+    deadline = time.time() + 10
+    while len(listener.batch_sizes) == 0 and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert listener.batch_sizes == [1001]
+
+    listener.terminate()
+    listener.join()
+
+    ApplicationDomainEventPublisher().instance.unregister_listener(listener)
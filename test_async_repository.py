@@ -0,0 +1,203 @@
+import asyncio
+import time
+
+import pytest
+
+from eventsourcing.AsyncEventSourceRepository import AsyncInMemoryEventSourceRepository
+from eventsourcing.DomainEventListener import ApplicationDomainEventPublisher, AsyncioDomainEventListener, \
+    DomainEventListener
+from eventsourcing.DomainObject import DomainObject
+from eventsourcing.EventSourceRepository import ConcurrencyError
+
+
+class AddDomainObject(DomainObject):
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def add(self, a, b):
+        self.mutate("adding", a + b)
+
+    def on_adding(self, event):
+        self.value = event
+
+
+class AddAsyncInMemoryRepository(AsyncInMemoryEventSourceRepository):
+
+    def __init__(self):
+        super().__init__()
+
+    def create_blank_domain_object(self):
+        return AddDomainObject()
+
+
+class AddDomainEventListener(DomainEventListener):
+
+    def __init__(self):
+        self.nb_events = 0
+
+    def domainEventPublished(self, event):
+        self.nb_events += 1
+
+
+class AsyncioAddDomainEventListener(AsyncioDomainEventListener):
+
+    def __init__(self):
+        self.versions = list()
+
+    async def domainEventPublished(self, event):
+        await asyncio.sleep(0)
+        self.versions.append(event["version"])
+
+
+def test_save_and_load():
+    async def scenario():
+        obj = AddDomainObject()
+        repo = AddAsyncInMemoryRepository()
+        await repo.save(obj)
+
+        for i in range(0, 100):
+            obj.add(i, i - 1)
+        await repo.save(obj)
+
+        assert await repo.exists(obj.object_id)
+        assert not await repo.exists(obj.object_id + "lol")
+        assert await repo.max_version_for_object(obj.object_id) == 101
+        assert await repo.get_event_stream_for(obj.object_id) == obj.event_stream
+
+        reloaded = await repo.load(obj.object_id)
+        assert reloaded.event_stream == obj.event_stream
+        assert reloaded.value == obj.value
+
+    asyncio.run(scenario())
+
+
+def test_conflict():
+    async def scenario():
+        obj = AddDomainObject()
+        repo = AddAsyncInMemoryRepository()
+        await repo.save(obj, 0)
+
+        first = await repo.load(obj.object_id)
+        second = await repo.load(obj.object_id)
+        first.add(1, 2)
+        second.add(3, 4)
+
+        await repo.save(first, 1)
+        with pytest.raises(ConcurrencyError):
+            await repo.save(second, 1)
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_aggregates():
+    async def scenario():
+        repo = AddAsyncInMemoryRepository()
+
+        async def work(i):
+            obj = AddDomainObject()
+            obj.add(i, 0)
+            await repo.save(obj)
+            reloaded = await repo.load(obj.object_id)
+            return reloaded.value
+
+        values = await asyncio.gather(*[work(i) for i in range(0, 1000)])
+        assert values == list(range(0, 1000))
+
+    asyncio.run(scenario())
+
+
+def test_publish_to_listeners():
+    listener = AddDomainEventListener()
+    asyncio_listener = AsyncioAddDomainEventListener()
+
+    publisher = ApplicationDomainEventPublisher().instance
+    publisher.register_listener(listener)
+    publisher.register_listener(asyncio_listener)
+    assert publisher.contains_listener(asyncio_listener)
+
+    async def scenario():
+        obj = AddDomainObject()
+        for i in range(0, 10):
+            obj.add(i, 1)
+        repo = AddAsyncInMemoryRepository()
+        await repo.save(obj)
+
+    asyncio.run(scenario())
+
+    assert listener.nb_events == 11
+    assert asyncio_listener.versions == list(range(1, 12))
+
+    publisher.unregister_listener(listener)
+    publisher.unregister_listener(asyncio_listener)
+    assert not publisher.contains_listener(asyncio_listener)
+
+
+def test_load_many():
+    async def scenario():
+        repo = AddAsyncInMemoryRepository()
+        objs = [AddDomainObject() for _ in range(0, 10)]
+        for i, obj in enumerate(objs):
+            obj.add(i, 1)
+            await repo.save(obj)
+
+        loaded = await repo.load_many([obj.object_id for obj in objs] + ["unknown"])
+        assert len(loaded) == 10
+        for obj in objs:
+            assert loaded[obj.object_id].value == obj.value
+
+    asyncio.run(scenario())
+
+
+def test_read_all():
+    async def scenario():
+        repo = AddAsyncInMemoryRepository()
+        assert await repo.last_position() == 0
+
+        obj1 = AddDomainObject()
+        obj2 = AddDomainObject()
+        obj1.add(1, 1)
+        await repo.save(obj1)
+        await repo.save(obj2)
+        obj1.add(2, 2)
+        await repo.save(obj1)
+
+        events = [event async for event in repo.read_all()]
+        assert [event.position for event in events] == [1, 2, 3, 4]
+        assert [(event.object_id, event.version) for event in events] == [
+            (obj1.object_id, 1), (obj1.object_id, 2), (obj2.object_id, 1), (obj1.object_id, 3)]
+        assert [event.position async for event in repo.read_all(2)] == [3, 4]
+        assert await repo.last_position() == 4
+
+    asyncio.run(scenario())
+
+
+def test_sync_listeners_do_not_block_the_loop():
+    class SlowListener(DomainEventListener):
+        def domainEventPublished(self, event):
+            time.sleep(0.3)
+
+    listener = SlowListener()
+    publisher = ApplicationDomainEventPublisher().instance
+    publisher.register_listener(listener)
+
+    async def scenario():
+        repo = AddAsyncInMemoryRepository()
+        ticks = list()
+
+        async def tick():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.ensure_future(tick())
+        await asyncio.gather(*[repo.save(AddDomainObject()) for _ in range(3)])
+        ticker.cancel()
+
+        # The loop kept running while the listener was called
+        assert max(later - earlier for earlier, later in zip(ticks, ticks[1:])) < 0.2
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        publisher.unregister_listener(listener)
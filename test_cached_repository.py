@@ -0,0 +1,183 @@
+import threading
+import time
+
+from eventsourcing.CachedRepository import CachedRepository
+from eventsourcing.DomainObject import DomainObject
+from eventsourcing.EventSourceRepository import InMemoryEventSourceRepository
+
+
+class AddDomainObject(DomainObject):
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def add(self, a, b):
+        self.mutate("adding", a + b)
+
+    def on_adding(self, event):
+        self.value = event
+
+
+class AddInMemoryRepository(InMemoryEventSourceRepository):
+
+    def __init__(self):
+        super().__init__()
+
+    def create_blank_domain_object(self):
+        return AddDomainObject()
+
+
+def test_hit_and_miss():
+    inner = AddInMemoryRepository()
+    repo = CachedRepository(inner)
+
+    obj = AddDomainObject()
+    obj.add(1, 2)
+    inner.save(obj)
+
+    loaded = repo.load(obj.object_id)
+    assert loaded.value == 3
+    assert repo.misses == 1 and repo.hits == 0
+
+    assert repo.load(obj.object_id) is loaded
+    assert repo.misses == 1 and repo.hits == 1
+
+
+def test_hit_fetches_new_events():
+    inner = AddInMemoryRepository()
+    repo = CachedRepository(inner)
+
+    obj = AddDomainObject()
+    inner.save(obj)
+    loaded = repo.load(obj.object_id)
+
+    obj.add(2, 3)
+    obj.add(3, 4)
+    inner.save(obj)
+
+    reloaded = repo.load(obj.object_id)
+    assert reloaded is loaded
+    assert reloaded.version_number == 3
+    assert reloaded.value == 7
+    assert reloaded.event_stream == obj.event_stream
+
+
+def test_save_keeps_cache_coherent():
+    inner = AddInMemoryRepository()
+    repo = CachedRepository(inner)
+
+    obj = AddDomainObject()
+    obj.add(1, 1)
+    repo.save(obj)
+
+    assert repo.exists(obj.object_id)
+    assert repo.load(obj.object_id) is obj
+    assert repo.hits == 1
+    assert inner.get_event_stream_for(obj.object_id) == obj.event_stream
+
+
+def test_lru_eviction():
+    inner = AddInMemoryRepository()
+    repo = CachedRepository(inner, max_size=2)
+
+    objs = [AddDomainObject() for _ in range(0, 3)]
+    for obj in objs:
+        inner.save(obj)
+
+    repo.load(objs[0].object_id)
+    repo.load(objs[1].object_id)
+    repo.load(objs[0].object_id)
+    repo.load(objs[2].object_id)
+
+    assert len(repo) == 2
+    assert repo.evictions == 1
+    assert objs[0].object_id in repo
+    assert objs[1].object_id not in repo
+
+
+def test_size_eviction():
+    inner = AddInMemoryRepository()
+    repo = CachedRepository(inner, max_size=None, max_events=100)
+
+    big = AddDomainObject()
+    for i in range(0, 80):
+        big.add(i, 1)
+    small = AddDomainObject()
+    repo.save(big)
+    repo.save(small)
+    assert repo.evictions == 0
+
+    other = AddDomainObject()
+    for i in range(0, 30):
+        other.add(i, 1)
+    repo.save(other)
+
+    assert repo.evictions == 1
+    assert big.object_id not in repo
+    assert repo.stats()["events"] == 2 + 32
+
+
+def test_unknown_object_not_cached():
+    repo = CachedRepository(AddInMemoryRepository())
+
+    assert not repo.exists("unknown")
+    repo.load("unknown")
+    assert len(repo) == 0
+
+
+def test_load_many():
+    inner = AddInMemoryRepository()
+    repo = CachedRepository(inner)
+
+    obj1 = AddDomainObject()
+    obj2 = AddDomainObject()
+    inner.save_all([obj1, obj2])
+    cached = repo.load(obj1.object_id)
+
+    obj1.add(1, 2)
+    inner.save(obj1)
+
+    loaded = repo.load_many([obj1.object_id, obj2.object_id, "unknown"])
+    assert loaded[obj1.object_id] is cached
+    assert cached.value == 3
+    assert loaded[obj2.object_id].event_stream == obj2.event_stream
+    assert "unknown" not in loaded
+    assert repo.hits == 1 and repo.misses == 3
+
+
+def test_concurrent_hits():
+    class SlowInMemoryRepository(AddInMemoryRepository):
+        def iter_event_stream_for(self, object_id, after_version=0, batch_size=None):
+            events = list(super().iter_event_stream_for(object_id, after_version, batch_size))
+            time.sleep(0.05)
+            return events
+
+    inner = SlowInMemoryRepository()
+    repo = CachedRepository(inner)
+
+    obj = AddDomainObject()
+    inner.save(obj)
+    cached = repo.load(obj.object_id)
+
+    obj.add(1, 2)
+    obj.add(3, 4)
+    inner.save(obj)
+
+    errors = list()
+
+    def load():
+        try:
+            repo.load(obj.object_id)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=load) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert cached.version_number == 3
+    assert [event["version"] for event in cached.event_stream] == [1, 2, 3]
+    assert cached.value == 7
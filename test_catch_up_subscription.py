@@ -0,0 +1,245 @@
+import pytest
+
+from eventsourcing.CachedRepository import CachedRepository
+from eventsourcing.CatchUpSubscription import CatchUpSubscription
+from eventsourcing.DomainEventListener import ApplicationDomainEventPublisher
+from eventsourcing.DomainObject import DomainObject
+from eventsourcing.EventRecord import EventRecord
+from eventsourcing.EventSourceRepository import InMemoryEventSourceRepository, DomainEventListener
+
+
+class AddDomainObject(DomainObject):
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def add(self, a, b):
+        self.mutate("adding", a + b)
+
+    def on_adding(self, event):
+        self.value = event
+
+
+class AddInMemoryRepository(InMemoryEventSourceRepository):
+
+    def __init__(self):
+        super().__init__()
+
+    def create_blank_domain_object(self):
+        return AddDomainObject()
+
+
+class PositionsListener(DomainEventListener):
+
+    def __init__(self):
+        self.positions = list()
+        self.batch_sizes = list()
+
+    def domainEventPublished(self, event):
+        self.positions.append(event.position)
+
+    def domainEventsPublished(self, events):
+        self.batch_sizes.append(len(events))
+        super().domainEventsPublished(events)
+
+
+def test_positions():
+    repo = AddInMemoryRepository()
+    obj1 = AddDomainObject()
+    obj2 = AddDomainObject()
+    obj1.add(1, 1)
+    repo.save(obj1)
+    repo.save_all([obj2])
+    obj1.add(2, 2)
+    repo.save(obj1)
+
+    events = list(repo.read_all())
+    assert [event.position for event in events] == [1, 2, 3, 4]
+    assert [(event.object_id, event.version) for event in events] == [
+        (obj1.object_id, 1), (obj1.object_id, 2), (obj2.object_id, 1), (obj1.object_id, 3)]
+    assert [event.position for event in repo.read_all(2)] == [3, 4]
+    assert repo.last_position() == 4
+    assert CachedRepository(repo).last_position() == 4
+
+    loaded = repo.load(obj1.object_id)
+    assert [event.position for event in loaded.event_stream] == [1, 2, 4]
+    assert loaded.event_stream == obj1.event_stream
+
+
+def test_position_is_not_a_key():
+    record = EventRecord("obj-1", 2, "adding", 3, 12.5)
+    positioned = record.with_position(7)
+
+    assert positioned.position == 7
+    assert positioned == record
+    assert "position" not in positioned
+    assert dict(positioned) == dict(record)
+    assert positioned.to_dict()["position"] == 7
+    assert EventRecord.from_mapping(positioned.to_dict()).position == 7
+
+
+def test_catch_up_then_live():
+    repo = AddInMemoryRepository()
+    objs = [AddDomainObject() for _ in range(5)]
+    for obj in objs:
+        obj.add(1, 2)
+        repo.save(obj)
+
+    listener = PositionsListener()
+    subscription = CatchUpSubscription(repo, listener, from_position=3, batch_size=4)
+    subscription.start()
+
+    assert subscription.is_live()
+    assert listener.positions == list(range(4, 11))
+    assert listener.batch_sizes == [4, 3]
+    assert subscription.position == 10
+
+    objs[0].add(5, 5)
+    repo.save(objs[0])
+    subscription.stop()
+    objs[0].add(6, 6)
+    repo.save(objs[0])
+
+    assert listener.positions == list(range(4, 12))
+    assert subscription.position == 11
+
+
+def test_events_saved_while_catching_up():
+    repo = AddInMemoryRepository()
+    obj = AddDomainObject()
+    for i in range(5):
+        obj.add(i, i)
+    repo.save(obj)
+
+    class SavingListener(PositionsListener):
+        saved = False
+
+        def domainEventsPublished(self, events):
+            super().domainEventsPublished(events)
+            # Saving from the catch-up publishes events that are also read from the store
+            if not self.saved:
+                self.saved = True
+                obj.add(10, 10)
+                repo.save(obj)
+
+    listener = SavingListener()
+    subscription = CatchUpSubscription(repo, listener, batch_size=2)
+    subscription.start()
+    subscription.stop()
+
+    assert listener.positions == list(range(1, 8))
+
+
+def test_start_failure_unregisters():
+    class FailingRepository(AddInMemoryRepository):
+        def read_all(self, from_position=0, batch_size=None):
+            raise IOError("Store unavailable")
+
+    subscription = CatchUpSubscription(FailingRepository(), PositionsListener())
+    with pytest.raises(IOError):
+        subscription.start()
+
+    assert not ApplicationDomainEventPublisher().instance.contains_listener(subscription)
+
+
+def test_gap_filled_by_live_event():
+    class LaggingRepository(AddInMemoryRepository):
+        # The event at position 2 is not visible yet when the subscription reads the store
+        def read_all(self, from_position=0, batch_size=None):
+            return [event for event in super().read_all(from_position, batch_size) if event.position != 2]
+
+    repo = LaggingRepository()
+    for _ in range(3):
+        repo.save(AddDomainObject())
+    hidden = list(AddInMemoryRepository.read_all(repo))[1]
+
+    listener = PositionsListener()
+    subscription = CatchUpSubscription(repo, listener)
+    publisher = ApplicationDomainEventPublisher().instance
+    subscription.start()
+    try:
+        assert listener.positions == [1, 3]
+
+        publisher.domainEventsPublished([hidden])
+        assert listener.positions == [1, 3, 2]
+
+        # Once the gap is filled, its position is dropped as any position already caught up
+        publisher.domainEventsPublished([hidden])
+        publisher.domainEventsPublished([hidden.with_position(3)])
+        assert listener.positions == [1, 3, 2]
+    finally:
+        subscription.stop()
+
+
+def test_live_events_out_of_order():
+    repo = AddInMemoryRepository()
+    repo.save(AddDomainObject())
+
+    listener = PositionsListener()
+    subscription = CatchUpSubscription(repo, listener)
+    publisher = ApplicationDomainEventPublisher().instance
+    subscription.start()
+    try:
+        publisher.domainEventsPublished([EventRecord("obj-1", 2, "adding", 3, 0.0, position=3)])
+        publisher.domainEventsPublished([EventRecord("obj-1", 1, "adding", 2, 0.0, position=2)])
+    finally:
+        subscription.stop()
+
+    assert listener.positions == [1, 3, 2]
+    assert subscription.position == 3
+
+
+def test_gaps_settled_from_the_store():
+    class LaggingRepository(AddInMemoryRepository):
+        # The event at position 2 is only visible from the second read of the store
+        reads = 0
+
+        def read_all(self, from_position=0, batch_size=None):
+            self.reads += 1
+            return [event for event in super().read_all(from_position, batch_size)
+                    if event.position != 2 or self.reads > 1]
+
+    repo = LaggingRepository()
+    for _ in range(3):
+        repo.save(AddDomainObject())
+
+    listener = PositionsListener()
+    subscription = CatchUpSubscription(repo, listener, gap_timeout=0.0)
+    subscription.start()
+    try:
+        assert listener.positions == [1, 3]
+
+        # Position 2 is never published, the next live event makes the subscription read it
+        repo.save(AddDomainObject())
+        assert listener.positions == [1, 3, 4, 2]
+
+        repo.save(AddDomainObject())
+        assert listener.positions == [1, 3, 4, 2, 5]
+        assert repo.reads == 2
+    finally:
+        subscription.stop()
+
+
+def test_max_gaps():
+    class SparseRepository(AddInMemoryRepository):
+        def read_all(self, from_position=0, batch_size=None):
+            return [event.with_position(event.position * 10)
+                    for event in super().read_all(from_position, batch_size)]
+
+    repo = SparseRepository()
+    for _ in range(3):
+        repo.save(AddDomainObject())
+
+    listener = PositionsListener()
+    subscription = CatchUpSubscription(repo, listener, max_gaps=5)
+    publisher = ApplicationDomainEventPublisher().instance
+    subscription.start()
+    try:
+        assert listener.positions == [10, 20, 30]
+
+        # Only the 5 highest skipped positions are still accepted
+        publisher.domainEventsPublished([EventRecord("obj-1", 1, "adding", 3, 0.0, position=24)])
+        publisher.domainEventsPublished([EventRecord("obj-1", 2, "adding", 3, 0.0, position=25)])
+        assert listener.positions == [10, 20, 30, 25]
+    finally:
+        subscription.stop()
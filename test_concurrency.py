@@ -0,0 +1,86 @@
+from threading import Thread
+
+import pytest
+
+from eventsourcing.DomainObject import DomainObject
+from eventsourcing.EventSourceRepository import InMemoryEventSourceRepository, ConcurrencyError
+
+
+class AddDomainObject(DomainObject):
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def add(self, a, b):
+        self.mutate("adding", a + b)
+
+    def on_adding(self, event):
+        self.value = event
+
+
+class AddInMemoryRepository(InMemoryEventSourceRepository):
+
+    def __init__(self):
+        super().__init__()
+
+    def create_blank_domain_object(self):
+        return AddDomainObject()
+
+
+def test_expected_version():
+    obj = AddDomainObject()
+    repo = AddInMemoryRepository()
+    repo.save(obj, 0)
+
+    obj.add(1, 2)
+    repo.save(obj, 1)
+
+    assert repo.max_version_for_object(obj.object_id) == 2
+    assert repo.get_event_stream_for(obj.object_id) == obj.event_stream
+
+
+def test_conflict():
+    obj = AddDomainObject()
+    repo = AddInMemoryRepository()
+    repo.save(obj)
+
+    first = repo.load(obj.object_id)
+    second = repo.load(obj.object_id)
+
+    first.add(1, 2)
+    repo.save(first, 1)
+
+    second.add(3, 4)
+    with pytest.raises(ConcurrencyError) as e:
+        repo.save(second, 1)
+    assert e.value.object_id == obj.object_id
+    assert e.value.expected_version == 1
+
+    assert repo.get_event_stream_for(obj.object_id) == first.event_stream
+
+
+def test_concurrent_writers():
+    obj = AddDomainObject()
+    repo = AddInMemoryRepository()
+    repo.save(obj)
+
+    results = list()
+
+    def write(value):
+        writer = repo.load(obj.object_id)
+        writer.add(value, 0)
+        try:
+            repo.save(writer, 1)
+            results.append(value)
+        except ConcurrencyError:
+            pass
+
+    threads = [Thread(target=write, args=(i,)) for i in range(0, 20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 1
+    assert repo.max_version_for_object(obj.object_id) == 2
+    assert repo.load(obj.object_id).value == results[0]
@@ -1,4 +1,10 @@
-from eventsourcing.DomainObject import DomainObject
+import json
+import threading
+
+import pytest
+
+from eventsourcing.DomainObject import DomainObject, JSON_VALIDATION, CACHED_JSON_VALIDATION, STRUCTURAL_VALIDATION, \
+    NO_VALIDATION, handles, NoLock
 
 
 class AddDomainObject(DomainObject):
@@ -63,4 +69,232 @@ def test_rehydrate_events():
     assert test_object.version_number == test_object2.version_number
     assert len(test_object.event_stream) == len(test_object2.event_stream)
     assert test_object.event_stream == test_object2.event_stream
-    assert test_object2.object_id == test_object2.event_stream[-1]["object_id"]
\ No newline at end of file
+    assert test_object2.object_id == test_object2.event_stream[-1]["object_id"]
+
+def test_rehydrate_from_iterator():
+    test_object = AddDomainObject()
+
+    for i in range(0, 1000):
+        test_object.add(i, 3)
+
+    test_object2 = AddDomainObject()
+    test_object2.rehydrate(iter(test_object.event_stream))
+
+    assert test_object2.version_number == test_object.version_number
+    assert test_object2.value == test_object.value
+    assert test_object2.event_stream == test_object.event_stream
+
+
+def test_rehydrate_from_unsorted_iterator():
+    test_object = AddDomainObject()
+    test_object.add(1, 2)
+    test_object.add(3, 4)
+
+    test_object2 = AddDomainObject()
+    with pytest.raises(ValueError):
+        test_object2.rehydrate(reversed(test_object.event_stream))
+
+
+def test_event_validation_modes():
+    class CheckedDomainObject(AddDomainObject):
+        pass
+
+    for validation in (JSON_VALIDATION, CACHED_JSON_VALIDATION, STRUCTURAL_VALIDATION):
+        CheckedDomainObject.event_validation = validation
+        test_object = CheckedDomainObject()
+        test_object.mutate("complex", {"a": [1, 2.5, None, True], "b": {"c": "d"}})
+        with pytest.raises(ValueError):
+            test_object.mutate("complex", {"a": object()})
+        assert test_object.version_number == 2
+
+    CheckedDomainObject.event_validation = NO_VALIDATION
+    test_object = CheckedDomainObject()
+    test_object.mutate("complex", {"a": object()})
+    assert test_object.version_number == 2
+
+
+def test_cached_json_validation():
+    class CachedDomainObject(AddDomainObject):
+        event_validation = CACHED_JSON_VALIDATION
+
+    test_object = CachedDomainObject()
+    test_object.add(2, 3)
+
+    assert test_object.encoded_events == {1: json.dumps({"id": test_object.object_id}), 2: "5"}
+
+    test_object.forget_encoded_events(1)
+    assert test_object.encoded_events == {2: "5"}
+
+
+def test_handles_decorator():
+    class DecoratedDomainObject(AddDomainObject):
+        def __init__(self):
+            self.removed = 0
+            super().__init__()
+
+        @handles("removing", "subtracting")
+        def apply_removal(self, event):
+            self.removed += event
+
+    test_object = DecoratedDomainObject()
+    test_object.add(2, 3)
+    test_object.mutate("removing", 2)
+    test_object.mutate("subtracting", 4)
+    test_object.mutate("unknown", 1)
+
+    assert test_object.value == 5
+    assert test_object.removed == 6
+
+    test_object2 = DecoratedDomainObject()
+    test_object2.rehydrate(test_object.event_stream)
+    assert test_object2.value == 5
+    assert test_object2.removed == 6
+
+
+def test_handler_override():
+    class DoubleDomainObject(AddDomainObject):
+        def on_adding(self, event):
+            self.value = event * 2
+
+    class TripleDomainObject(DoubleDomainObject):
+        @handles("adding")
+        def triple(self, event):
+            self.value = event * 3
+
+    double_object = DoubleDomainObject()
+    double_object.add(2, 3)
+    triple_object = TripleDomainObject()
+    triple_object.add(2, 3)
+
+    assert double_object.value == 10
+    assert triple_object.value == 15
+
+
+def test_static_handler():
+    applied = list()
+
+    class StaticDomainObject(DomainObject):
+        @staticmethod
+        def on_adding(event):
+            applied.append(event)
+
+    test_object = StaticDomainObject()
+    test_object.mutate("adding", 5)
+
+    assert applied == [5]
+
+
+def test_class_handler():
+    applied = list()
+
+    class ClassDomainObject(DomainObject):
+        @classmethod
+        def on_adding(cls, event):
+            applied.append((cls, event))
+
+    test_object = ClassDomainObject()
+    test_object.mutate("adding", 5)
+
+    assert applied == [(ClassDomainObject, 5)]
+
+
+def test_instance_handler():
+    test_object = AddDomainObject()
+    removed = list()
+    test_object.on_removing = removed.append
+    test_object.on_adding = lambda event: removed.append(event)
+
+    test_object.mutate("removing", 5)
+    test_object.add(2, 3)
+
+    # The handler of the class comes first
+    assert removed == [5]
+    assert test_object.value == 5
+
+
+def test_lock_factories():
+    for lock_factory in (NoLock, threading.Lock):
+        class LockedDomainObject(AddDomainObject):
+            pass
+
+        LockedDomainObject.lock_factory = lock_factory
+
+        test_object = LockedDomainObject()
+        test_object.add(2, 3)
+        test_object2 = LockedDomainObject()
+        test_object2.rehydrate(test_object.event_stream)
+
+        assert isinstance(test_object.lock, type(lock_factory()))
+        assert test_object2.value == 5
+        assert test_object2.version_number == 2
+
+
+def test_uncommitted_events():
+    test_object = AddDomainObject()
+    test_object.add(2, 3)
+
+    assert test_object.committed_version == 0
+    assert [event["version"] for event in test_object.uncommitted_events] == [1, 2]
+    assert test_object.events_after(0) == test_object.uncommitted_events
+
+    test_object.mark_committed(1)
+    test_object.add(1, 1)
+
+    assert test_object.committed_version == 1
+    assert [event["version"] for event in test_object.uncommitted_events] == [2, 3]
+    assert [event["version"] for event in test_object.events_after(2)] == [3]
+    assert [event["version"] for event in test_object.events_after(0)] == [1, 2, 3]
+
+    test_object.mark_committed()
+    assert test_object.uncommitted_events == []
+    assert len(test_object.event_stream) == 3
+
+    test_object2 = AddDomainObject()
+    test_object2.rehydrate(test_object.event_stream)
+    assert test_object2.committed_version == 3
+    assert test_object2.uncommitted_events == []
+
+
+def test_replay_keeps_uncommitted_events():
+    test_object = AddDomainObject()
+    test_object.add(2, 3)
+    test_object.mark_committed()
+    test_object.add(1, 1)
+
+    test_object.replay([])
+    assert test_object.committed_version == 2
+    assert [event["version"] for event in test_object.uncommitted_events] == [3]
+
+    source = AddDomainObject()
+    source.add(2, 3)
+    replayed = AddDomainObject()
+    replayed.rehydrate(source.event_stream[:1])
+    replayed.replay(source.event_stream[1:])
+    assert replayed.committed_version == 2
+    assert replayed.uncommitted_events == []
+
+
+def test_drop_committed_events():
+    class ForgetfulDomainObject(AddDomainObject):
+        retain_event_stream = False
+
+    test_object = ForgetfulDomainObject()
+    test_object.add(2, 3)
+    test_object.mark_committed()
+    test_object.add(3, 3)
+
+    assert [event["version"] for event in test_object.event_stream] == [3]
+    assert [event["version"] for event in test_object.events_after(2)] == [3]
+    with pytest.raises(ValueError):
+        test_object.events_after(1)
+
+    source = AddDomainObject()
+    for i in range(10):
+        source.add(i, i)
+    test_object2 = ForgetfulDomainObject()
+    test_object2.rehydrate(source.event_stream)
+
+    assert test_object2.event_stream == []
+    assert test_object2.value == 18
+    assert test_object2.version_number == 11
+    assert test_object2.committed_version == 11
@@ -0,0 +1,171 @@
+import threading
+import time
+
+from eventsourcing.DomainEventListener import AsyncDomainEventListener
+from eventsourcing.EventQueue import EventQueue, BLOCK, DROP_OLDEST, SPILL_TO_DISK
+
+
+class CollectingListener(AsyncDomainEventListener):
+
+    def __init__(self, batch_size=100, batch_wait=0.01, **kwargs):
+        super().__init__(batch_size, batch_wait, **kwargs)
+        self.events = list()
+        self.batch_sizes = list()
+
+    def domainEventPublished(self, event):
+        self.events.append(event)
+
+    def domainEventsPublished(self, events):
+        self.batch_sizes.append(len(events))
+        super().domainEventsPublished(events)
+
+
+def test_get_batch():
+    queue = EventQueue()
+    queue.put([1, 2, 3])
+    queue.put([4, 5])
+
+    assert len(queue) == 5
+
+    events, enqueued_at = queue.get_batch(4)
+    assert events == [1, 2, 3, 4]
+    assert enqueued_at <= time.monotonic()
+
+    events, _ = queue.get_batch(4)
+    assert events == [5]
+    assert len(queue) == 0
+
+
+def test_get_batch_waits_to_fill():
+    queue = EventQueue()
+    queue.put([1])
+
+    def put_later():
+        time.sleep(0.05)
+        queue.put([2])
+
+    thread = threading.Thread(target=put_later)
+    thread.start()
+    events, _ = queue.get_batch(2, max_wait=2.0)
+    thread.join()
+
+    assert events == [1, 2]
+
+
+def test_close():
+    queue = EventQueue()
+    queue.put([1, 2])
+    queue.close()
+
+    assert not queue.put([3])
+    assert queue.get_batch(10)[0] == [1, 2]
+    assert queue.get_batch(10) == ([], None)
+
+
+def test_listener_batches_and_stats():
+    listener = CollectingListener(batch_size=4)
+    listener.start()
+
+    listener.queue.put(list(range(10)))
+
+    deadline = time.time() + 10
+    while listener.stats()["events"] < 10 and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert listener.events == list(range(10))
+    assert listener.batch_sizes == [4, 4, 2]
+
+    stats = listener.stats()
+    assert stats["depth"] == 0
+    assert stats["events"] == 10
+    assert stats["batches"] == 3
+    assert stats["max_latency"] >= stats["mean_latency"] > 0
+
+    listener.terminate()
+    listener.join()
+
+
+def test_listener_terminates_without_polling():
+    listener = CollectingListener()
+    listener.start()
+    listener.queue.put([1, 2])
+
+    start = time.monotonic()
+    listener.terminate()
+    listener.join(timeout=2)
+
+    assert not listener.is_alive()
+    assert not listener.is_running()
+    assert time.monotonic() - start < 1
+    assert listener.events == [1, 2]
+
+
+def test_drop_oldest():
+    queue = EventQueue(max_size=3, overflow=DROP_OLDEST)
+    queue.put([1, 2])
+    queue.put([3, 4, 5])
+
+    assert queue.get_batch(10)[0] == [3, 4, 5]
+    assert queue.stats() == {"depth": 0, "spilled": 0, "dropped": 2, "high_water_mark": 3}
+
+
+def test_spill_to_disk(tmp_path):
+    queue = EventQueue(max_size=3, overflow=SPILL_TO_DISK, spill_directory=str(tmp_path))
+    queue.put([{"n": i} for i in range(5)])
+    queue.put([{"n": 5}])
+
+    assert queue.stats() == {"depth": 6, "spilled": 3, "dropped": 0, "high_water_mark": 6}
+
+    assert queue.get_batch(2)[0] == [{"n": 0}, {"n": 1}]
+    queue.put([{"n": 6}])
+    assert queue.get_batch(10)[0] == [{"n": 2}, {"n": 3}, {"n": 4}]
+    assert queue.get_batch(10)[0] == [{"n": 5}, {"n": 6}]
+    assert queue.stats()["spilled"] == 0
+
+
+def test_block():
+    queue = EventQueue(max_size=2, overflow=BLOCK)
+    put_done = threading.Event()
+
+    def put():
+        queue.put([1, 2, 3, 4])
+        put_done.set()
+
+    thread = threading.Thread(target=put)
+    thread.start()
+
+    assert not put_done.wait(0.1)
+    assert len(queue) == 2
+
+    received = list()
+    while len(received) < 4:
+        received.extend(queue.get_batch(10)[0])
+    thread.join()
+
+    assert received == [1, 2, 3, 4]
+    assert queue.stats()["high_water_mark"] == 2
+
+
+def test_block_released_on_close():
+    queue = EventQueue(max_size=1, overflow=BLOCK)
+    results = list()
+
+    thread = threading.Thread(target=lambda: results.append(queue.put([1, 2])))
+    thread.start()
+    time.sleep(0.05)
+    queue.close()
+    thread.join(timeout=2)
+
+    assert results == [False]
+
+
+def test_bounded_listener():
+    listener = CollectingListener(batch_size=10, max_queue_size=5, overflow=DROP_OLDEST)
+    listener.queue.put(list(range(8)))
+    listener.start()
+
+    listener.terminate()
+    listener.join()
+
+    assert listener.events == [3, 4, 5, 6, 7]
+    assert listener.stats()["dropped"] == 3
@@ -0,0 +1,154 @@
+import pickle
+from copy import deepcopy
+
+import pytest
+
+from eventsourcing.DomainObject import DomainObject
+from eventsourcing.EventRecord import EventRecord, FrozenDict, FrozenList, freeze, copy_for_listeners
+from eventsourcing.EventSourceRepository import InMemoryEventSourceRepository
+
+
+class AddDomainObject(DomainObject):
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def add(self, a, b):
+        self.mutate("adding", a + b)
+
+    def on_adding(self, event):
+        self.value = event
+
+
+class FrozenItemsDomainObject(DomainObject):
+    freeze_events = True
+
+    def __init__(self):
+        super().__init__()
+        self.items = list()
+
+    def add_items(self, items):
+        self.mutate("items_added", {"items": items})
+
+    def on_items_added(self, event):
+        self.items.extend(event["items"])
+
+
+class FrozenItemsInMemoryRepository(InMemoryEventSourceRepository):
+
+    def create_blank_domain_object(self):
+        return FrozenItemsDomainObject()
+
+
+def test_dict_compatibility():
+    record = EventRecord("obj-1", 2, "adding", {"a": 1}, 12.5)
+
+    assert record["object_id"] == "obj-1"
+    assert record["version"] == 2
+    assert record.get("event") == {"a": 1}
+    assert record.get("unknown") is None
+    assert "event_name" in record
+    assert "unknown" not in record
+    assert dict(record) == record.to_dict()
+    assert record == {"object_id": "obj-1", "version": 2, "event_name": "adding", "event": {"a": 1},
+                      "event_timestamp": 12.5}
+    with pytest.raises(KeyError):
+        record["unknown"]
+
+
+def test_immutable():
+    record = EventRecord("obj-1", 2, "adding", 3, 12.5)
+
+    with pytest.raises(AttributeError):
+        record.version = 3
+    with pytest.raises(AttributeError):
+        record.extra = 3
+    with pytest.raises(AttributeError):
+        del record.version
+
+
+def test_copy_and_pickle():
+    record = EventRecord("obj-1", 2, "adding", {"a": [1, 2]}, 12.5)
+
+    assert pickle.loads(pickle.dumps(record)) == record
+    copied = deepcopy(record)
+    assert copied == record
+    assert copied.event is not record.event
+
+
+def test_interned_fields():
+    record1 = EventRecord("".join(["obj", "-1"]), 1, "".join(["add", "ing"]), 3, 12.5)
+    record2 = EventRecord("".join(["obj", "-1"]), 2, "".join(["add", "ing"]), 4, 13.5)
+
+    assert record1.object_id is record2.object_id
+    assert record1.event_name is record2.event_name
+
+
+def test_domain_object_records():
+    test_object = AddDomainObject()
+    test_object.add(2, 3)
+
+    assert all(type(event) is EventRecord for event in test_object.event_stream)
+
+    test_object2 = AddDomainObject()
+    test_object2.rehydrate([event.to_dict() for event in test_object.event_stream])
+    assert all(type(event) is EventRecord for event in test_object2.event_stream)
+    assert test_object2.event_stream == test_object.event_stream
+
+
+def test_frozen_payloads():
+    frozen = freeze({"a": [1, {"b": 2}], "c": (3, 4)})
+
+    assert frozen == {"a": [1, {"b": 2}], "c": [3, 4]}
+    assert type(frozen) is FrozenDict
+    assert type(frozen["a"]) is FrozenList
+    assert type(frozen["a"][1]) is FrozenDict
+    assert deepcopy(frozen) is frozen
+    assert pickle.loads(pickle.dumps(frozen)) == frozen
+    with pytest.raises(TypeError):
+        frozen["d"] = 1
+    with pytest.raises(TypeError):
+        frozen["a"].append(5)
+    with pytest.raises(TypeError):
+        frozen["a"][1].update({"b": 3})
+
+
+def test_copy_for_listeners():
+    mutable = EventRecord("obj-1", 1, "adding", {"a": 1}, 12.5)
+    frozen = EventRecord("obj-1", 2, "adding", freeze({"a": 1}), 12.5)
+    scalar = EventRecord("obj-1", 3, "adding", 3, 12.5)
+
+    copies = copy_for_listeners([mutable, frozen, scalar])
+
+    assert copies == [mutable, frozen, scalar]
+    assert copies[0] is not mutable
+    assert copies[1] is frozen
+    assert copies[2] is scalar
+
+
+def test_frozen_domain_object_save_shares_events():
+    repository = FrozenItemsInMemoryRepository()
+    test_object = FrozenItemsDomainObject()
+    test_object.add_items(["a", "b"])
+
+    assert type(test_object.event_stream[-1].event) is FrozenDict
+
+    saved = repository.append_to_stream(test_object)
+
+    assert all(saved_event.event is event.event for saved_event, event in zip(saved, test_object.event_stream))
+
+    loaded = repository.load(test_object.object_id)
+    assert loaded.items == ["a", "b"]
+    assert loaded.event_stream == test_object.event_stream
+
+
+def test_frozen_domain_object_rehydrate_freezes():
+    test_object = FrozenItemsDomainObject()
+    test_object.rehydrate([
+        {"object_id": "obj-1", "version": 1, "event_name": "DomainObjectCreated", "event": {"id": "obj-1"},
+         "event_timestamp": 12.5},
+        {"object_id": "obj-1", "version": 2, "event_name": "items_added", "event": {"items": ["a"]},
+         "event_timestamp": 13.5}])
+
+    assert test_object.items == ["a"]
+    assert all(type(event.event) is FrozenDict for event in test_object.event_stream)
@@ -0,0 +1,191 @@
+import threading
+
+from eventsourcing.DomainObject import DomainObject
+from eventsourcing.EventSourceRepository import InMemoryEventSourceRepository
+from eventsourcing.IndexedCollection import IndexedCollection, HASH, SORTED
+from eventsourcing.Projection import InMemoryProjection
+
+
+class AddDomainObject(DomainObject):
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def add(self, a, b):
+        self.mutate("adding", a + b)
+
+    def remove(self):
+        self.mutate("removed", {})
+
+    def on_adding(self, event):
+        self.value = event
+
+    def on_removed(self, event):
+        pass
+
+
+class AddInMemoryRepository(InMemoryEventSourceRepository):
+
+    def __init__(self):
+        super().__init__()
+
+    def create_blank_domain_object(self):
+        return AddDomainObject()
+
+
+class ValueProjection(InMemoryProjection):
+
+    primary_key = "object_id"
+    indexes = {"parity": HASH, "value": SORTED}
+
+    def project(self, obj_id, event_name, event):
+        if event_name == "adding":
+            self.collection.upsert({"object_id": obj_id, "value": event, "parity": event % 2})
+        elif event_name == "removed":
+            self.collection.delete(obj_id)
+
+
+def people():
+    collection = IndexedCollection("id", {"city": HASH, "age": SORTED})
+    collection.upsert({"id": 1, "city": "Paris", "age": 30})
+    collection.upsert({"id": 2, "city": "Lyon", "age": 25})
+    collection.upsert({"id": 3, "city": "Paris", "age": 41})
+    collection.upsert({"id": 4, "age": 25})
+    return collection
+
+
+def test_primary_key():
+    collection = people()
+
+    assert len(collection) == 4
+    assert 2 in collection
+    assert collection.get(3)["age"] == 41
+    assert collection.get(5) is None
+    assert collection.find("id", 1) == [collection.get(1)]
+
+
+def test_hash_index():
+    collection = people()
+
+    assert [person["id"] for person in collection.find("city", "Paris")] == [1, 3]
+    assert collection.find("city", "Nice") == []
+
+
+def test_sorted_index():
+    collection = people()
+
+    assert [person["id"] for person in collection.find("age", 25)] == [2, 4]
+    assert [person["id"] for person in collection.range("age", 25, 41)] == [2, 4, 1]
+    assert [person["id"] for person in collection.range("age", 25, 41, include_low=False, include_high=True)] == [1, 3]
+    assert [person["id"] for person in collection.range("age", high=30)] == [2, 4]
+    assert [person["id"] for person in collection.range("age", low=30)] == [1, 3]
+
+
+def test_upsert_updates_indexes():
+    collection = people()
+    collection.upsert({"id": 1, "city": "Lyon", "age": 20})
+
+    assert len(collection) == 4
+    assert [person["id"] for person in collection.find("city", "Paris")] == [3]
+    assert [person["id"] for person in collection.find("city", "Lyon")] == [2, 1]
+    assert [person["id"] for person in collection.range("age")] == [1, 2, 4, 3]
+
+
+def test_delete_updates_indexes():
+    collection = people()
+
+    assert collection.delete(2)
+    assert not collection.delete(2)
+    assert 2 not in collection
+    assert [person["id"] for person in collection.find("age", 25)] == [4]
+    assert collection.find("city", "Lyon") == []
+
+
+def test_unindexed_field():
+    collection = IndexedCollection("id")
+    collection.upsert({"id": 1, "city": "Paris"})
+    collection.upsert({"id": 2, "city": "Lyon"})
+
+    assert collection.find("city", "Lyon") == [collection.get(2)]
+
+
+def test_indexed_projection():
+    projection = ValueProjection()
+    repo = AddInMemoryRepository()
+    objs = [AddDomainObject() for _ in range(10)]
+    for i, obj in enumerate(objs):
+        obj.add(i, 0)
+    objs[0].add(10, 0)
+    objs[1].remove()
+
+    for obj in objs:
+        repo.save(obj)
+        projection.domainEventsPublished(obj.event_stream)
+
+    assert len(projection.collection) == 9
+    assert projection.collection.get(objs[0].object_id)["value"] == 10
+    assert len(projection.collection.find("parity", 1)) == 4
+    assert [row["value"] for row in projection.collection.range("value", 5)] == [5, 6, 7, 8, 9, 10]
+
+
+def test_list_projection_by_default():
+    class ListProjection(InMemoryProjection):
+        def project(self, obj_id, event_name, event):
+            self.collection.append(event)
+
+    assert ListProjection().collection == []
+
+
+def test_upsert_modified_document():
+    collection = people()
+    person = collection.get(1)
+    person["city"] = "Lyon"
+    person["age"] = 25
+    collection.upsert(person)
+
+    assert [person["id"] for person in collection.find("city", "Paris")] == [3]
+    assert [person["id"] for person in collection.find("city", "Lyon")] == [2, 1]
+    assert [person["id"] for person in collection.find("age", 25)] == [2, 4, 1]
+    assert collection.find("age", 30) == []
+
+    assert collection.delete(1)
+    assert [person["id"] for person in collection.find("city", "Lyon")] == [2]
+    assert [person["id"] for person in collection.range("age")] == [2, 4, 3]
+
+
+def test_shared_sorted_value():
+    collection = IndexedCollection("id", {"status": SORTED})
+    for i in range(1000):
+        collection.upsert({"id": i, "status": "open"})
+    for i in range(0, 1000, 2):
+        collection.upsert({"id": i, "status": "done"})
+
+    assert len(collection.find("status", "open")) == 500
+    assert [person["id"] for person in collection.range("status", "done", "done", include_high=True)] == list(range(0, 1000, 2))
+
+
+def test_concurrent_reads():
+    collection = IndexedCollection("id", {"age": SORTED, "city": HASH})
+    errors = list()
+
+    def write():
+        for i in range(2000):
+            collection.upsert({"id": i % 50, "age": i, "city": str(i % 7)})
+            if i % 3 == 0:
+                collection.delete((i + 25) % 50)
+
+    def read():
+        try:
+            for _ in range(2000):
+                collection.range("age", 100)
+                collection.find("city", "3")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
@@ -1,4 +1,4 @@
-from eventsourcing.DomainObject import DomainObject
+from eventsourcing.DomainObject import DomainObject, CACHED_JSON_VALIDATION
 from eventsourcing.EventSourceRepository import InMemoryEventSourceRepository
 
 
@@ -90,3 +90,87 @@ def test_not_exists():
     repo.save(obj)
 
     assert not repo.exists(obj.object_id + "lol")
+
+
+def test_max_version():
+    obj1 = AddDomainObject()
+    obj2 = AddDomainObject()
+    repo = AddInMemoryRepository()
+    assert repo.max_version_for_object(obj1.object_id) == 0
+
+    obj1.add(1, 2)
+    repo.save(obj1)
+    repo.save(obj2)
+    assert repo.max_version_for_object(obj1.object_id) == 2
+    assert repo.max_version_for_object(obj2.object_id) == 1
+
+    obj1.add(3, 4)
+    repo.save(obj1)
+    repo.save(obj1)
+    assert repo.max_version_for_object(obj1.object_id) == 3
+    assert repo.get_event_stream_for(obj1.object_id) == obj1.event_stream
+
+
+def test_iter_event_stream():
+    obj = AddDomainObject()
+    repo = AddInMemoryRepository()
+    for i in range(0, 100):
+        obj.add(i, i-1)
+    repo.save(obj)
+
+    assert list(repo.iter_event_stream_for(obj.object_id)) == obj.event_stream
+    assert list(repo.iter_event_stream_for(obj.object_id, 90)) == obj.event_stream[90:]
+    assert list(repo.iter_event_stream_for(obj.object_id + "lol")) == []
+
+
+def test_load_many():
+    repo = AddInMemoryRepository()
+    objs = [AddDomainObject() for _ in range(0, 20)]
+    for i, obj in enumerate(objs):
+        for j in range(0, i):
+            obj.add(i, j)
+        repo.save(obj)
+
+    object_ids = [obj.object_id for obj in objs]
+    loaded = repo.load_many(object_ids + ["unknown"])
+
+    assert sorted(loaded) == sorted(object_ids)
+    for obj in objs:
+        assert loaded[obj.object_id].event_stream == obj.event_stream
+        assert loaded[obj.object_id].value == obj.value
+
+
+def test_save_forgets_encoded_events():
+    class CachedDomainObject(AddDomainObject):
+        event_validation = CACHED_JSON_VALIDATION
+
+    obj = CachedDomainObject()
+    obj.add(1, 2)
+    repo = AddInMemoryRepository()
+    repo.save(obj)
+
+    assert obj.encoded_events == {}
+
+
+def test_save_commits_events():
+    class ForgetfulDomainObject(AddDomainObject):
+        retain_event_stream = False
+
+    class ForgetfulInMemoryRepository(InMemoryEventSourceRepository):
+        def create_blank_domain_object(self):
+            return ForgetfulDomainObject()
+
+    repo = ForgetfulInMemoryRepository()
+    obj = ForgetfulDomainObject()
+    for i in range(100):
+        obj.add(i, 1)
+        repo.save(obj)
+
+        assert obj.uncommitted_events == []
+        assert obj.event_stream == []
+        assert obj.committed_version == i + 2
+
+    loaded = repo.load(obj.object_id)
+    assert loaded.value == 100
+    assert loaded.event_stream == []
+    assert repo.max_version_for_object(obj.object_id) == 101
@@ -0,0 +1,393 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+import eventsourcing.AsyncEventSourceRepository as AsyncEventSourceRepository
+import eventsourcing.EventSourceRepository as EventSourceRepository
+from eventsourcing.AsyncEventSourceRepository import AsyncMongoEventSourceRepository
+from eventsourcing.DomainObject import DomainObject
+from eventsourcing.EventSourceRepository import MongoEventSourceRepository, ConcurrencyError
+
+
+class AddDomainObject(DomainObject):
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def add(self, a, b):
+        self.mutate("adding", a + b)
+
+    def on_adding(self, event):
+        self.value = event
+
+
+class AddMongoRepository(MongoEventSourceRepository):
+
+    def __init__(self):
+        super().__init__()
+
+    def create_blank_domain_object(self):
+        return AddDomainObject()
+
+
+class AddAsyncMongoRepository(AsyncMongoEventSourceRepository):
+
+    def __init__(self):
+        super().__init__()
+
+    def create_blank_domain_object(self):
+        return AddDomainObject()
+
+
+class FakeCollection:
+    """
+    Stands for a Mongo collection with a unique (object_id, version) index, or for the counter of positions,
+    no server is needed
+
+    before_insert, when set, is called before each insert, e.g. to let another writer in.
+    """
+
+    def __init__(self, documents=()):
+        self.documents = list(documents)
+        self.counter = None
+        self.before_insert = None
+        self.version_reads = 0
+
+    def create_index(self, keys, **kwargs):
+        pass
+
+    def find_one(self, filter, projection=None, sort=None):
+        if filter.get("_id") == "position":
+            return dict(self.counter) if self.counter is not None else None
+        if "position" in filter:
+            positions = [document["position"] for document in self.documents if "position" in document]
+            return {"position": max(positions)} if len(positions) > 0 else None
+
+        self.version_reads += 1
+        versions = [document["version"] for document in self.documents
+                    if document["object_id"] == filter["object_id"]]
+        return {"version": max(versions)} if len(versions) > 0 else None
+
+    def update_one(self, filter, update, upsert=False):
+        if self.counter is None:
+            self.counter = {"_id": "position", "position": 0}
+        for name, value in update.get("$max", {}).items():
+            self.counter[name] = max(self.counter.get(name, value), value)
+        self.counter.update(update.get("$set", {}))
+
+    def find_one_and_update(self, filter, update, upsert=False, return_document=None):
+        if self.counter is None:
+            self.counter = {"_id": "position", "position": 0}
+        self.counter["position"] += update["$inc"]["position"]
+        return dict(self.counter)
+
+    def count_documents(self, filter):
+        return len(self.unnumbered())
+
+    def find(self, filter, projection=None, allow_disk_use=False):
+        if "$gt" in filter["position"]:
+            return FakeCursor(sorted(
+                (dict((key, value) for key, value in document.items() if key != "_id")
+                 for document in self.documents if document.get("position", 0) > filter["position"]["$gt"]),
+                key=lambda document: document["position"]))
+        return FakeCursor(self.unnumbered())
+
+    def unnumbered(self):
+        return sorted(
+            (document for document in self.documents if "position" not in document),
+            key=lambda document: (document["event_timestamp"], document["object_id"], document["version"]),
+        )
+
+    def bulk_write(self, requests, ordered=True):
+        positions = dict((request._filter["_id"], request._doc["$set"]["position"]) for request in requests)
+        for document in self.documents:
+            if document.get("_id") in positions and "position" not in document:
+                document["position"] = positions[document["_id"]]
+
+    def aggregate(self, pipeline):
+        object_ids = pipeline[0]["$match"]["object_id"]["$in"]
+        max_versions = dict()
+        for document in self.documents:
+            if document["object_id"] in object_ids:
+                max_versions[document["object_id"]] = max(
+                    max_versions.get(document["object_id"], 0), document["version"])
+        return [{"_id": object_id, "max_version": version} for object_id, version in max_versions.items()]
+
+    def insert_many(self, documents, ordered=True):
+        if self.before_insert is not None:
+            before_insert, self.before_insert = self.before_insert, None
+            before_insert()
+
+        keys = set((document["object_id"], document["version"]) for document in self.documents)
+        for index, document in enumerate(documents):
+            if (document["object_id"], document["version"]) in keys:
+                raise BulkWriteError({"writeErrors": [{"index": index, "code": 11000}], "nInserted": index})
+            self.documents.append(document)
+
+
+class FakeCursor:
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, keys, direction=None):
+        return self
+
+    def close(self):
+        pass
+
+    def batch_size(self, size):
+        return self
+
+    def __iter__(self):
+        return iter(self.documents)
+
+    def __aiter__(self):
+        return self.__async_iter()
+
+    async def __async_iter(self):
+        for document in self.documents:
+            yield document
+
+
+class AsyncFakeCollection:
+    """
+    The awaitable methods of FakeCollection used by AsyncMongoEventSourceRepository
+    """
+
+    def __init__(self):
+        self.collection = FakeCollection()
+
+    async def create_index(self, keys, **kwargs):
+        self.collection.create_index(keys, **kwargs)
+
+    async def find_one(self, filter, projection=None, sort=None):
+        return self.collection.find_one(filter, projection, sort)
+
+    async def update_one(self, filter, update, upsert=False):
+        self.collection.update_one(filter, update, upsert)
+
+    async def find_one_and_update(self, filter, update, upsert=False, return_document=None):
+        return self.collection.find_one_and_update(filter, update, upsert, return_document)
+
+    async def count_documents(self, filter):
+        return self.collection.count_documents(filter)
+
+    def find(self, filter, projection=None, allow_disk_use=False):
+        return self.collection.find(filter, projection, allow_disk_use)
+
+    async def bulk_write(self, requests, ordered=True):
+        self.collection.bulk_write(requests, ordered)
+
+    async def insert_many(self, documents, ordered=True):
+        self.collection.insert_many(documents, ordered)
+
+
+def fake_client(collections, collection_class=FakeCollection):
+    """
+    Return a client class whose collections are taken from collections, created on first use
+    """
+    class Client:
+        def __init__(self, host=None, port=None):
+            pass
+
+        def __getitem__(self, name):
+            return Database()
+
+    class Database:
+        def __getitem__(self, name):
+            return collections.setdefault(name, collection_class())
+
+    return Client
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    collections = dict()
+    monkeypatch.setattr(EventSourceRepository, "MongoClient", fake_client(collections))
+    return lambda: collections["event_store"]
+
+
+def saved_object(repo):
+    obj = AddDomainObject()
+    obj.add(1, 2)
+    repo.save(obj)
+    return obj
+
+
+def test_expected_version(collection):
+    repo = AddMongoRepository()
+    obj = saved_object(repo)
+
+    obj.add(3, 4)
+    repo.save(obj, 2)
+
+    assert repo.max_version_for_object(obj.object_id) == 3
+    assert [document["position"] for document in collection().documents] == [1, 2, 3]
+
+
+def test_expected_version_behind(collection):
+    repo = AddMongoRepository()
+    obj = saved_object(repo)
+
+    obj.add(3, 4)
+    with pytest.raises(ConcurrencyError) as e:
+        repo.save(obj, 1)
+    assert e.value.expected_version == 1
+    assert len(collection().documents) == 2
+
+
+def test_expected_version_ahead(collection):
+    repo = AddMongoRepository()
+    obj = saved_object(repo)
+
+    obj.add(3, 4)
+    obj.add(5, 6)
+    with pytest.raises(ConcurrencyError) as e:
+        repo.save(obj, 3)
+    assert e.value.expected_version == 3
+    assert len(collection().documents) == 2
+
+    with pytest.raises(ConcurrencyError):
+        repo.save(obj, 4)
+    assert len(collection().documents) == 2
+
+
+def test_new_stream_is_not_read(collection):
+    repo = AddMongoRepository()
+    obj = AddDomainObject()
+    obj.add(1, 2)
+
+    repo.save(obj, 0)
+    assert collection().version_reads == 0
+
+    # The unique index rejects the stream once it exists
+    obj.add(3, 4)
+    with pytest.raises(ConcurrencyError):
+        repo.save(obj, 0)
+    assert len(collection().documents) == 2
+
+
+def test_concurrent_writer(collection):
+    repo = AddMongoRepository()
+    obj = saved_object(repo)
+
+    def other_writer():
+        collection().documents.append({"object_id": obj.object_id, "version": 3})
+
+    collection().before_insert = other_writer
+    obj.add(3, 4)
+    with pytest.raises(ConcurrencyError) as e:
+        repo.save(obj, 2)
+    assert e.value.object_id == obj.object_id
+
+
+def test_save_all_expected_versions(collection):
+    repo = AddMongoRepository()
+    first = saved_object(repo)
+    second = saved_object(repo)
+
+    first.add(3, 4)
+    second.add(3, 4)
+    with pytest.raises(ConcurrencyError) as e:
+        repo.save_all([first, second], {first.object_id: 2, second.object_id: 5})
+    assert e.value.object_id == second.object_id
+    assert e.value.saved_events == []
+    assert len(collection().documents) == 4
+
+    repo.save_all([first, second], {first.object_id: 2, second.object_id: 2})
+    assert len(collection().documents) == 6
+
+
+def test_save_all_concurrent_writer(collection):
+    repo = AddMongoRepository()
+    first = saved_object(repo)
+    second = saved_object(repo)
+
+    def other_writer():
+        collection().documents.append({"object_id": second.object_id, "version": 3})
+
+    collection().before_insert = other_writer
+    first.add(3, 4)
+    second.add(3, 4)
+    with pytest.raises(ConcurrencyError) as e:
+        repo.save_all([first, second])
+    assert e.value.object_id == second.object_id
+    assert [event["object_id"] for event in e.value.saved_events] == [first.object_id]
+
+
+def test_async_expected_versions(monkeypatch):
+    collections = dict()
+    monkeypatch.setattr(
+        AsyncEventSourceRepository, "AsyncMongoClient", fake_client(collections, AsyncFakeCollection))
+
+    async def scenario():
+        repo = AddAsyncMongoRepository()
+        obj = AddDomainObject()
+        obj.add(1, 2)
+        await repo.save(obj)
+        documents = collections["event_store"].collection.documents
+
+        obj.add(3, 4)
+        for expected_version in (1, 3):
+            with pytest.raises(ConcurrencyError) as e:
+                await repo.save(obj, expected_version)
+            assert e.value.expected_version == expected_version
+        assert len(documents) == 2
+
+        await repo.save(obj, 2)
+        assert [document["position"] for document in documents] == [1, 2, 3]
+
+    asyncio.run(scenario())
+
+
+def legacy_documents():
+    # Events stored before positions existed
+    return [
+        {"_id": 1, "object_id": "obj-2", "version": 1, "event_name": "DomainObjectCreated", "event": {},
+         "event_timestamp": 2.0},
+        {"_id": 2, "object_id": "obj-1", "version": 1, "event_name": "DomainObjectCreated", "event": {},
+         "event_timestamp": 1.0},
+        {"_id": 3, "object_id": "obj-1", "version": 2, "event_name": "adding", "event": 3,
+         "event_timestamp": 3.0},
+    ]
+
+
+def test_add_positions_to_existing_collection(monkeypatch):
+    collections = {"event_store": FakeCollection(legacy_documents())}
+    monkeypatch.setattr(EventSourceRepository, "MongoClient", fake_client(collections))
+
+    repo = AddMongoRepository()
+    documents = collections["event_store"].documents
+    assert sorted(
+        (document["position"], document["object_id"], document["version"]) for document in documents
+    ) == [(1, "obj-1", 1), (2, "obj-2", 1), (3, "obj-1", 2)]
+    assert [event.position for event in repo.read_all()] == [1, 2, 3]
+    assert repo.last_position() == 3
+
+    obj = saved_object(repo)
+    assert [document["position"] for document in documents if document["object_id"] == obj.object_id] == [4, 5]
+
+    # Once numbered, the collection is left alone
+    documents.append(dict(legacy_documents()[0], _id=4, object_id="obj-3"))
+    AddMongoRepository()
+    assert "position" not in documents[-1]
+
+
+def test_async_add_positions_to_existing_collection(monkeypatch):
+    legacy = AsyncFakeCollection()
+    legacy.collection.documents = legacy_documents()
+    collections = {"event_store": legacy}
+    monkeypatch.setattr(
+        AsyncEventSourceRepository, "AsyncMongoClient", fake_client(collections, AsyncFakeCollection))
+
+    async def scenario():
+        repo = AddAsyncMongoRepository()
+        assert await repo.last_position() == 3
+
+        obj = AddDomainObject()
+        await repo.save(obj)
+        assert sorted(document["position"] for document in legacy.collection.documents) == [1, 2, 3, 4]
+
+    asyncio.run(scenario())
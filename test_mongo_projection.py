@@ -0,0 +1,107 @@
+import time
+
+from pymongo import ASCENDING, IndexModel, InsertOne, UpdateOne
+
+from eventsourcing.EventRecord import EventRecord
+from eventsourcing.Projection import MongoProjection
+
+
+class RecordingCollection:
+    """
+    Stands for the projection collection, no Mongo server is needed
+    """
+
+    def __init__(self):
+        self.bulk_writes = list()
+        self.indexes = list()
+
+    def bulk_write(self, requests, ordered=True):
+        self.bulk_writes.append((list(requests), ordered))
+
+    def create_indexes(self, indexes):
+        self.indexes.extend(indexes)
+
+
+class CountProjection(MongoProjection):
+
+    bulk_size = 10
+
+    def __init__(self):
+        super().__init__()
+        self.collection = RecordingCollection()
+
+    def project(self, obj_id, event_name, event):
+        if event_name == "adding":
+            self.update_one({"_id": obj_id}, {"$set": {"value": event}}, upsert=True)
+        elif event_name == "logging":
+            self.insert_one({"object_id": obj_id, "value": event})
+
+
+def events_for(obj_id, event_name, values):
+    return [
+        EventRecord(obj_id, i + 1, event_name, value, 0.0)
+        for i, value in enumerate(values)
+    ]
+
+
+def test_flush_by_size_and_end_of_batch():
+    projection = CountProjection()
+    projection.domainEventsPublished(events_for("a", "logging", range(25)))
+
+    writes = projection.collection.bulk_writes
+    assert [len(requests) for requests, _ in writes] == [10, 10, 5]
+    assert all(not ordered for _, ordered in writes)
+    assert all(isinstance(request, InsertOne) for requests, _ in writes for request in requests)
+    assert projection.pending_writes() == 0
+
+
+def test_flush_by_time():
+    projection = CountProjection()
+    projection.flush_interval = 0.05
+
+    projection.project("a", "adding", 1)
+    assert projection.pending_writes() == 1
+    time.sleep(0.1)
+    projection.project("b", "adding", 2)
+
+    assert projection.pending_writes() == 0
+    assert len(projection.collection.bulk_writes[0][0]) == 2
+
+
+def test_ordered_when_writes_share_a_document():
+    projection = CountProjection()
+    projection.domainEventsPublished(
+        events_for("a", "adding", [1]) + events_for("b", "adding", [2]))
+    projection.domainEventsPublished(events_for("a", "adding", [1, 2]))
+    projection.delete_many({"value": 2})
+    projection.flush()
+
+    writes = projection.collection.bulk_writes
+    assert [ordered for _, ordered in writes] == [False, True, True]
+    assert isinstance(writes[0][0][0], UpdateOne)
+
+
+def test_forced_ordering():
+    projection = CountProjection()
+    projection.ordered_writes = True
+    projection.domainEventsPublished(events_for("a", "logging", range(3)))
+
+    assert projection.collection.bulk_writes[0][1]
+
+
+def test_create_indexes():
+    projection = CountProjection()
+    projection.indexes = ["value", [("object_id", ASCENDING), ("value", ASCENDING)]]
+    projection.create_indexes()
+
+    indexes = projection.collection.indexes
+    assert all(isinstance(index, IndexModel) for index in indexes)
+    assert [index.document["key"] for index in indexes] == [
+        {"value": ASCENDING}, {"object_id": ASCENDING, "value": ASCENDING}]
+
+
+def test_flush_without_writes():
+    projection = CountProjection()
+    projection.flush()
+
+    assert projection.collection.bulk_writes == []
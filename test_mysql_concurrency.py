@@ -0,0 +1,398 @@
+import asyncio
+import re
+import uuid
+
+import aiomysql
+import pymysql
+import pytest
+
+from eventsourcing.AsyncEventSourceRepository import AsyncMySQLSourceRepository
+from eventsourcing.DomainObject import DomainObject
+from eventsourcing.EventSourceRepository import MySQLSourceRepository, ConcurrencyError
+
+
+class AddDomainObject(DomainObject):
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def add(self, a, b):
+        self.mutate("adding", a + b)
+
+    def on_adding(self, event):
+        self.value = event
+
+
+class AddMySQLRepository(MySQLSourceRepository):
+
+    def __init__(self, database):
+        super().__init__(database=database)
+
+    def create_blank_domain_object(self):
+        return AddDomainObject()
+
+
+class AddAsyncMySQLRepository(AsyncMySQLSourceRepository):
+
+    def __init__(self):
+        super().__init__()
+
+    def create_blank_domain_object(self):
+        return AddDomainObject()
+
+
+class FakeServer:
+    """
+    Stands for a MySQL server, answering the statements of MySQLSourceRepository only
+
+    before_insert, when set, is called before each insert, e.g. to let another writer in.
+    """
+
+    def __init__(self, rows=(), table_exists=False, position_column=True):
+        self.rows = list(rows)
+        self.position = None
+        self.before_insert = None
+        self.table_exists = table_exists
+        self.position_column = position_column
+        self.statements = list()
+        self.commits = 0
+
+    def connect(self, **parameters):
+        return FakeConnection(self)
+
+
+class FakeConnection:
+
+    def __init__(self, server):
+        self.server = server
+        self.open = True
+        self.pending = list()
+        self.last_insert_id = 0
+
+    def cursor(self, cursorclass=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.server.commits += 1
+        self.server.rows.extend(self.pending)
+        self.pending = list()
+
+    def rollback(self):
+        self.pending = list()
+
+    def ping(self, reconnect=True):
+        pass
+
+    def close(self):
+        self.open = False
+
+
+class FakeCursor:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.results = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def execute(self, statement, parameters=None):
+        server = self.connection.server
+        server.statements.append(statement.split("`")[0].strip())
+        self.results = list()
+
+        if statement.startswith("update") and "last_insert_id" in statement:
+            server.position += parameters[0]
+            self.connection.last_insert_id = server.position
+        elif statement.startswith("update"):
+            rows = sorted((row for row in server.rows if row[5] is None), key=lambda row: (row[4], row[0], row[1]))
+            first_position = max([row[5] for row in server.rows if row[5] is not None] + [0]) + 1
+            numbered = dict((row[:2], row[:5] + (first_position + i,)) for i, row in enumerate(rows))
+            server.rows = [numbered.get(row[:2], row) for row in server.rows]
+        elif statement.startswith("insert ignore"):
+            if server.position is None:
+                server.position = max([row[5] for row in server.rows if row[5] is not None] + [0])
+        elif statement.startswith("show tables"):
+            self.results = [{"table": parameters}] if server.table_exists else []
+        elif statement.startswith("show columns"):
+            self.results = [{"Field": "position"}] if server.position_column else []
+        elif statement.startswith("alter table"):
+            server.position_column = True
+        elif statement.startswith("select last_insert_id()"):
+            self.results = [{"position": self.connection.last_insert_id}]
+        elif statement.startswith("select max(version)"):
+            versions = [row[1] for row in server.rows if row[0] == parameters[0]]
+            self.results = [{"max_version": max(versions) if len(versions) > 0 else None}]
+        elif statement.startswith("select object_id, max(version)"):
+            max_versions = dict()
+            for row in server.rows:
+                if row[0] in parameters:
+                    max_versions[row[0]] = max(max_versions.get(row[0], 0), row[1])
+            self.results = [
+                {"object_id": object_id, "max_version": version}
+                for object_id, version in max_versions.items()
+            ]
+        else:
+            assert re.match("create table|set @position", statement)
+
+    def executemany(self, statement, rows):
+        server = self.connection.server
+        if server.before_insert is not None:
+            before_insert, server.before_insert = server.before_insert, None
+            before_insert()
+
+        keys = set((row[0], row[1]) for row in server.rows + self.connection.pending)
+        for row in rows:
+            if (row[0], row[1]) in keys:
+                raise pymysql.err.IntegrityError(1062, "Duplicate entry")
+            self.connection.pending.append(row)
+
+    def fetchone(self):
+        return self.results[0] if len(self.results) > 0 else None
+
+    def fetchall(self):
+        return self.results
+
+
+class AsyncFakePool:
+    """
+    The aiomysql pool of AsyncMySQLSourceRepository over a FakeServer
+    """
+
+    def __init__(self, server):
+        self.server = server
+
+    def acquire(self):
+        return AsyncFakeConnection(FakeConnection(self.server))
+
+
+class AsyncFakeConnection:
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def cursor(self, cursorclass=None):
+        return AsyncFakeCursor(self.connection.cursor(), cursorclass is None)
+
+    async def commit(self):
+        self.connection.commit()
+
+    async def rollback(self):
+        self.connection.rollback()
+
+
+class AsyncFakeCursor:
+
+    def __init__(self, cursor, as_tuples):
+        self.cursor = cursor
+        self.as_tuples = as_tuples
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return False
+
+    async def execute(self, statement, parameters=None):
+        self.cursor.execute(statement, parameters)
+
+    async def executemany(self, statement, rows):
+        self.cursor.executemany(statement, rows)
+
+    async def fetchone(self):
+        result = self.cursor.fetchone()
+        # The default cursor of aiomysql returns tuples
+        return tuple(result.values()) if self.as_tuples and result is not None else result
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer()
+    monkeypatch.setattr(pymysql, "connect", server.connect)
+    return server
+
+
+@pytest.fixture
+def repo(server):
+    # Pools are shared by database, each test gets its own
+    return AddMySQLRepository("test-{}".format(uuid.uuid4()))
+
+
+def saved_object(repo):
+    obj = AddDomainObject()
+    obj.add(1, 2)
+    repo.save(obj)
+    return obj
+
+
+def test_expected_version(server, repo):
+    obj = saved_object(repo)
+
+    obj.add(3, 4)
+    repo.save(obj, 2)
+
+    assert repo.max_version_for_object(obj.object_id) == 3
+    assert [row[5] for row in server.rows] == [1, 2, 3]
+
+
+def test_single_transaction(server, repo):
+    obj = saved_object(repo)
+    server.commits = 0
+    server.statements = list()
+
+    obj.add(3, 4)
+    repo.save(obj, 2)
+    second = AddDomainObject()
+    repo.save_all([obj, second], {second.object_id: 0})
+
+    # The stored versions are read in the transactions of the inserts
+    assert server.commits == 2
+    assert server.statements.count("update") == 2
+
+
+def test_expected_version_behind(server, repo):
+    obj = saved_object(repo)
+
+    obj.add(3, 4)
+    with pytest.raises(ConcurrencyError) as e:
+        repo.save(obj, 1)
+    assert e.value.expected_version == 1
+    assert len(server.rows) == 2
+
+
+def test_expected_version_ahead(server, repo):
+    obj = saved_object(repo)
+
+    obj.add(3, 4)
+    obj.add(5, 6)
+    with pytest.raises(ConcurrencyError) as e:
+        repo.save(obj, 3)
+    assert e.value.expected_version == 3
+    assert len(server.rows) == 2
+
+
+def test_concurrent_writer(server, repo):
+    obj = saved_object(repo)
+
+    def other_writer():
+        server.rows.append((obj.object_id, 3))
+
+    server.before_insert = other_writer
+    obj.add(3, 4)
+    with pytest.raises(ConcurrencyError) as e:
+        repo.save(obj, 2)
+    assert e.value.object_id == obj.object_id
+
+
+def test_save_all_expected_versions(server, repo):
+    first = saved_object(repo)
+    second = saved_object(repo)
+
+    first.add(3, 4)
+    second.add(3, 4)
+    with pytest.raises(ConcurrencyError) as e:
+        repo.save_all([first, second], {first.object_id: 2, second.object_id: 5})
+    assert e.value.object_id == second.object_id
+    assert len(server.rows) == 4
+
+    repo.save_all([first, second], {first.object_id: 2, second.object_id: 2})
+    assert len(server.rows) == 6
+
+
+def test_save_all_concurrent_writer_rolls_back(server, repo):
+    first = saved_object(repo)
+    second = saved_object(repo)
+
+    def other_writer():
+        server.rows.append((second.object_id, 3))
+
+    server.before_insert = other_writer
+    first.add(3, 4)
+    second.add(3, 4)
+    with pytest.raises(ConcurrencyError) as e:
+        repo.save_all([first, second])
+    assert e.value.saved_events == []
+    assert len(server.rows) == 5
+
+
+def test_add_positions_to_existing_table(monkeypatch):
+    legacy_rows = [
+        ("obj-2", 1, "DomainObjectCreated", "{}", 2.0, None),
+        ("obj-1", 1, "DomainObjectCreated", "{}", 1.0, None),
+        ("obj-1", 2, "adding", "3", 3.0, None),
+    ]
+    server = FakeServer(legacy_rows, table_exists=True, position_column=False)
+    monkeypatch.setattr(pymysql, "connect", server.connect)
+
+    repo = AddMySQLRepository("test-{}".format(uuid.uuid4()))
+    assert "alter table" in server.statements
+    assert "create table" not in server.statements
+    assert sorted((row[5], row[0], row[1]) for row in server.rows) == [
+        (1, "obj-1", 1), (2, "obj-2", 1), (3, "obj-1", 2)]
+
+    obj = saved_object(repo)
+    assert [row[5] for row in server.rows if row[0] == obj.object_id] == [4, 5]
+
+    # Once migrated, the table is left alone
+    server.statements = list()
+    AddMySQLRepository("test-{}".format(uuid.uuid4()))
+    assert "alter table" not in server.statements
+
+
+def test_async_expected_versions(monkeypatch):
+    server = FakeServer()
+
+    async def create_pool(**parameters):
+        return AsyncFakePool(server)
+
+    monkeypatch.setattr(aiomysql, "create_pool", create_pool)
+
+    async def scenario():
+        repo = AddAsyncMySQLRepository()
+        obj = AddDomainObject()
+        obj.add(1, 2)
+        await repo.save(obj)
+        server.commits = 0
+
+        obj.add(3, 4)
+        for expected_version in (1, 3):
+            with pytest.raises(ConcurrencyError):
+                await repo.save(obj, expected_version)
+        await repo.save(obj, 2)
+
+    asyncio.run(scenario())
+    assert [row[1] for row in server.rows] == [1, 2, 3]
+    # The versions are read in the transactions of the inserts
+    assert server.commits == 1
+
+
+def test_async_add_positions_to_existing_table(monkeypatch):
+    legacy_rows = [
+        ("obj-2", 1, "DomainObjectCreated", "{}", 2.0, None),
+        ("obj-1", 1, "DomainObjectCreated", "{}", 1.0, None),
+    ]
+    server = FakeServer(legacy_rows, table_exists=True, position_column=False)
+
+    async def create_pool(**parameters):
+        return AsyncFakePool(server)
+
+    monkeypatch.setattr(aiomysql, "create_pool", create_pool)
+
+    async def scenario():
+        repo = AddAsyncMySQLRepository()
+        obj = AddDomainObject()
+        await repo.save(obj)
+
+    asyncio.run(scenario())
+    assert "alter table" in server.statements
+    assert sorted((row[5], row[0]) for row in server.rows)[:2] == [(1, "obj-1"), (2, "obj-2")]
+    assert [row[5] for row in server.rows if row[0].startswith("AddDomainObject")] == [3]
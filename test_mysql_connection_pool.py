@@ -0,0 +1,201 @@
+import threading
+import time
+import uuid
+
+import pymysql
+import pytest
+
+from eventsourcing.MySQLConnectionPool import MySQLConnectionPool, PoolTimeoutError
+
+
+class FakeConnection:
+    """
+    Stands for a pymysql connection, no server is needed
+    """
+
+    def __init__(self, **parameters):
+        self.parameters = parameters
+        self.open = True
+        self.commits = 0
+        self.rollbacks = 0
+        self.pings = 0
+        self.fail_rollback = False
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        if self.fail_rollback:
+            raise pymysql.err.OperationalError(2013, "Lost connection")
+        self.rollbacks += 1
+
+    def ping(self, reconnect=True):
+        self.pings += 1
+
+    def close(self):
+        self.open = False
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    connections = list()
+
+    def connect(**parameters):
+        connection = FakeConnection(**parameters)
+        connections.append(connection)
+        return connection
+
+    monkeypatch.setattr(pymysql, "connect", connect)
+    return connections
+
+
+def new_pool(min_size=1, max_size=2, **kwargs):
+    return MySQLConnectionPool("user", "password", "host", "db", min_size=min_size, max_size=max_size, **kwargs)
+
+
+def test_min_size(connections):
+    pool = new_pool(min_size=2, max_size=3)
+
+    assert len(connections) == 2
+    assert pool.stats() == {"size": 2, "idle": 2}
+    assert connections[0].parameters["db"] == "db"
+    assert connections[0].parameters["autocommit"] is False
+
+
+def test_acquire_and_release(connections):
+    pool = new_pool(min_size=1, max_size=2)
+
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first is connections[0]
+    assert second is connections[1]
+    assert pool.stats() == {"size": 2, "idle": 0}
+
+    pool.release(first)
+    assert pool.acquire() is first
+
+
+def test_acquire_timeout(connections):
+    pool = new_pool(min_size=0, max_size=1)
+    pool.acquire()
+
+    start = time.monotonic()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire(timeout=0.05)
+    assert time.monotonic() - start >= 0.05
+
+
+def test_acquire_waits_for_release(connections):
+    pool = new_pool(min_size=0, max_size=1)
+    connection = pool.acquire()
+
+    releaser = threading.Timer(0.05, pool.release, (connection,))
+    releaser.start()
+    assert pool.acquire(timeout=5) is connection
+    releaser.join()
+
+
+def test_release_discard(connections):
+    pool = new_pool(min_size=0, max_size=1)
+    connection = pool.acquire()
+
+    pool.release(connection, discard=True)
+    assert not connection.open
+    assert pool.stats() == {"size": 0, "idle": 0}
+
+    assert pool.acquire(timeout=0.05) is connections[1]
+
+
+def test_release_closed_connection(connections):
+    pool = new_pool(min_size=0, max_size=1)
+    connection = pool.acquire()
+    connection.close()
+
+    pool.release(connection)
+    assert pool.stats() == {"size": 0, "idle": 0}
+
+
+def test_health_check(connections):
+    pool = new_pool(min_size=1, health_check_interval=0.0)
+
+    connection = pool.acquire()
+    assert connection.pings == 1
+
+
+def test_connection_commits(connections):
+    pool = new_pool()
+
+    with pool.connection() as connection:
+        pass
+
+    assert connection.commits == 1
+    assert connection.rollbacks == 0
+    assert pool.stats() == {"size": 1, "idle": 1}
+
+
+def test_connection_rolls_back(connections):
+    pool = new_pool()
+
+    with pytest.raises(ValueError):
+        with pool.connection() as connection:
+            raise ValueError()
+
+    assert connection.commits == 0
+    assert connection.rollbacks == 1
+    assert connection.open
+    assert pool.stats() == {"size": 1, "idle": 1}
+
+
+def test_connection_discarded_on_operational_error(connections):
+    pool = new_pool()
+
+    with pytest.raises(pymysql.err.OperationalError):
+        with pool.connection() as connection:
+            raise pymysql.err.OperationalError(2006, "MySQL server has gone away")
+
+    assert connection.rollbacks == 0
+    assert not connection.open
+    assert pool.stats() == {"size": 0, "idle": 0}
+
+
+def test_connection_discarded_when_rollback_fails(connections):
+    pool = new_pool()
+
+    with pytest.raises(ValueError):
+        with pool.connection() as connection:
+            connection.fail_rollback = True
+            raise ValueError()
+
+    assert not connection.open
+    assert pool.stats() == {"size": 0, "idle": 0}
+
+
+def test_close(connections):
+    pool = new_pool(min_size=2, max_size=3)
+    in_use = pool.acquire()
+
+    idle = [connection for connection in connections if connection is not in_use]
+
+    pool.close()
+    assert pool.closed
+    assert not idle[0].open
+    assert in_use.open
+
+    pool.release(in_use)
+    assert not in_use.open
+    assert pool.stats() == {"size": 0, "idle": 0}
+
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+
+
+def test_for_dsn_sharing(connections):
+    database = "db-{}".format(uuid.uuid4())
+
+    pool = MySQLConnectionPool.for_dsn("user", "password", "host", database)
+    assert MySQLConnectionPool.for_dsn("user", "password", "host", database) is pool
+    assert MySQLConnectionPool.for_dsn("other", "password", "host", database) is not pool
+    assert MySQLConnectionPool.for_dsn("user", "password", "host", database, port=3307) is not pool
+
+    pool.close()
+    assert MySQLConnectionPool.for_dsn("user", "password", "host", database) is not pool
@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+
+from eventsourcing.DomainEventListener import ApplicationDomainEventPublisher, ListenerDispatchError
+from eventsourcing.DomainObject import DomainObject
+from eventsourcing.EventSourceRepository import InMemoryEventSourceRepository, DomainEventListener
+
+
+class AddDomainObject(DomainObject):
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def add(self, a, b):
+        self.mutate("adding", a + b)
+
+    def on_adding(self, event):
+        self.value = event
+
+
+class AddInMemoryRepository(InMemoryEventSourceRepository):
+
+    def __init__(self):
+        super().__init__()
+
+    def create_blank_domain_object(self):
+        return AddDomainObject()
+
+
+class SlowDomainEventListener(DomainEventListener):
+
+    def __init__(self, delay, calls=None, error=None):
+        self.delay = delay
+        self.calls = calls if calls is not None else list()
+        self.error = error
+        self.threads = list()
+
+    def domainEventPublished(self, event):
+        pass
+
+    def domainEventsPublished(self, events):
+        time.sleep(self.delay)
+        self.threads.append(threading.current_thread())
+        self.calls.append(self)
+        if self.error is not None:
+            raise self.error
+
+
+@pytest.fixture
+def publisher():
+    publisher = ApplicationDomainEventPublisher().instance
+    publisher.enable_parallel_dispatch(max_workers=4)
+    yield publisher
+    publisher.disable_parallel_dispatch()
+
+
+def test_parallel_dispatch(publisher):
+    listeners = [SlowDomainEventListener(0.2) for _ in range(3)]
+    for listener in listeners:
+        publisher.register_listener(listener)
+
+    repo = AddInMemoryRepository()
+    start = time.monotonic()
+    repo.save(AddDomainObject())
+    elapsed = time.monotonic() - start
+
+    for listener in listeners:
+        publisher.unregister_listener(listener)
+
+    assert elapsed < 0.5
+    assert all(len(listener.calls) == 1 for listener in listeners)
+    assert len(set(listener.threads[0] for listener in listeners)) == 3
+
+
+def test_dispatch_order(publisher):
+    calls = list()
+    late = SlowDomainEventListener(0.0, calls)
+    early = [SlowDomainEventListener(0.1, calls), SlowDomainEventListener(0.05, calls)]
+    publisher.register_listener(late, order=1)
+    for listener in early:
+        publisher.register_listener(listener)
+
+    AddInMemoryRepository().save(AddDomainObject())
+
+    publisher.unregister_listener(late)
+    for listener in early:
+        publisher.unregister_listener(listener)
+
+    assert calls[-1] is late
+    assert set(calls[:2]) == set(early)
+
+
+def test_aggregated_errors(publisher):
+    failing = [
+        SlowDomainEventListener(0.0, error=ValueError("first")),
+        SlowDomainEventListener(0.0, error=KeyError("second"))]
+    succeeding = SlowDomainEventListener(0.0)
+    for listener in failing:
+        publisher.register_listener(listener)
+    publisher.register_listener(succeeding, order=1)
+
+    with pytest.raises(ListenerDispatchError) as e:
+        AddInMemoryRepository().save(AddDomainObject())
+
+    for listener in failing:
+        publisher.unregister_listener(listener)
+    publisher.unregister_listener(succeeding)
+
+    assert [listener for listener, _ in e.value.errors] == failing
+    assert isinstance(e.value.errors[0][1], ValueError)
+    assert isinstance(e.value.errors[1][1], KeyError)
+    assert len(succeeding.calls) == 1
+
+
+def test_sequential_dispatch_order():
+    publisher = ApplicationDomainEventPublisher().instance
+    calls = list()
+    listeners = [SlowDomainEventListener(0.0, calls) for _ in range(3)]
+    publisher.register_listener(listeners[0], order=2)
+    publisher.register_listener(listeners[1])
+    publisher.register_listener(listeners[2], order=1)
+
+    AddInMemoryRepository().save(AddDomainObject())
+
+    for listener in listeners:
+        publisher.unregister_listener(listener)
+
+    assert calls == [listeners[1], listeners[2], listeners[0]]
@@ -0,0 +1,123 @@
+import multiprocessing
+import os
+from queue import Empty
+
+import pytest
+
+from eventsourcing.DomainEventListener import ApplicationDomainEventPublisher, ProcessPoolDomainEventListener
+from eventsourcing.DomainObject import DomainObject
+from eventsourcing.EventSourceRepository import InMemoryEventSourceRepository
+
+
+class AddDomainObject(DomainObject):
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def add(self, a, b):
+        self.mutate("adding", a + b)
+
+    def on_adding(self, event):
+        self.value = event
+
+
+class AddInMemoryRepository(InMemoryEventSourceRepository):
+
+    def __init__(self):
+        super().__init__()
+
+    def create_blank_domain_object(self):
+        return AddDomainObject()
+
+
+class ReportingListener(ProcessPoolDomainEventListener):
+
+    def __init__(self, nb_workers, max_queue_size=100):
+        super().__init__(nb_workers, max_queue_size)
+        self.results = multiprocessing.Queue()
+
+    def domainEventPublished(self, event):
+        if event["event"] == "fail":
+            raise ValueError("Failing event")
+        self.results.put((os.getpid(), event["object_id"], event["version"]))
+
+
+def collect(listener, nb_results):
+    results = list()
+    try:
+        while len(results) < nb_results:
+            results.append(listener.results.get(timeout=10))
+    except Empty:
+        pass
+    return results
+
+
+def test_partitioned_publish():
+    listener = ReportingListener(nb_workers=3, max_queue_size=2)
+    listener.start()
+    ApplicationDomainEventPublisher().instance.register_listener(listener)
+    assert ApplicationDomainEventPublisher().instance.contains_listener(listener)
+
+    repo = AddInMemoryRepository()
+    objs = [AddDomainObject() for _ in range(20)]
+    for i in range(10):
+        for obj in objs:
+            obj.add(i, 1)
+    for obj in objs:
+        repo.save(obj)
+
+    results = collect(listener, 20 * 11)
+
+    ApplicationDomainEventPublisher().instance.unregister_listener(listener)
+    listener.terminate()
+
+    assert len(results) == 20 * 11
+    for obj in objs:
+        obj_results = [(pid, version) for pid, object_id, version in results if object_id == obj.object_id]
+        # The events of an object are all handled in order, by the same worker
+        assert [version for _, version in obj_results] == list(range(1, 12))
+        assert len(set(pid for pid, _ in obj_results)) == 1
+    assert 1 < len(set(pid for pid, _, _ in results)) <= 3
+    assert os.getpid() not in set(pid for pid, _, _ in results)
+    assert not listener.is_running()
+
+
+def test_worker_survives_errors():
+    listener = ReportingListener(nb_workers=1)
+    listener.start()
+
+    obj = AddDomainObject()
+    obj.mutate("failing", "fail")
+    listener.publish(obj.event_stream)
+    obj.add(1, 2)
+    listener.publish(obj.event_stream[-1:])
+
+    results = collect(listener, 2)
+    listener.terminate()
+
+    assert [version for _, _, version in results] == [1, 3]
+
+
+def test_publish_before_start():
+    listener = ReportingListener(nb_workers=1)
+    obj = AddDomainObject()
+
+    with pytest.raises(RuntimeError):
+        listener.publish(obj.event_stream)
+
+
+def test_terminate_with_dead_worker():
+    listener = ReportingListener(nb_workers=1, max_queue_size=1)
+    listener.start()
+
+    worker, = [process for process in multiprocessing.active_children()
+               if process.name == "ReportingListener-0"]
+    worker.kill()
+    worker.join()
+
+    obj = AddDomainObject()
+    listener.publish(obj.event_stream)
+
+    # The queue of the dead worker is full, terminate must not wait for room there
+    listener.terminate()
+    assert not listener.is_running()
@@ -0,0 +1,225 @@
+from eventsourcing.Checkpoint import InMemoryCheckpointStore
+from eventsourcing.DomainEventListener import ApplicationDomainEventPublisher
+from eventsourcing.EventRecord import EventRecord
+from eventsourcing.DomainObject import DomainObject
+from eventsourcing.EventSourceRepository import InMemoryEventSourceRepository
+from eventsourcing.Projection import InMemoryProjection
+from eventsourcing.ProjectionRunner import ProjectionRunner
+
+
+class AddDomainObject(DomainObject):
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def add(self, a, b):
+        self.mutate("adding", a + b)
+
+    def on_adding(self, event):
+        self.value = event
+
+
+class AddInMemoryRepository(InMemoryEventSourceRepository):
+
+    def __init__(self):
+        super().__init__()
+
+    def create_blank_domain_object(self):
+        return AddDomainObject()
+
+
+class AddProjection(InMemoryProjection):
+
+    def __init__(self):
+        super().__init__()
+        self.flushes = 0
+
+    def project(self, obj_id, event_name, event):
+        if event_name == "adding":
+            self.collection.append(event)
+
+    def flush(self):
+        self.flushes += 1
+
+
+class FailingCheckpointStore(InMemoryCheckpointStore):
+
+    def __init__(self, fail_at):
+        super().__init__()
+        self.fail_at = fail_at
+
+    def save_checkpoint(self, name, position):
+        if position >= self.fail_at:
+            raise IOError("checkpoint store is down")
+        super().save_checkpoint(name, position)
+
+
+def add_events(repo, nb_events):
+    obj = AddDomainObject()
+    for i in range(nb_events):
+        obj.add(i, 0)
+    repo.save(obj)
+    return obj
+
+
+def test_run_in_batches():
+    repo = AddInMemoryRepository()
+    add_events(repo, 99)
+    checkpoints = InMemoryCheckpointStore()
+    projection = AddProjection()
+    reports = list()
+
+    runner = ProjectionRunner(repo, projection, checkpoints, batch_size=30, on_progress=reports.append)
+    progress = runner.run()
+
+    assert projection.collection == list(range(99))
+    assert projection.flushes == 4
+    assert checkpoints.get_checkpoint("AddProjection") == 100
+    assert [report["position"] for report in reports] == [30, 60, 90, 100]
+    assert progress["events"] == 100
+    assert progress["target_position"] == 100
+    assert progress["events_per_second"] > 0
+
+
+def test_resume_from_checkpoint():
+    repo = AddInMemoryRepository()
+    add_events(repo, 49)
+    checkpoints = InMemoryCheckpointStore()
+    projection = AddProjection()
+
+    ProjectionRunner(repo, projection, checkpoints, name="adds", batch_size=20).run()
+    add_events(repo, 9)
+    progress = ProjectionRunner(repo, projection, checkpoints, name="adds", batch_size=20).run()
+
+    assert projection.collection == list(range(49)) + list(range(9))
+    assert progress["events"] == 10
+    assert checkpoints.get_checkpoint("adds") == 60
+
+
+def test_resume_after_failure():
+    repo = AddInMemoryRepository()
+    add_events(repo, 49)
+    checkpoints = FailingCheckpointStore(fail_at=40)
+    projection = AddProjection()
+
+    runner = ProjectionRunner(repo, projection, checkpoints, batch_size=20)
+    try:
+        runner.run()
+        assert False
+    except IOError:
+        pass
+    assert checkpoints.get_checkpoint(runner.name) == 20
+
+    # The batch whose checkpoint was lost is projected again
+    checkpoints.fail_at = 1000
+    projection = AddProjection()
+    runner = ProjectionRunner(repo, projection, checkpoints, batch_size=20)
+    runner.run()
+    assert projection.collection == list(range(19, 49))
+    assert checkpoints.get_checkpoint(runner.name) == 50
+
+
+def test_reset():
+    repo = AddInMemoryRepository()
+    add_events(repo, 9)
+    checkpoints = InMemoryCheckpointStore()
+    projection = AddProjection()
+
+    runner = ProjectionRunner(repo, projection, checkpoints)
+    runner.run()
+    runner.reset()
+    runner.run()
+
+    assert projection.collection == list(range(9)) * 2
+
+
+def test_start_follows_live_events():
+    repo = AddInMemoryRepository()
+    obj = add_events(repo, 9)
+    checkpoints = InMemoryCheckpointStore()
+    projection = AddProjection()
+
+    runner = ProjectionRunner(repo, projection, checkpoints, name="live")
+    runner.start()
+    try:
+        obj.add(100, 0)
+        repo.save(obj)
+    finally:
+        runner.stop()
+
+    obj.add(200, 0)
+    repo.save(obj)
+
+    assert projection.collection == list(range(9)) + [100]
+    assert checkpoints.get_checkpoint("live") == 11
+
+
+def test_out_of_order_live_events():
+    repo = AddInMemoryRepository()
+    add_events(repo, 8)
+    checkpoints = InMemoryCheckpointStore()
+    projection = AddProjection()
+    publisher = ApplicationDomainEventPublisher().instance
+
+    runner = ProjectionRunner(repo, projection, checkpoints, name="unordered")
+    runner.start()
+    try:
+        publisher.domainEventsPublished([EventRecord("late", 2, "adding", 11, 0.0, position=11)])
+        assert checkpoints.get_checkpoint("unordered") == 9
+
+        publisher.domainEventsPublished([EventRecord("late", 1, "adding", 10, 0.0, position=10)])
+        publisher.domainEventsPublished([EventRecord("late", 2, "adding", 11, 0.0, position=11)])
+    finally:
+        runner.stop()
+
+    assert projection.collection == list(range(8)) + [11, 10]
+    assert checkpoints.get_checkpoint("unordered") == 11
+
+
+def test_unpublished_position():
+    repo = AddInMemoryRepository()
+    add_events(repo, 4)
+    checkpoints = InMemoryCheckpointStore()
+    projection = AddProjection()
+
+    runner = ProjectionRunner(repo, projection, checkpoints, name="unpublished", max_ahead=3, gap_timeout=60.0)
+    runner.start()
+    try:
+        # Position 6 is stored but never published, as an event saved by another process
+        hidden = AddDomainObject()
+        hidden.add(50, 0)
+        repo.append_to_stream(hidden)
+
+        obj = add_events(repo, 1)
+        assert checkpoints.get_checkpoint("unpublished") == 5
+
+        # Once max_ahead events wait for it, the store is read again
+        obj.add(60, 0)
+        repo.save(obj)
+        assert checkpoints.get_checkpoint("unpublished") == 10
+    finally:
+        runner.stop()
+
+    assert projection.collection == list(range(4)) + [0, 60, 50]
+
+
+def test_gap_timeout():
+    repo = AddInMemoryRepository()
+    add_events(repo, 4)
+    checkpoints = InMemoryCheckpointStore()
+    projection = AddProjection()
+
+    runner = ProjectionRunner(repo, projection, checkpoints, name="stalled", gap_timeout=0.0)
+    runner.start()
+    try:
+        hidden = AddDomainObject()
+        hidden.add(50, 0)
+        repo.append_to_stream(hidden)
+
+        # The checkpoint does not move, the store is read again at once
+        add_events(repo, 1)
+        assert checkpoints.get_checkpoint("stalled") == 9
+    finally:
+        runner.stop()
+
+    assert projection.collection == list(range(4)) + [0, 50]
@@ -56,3 +56,31 @@ def test_big_add():
         obj.add(i, i-1)
     repo.save(obj)
     assert listener.nb_events == 10001
+
+
+class BatchAddDomainEventListener(DomainEventListener):
+
+    def __init__(self):
+        self.batches = list()
+
+    def domainEventPublished(self, event):
+        raise AssertionError("Events must be published as a batch")
+
+    def domainEventsPublished(self, events):
+        self.batches.append([event["version"] for event in events])
+
+
+def test_batch_publish():
+    listener = BatchAddDomainEventListener()
+
+    obj = AddDomainObject()
+    repo = AddInMemoryRepository()
+    repo.register_listener(listener)
+    for i in range(0, 3):
+        obj.add(i, i)
+    repo.save(obj)
+    repo.save(obj)
+    obj.add(1, 1)
+    repo.save(obj)
+
+    assert listener.batches == [[1, 2, 3, 4], [5]]
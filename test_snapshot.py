@@ -0,0 +1,193 @@
+import pytest
+
+from eventsourcing.DomainObject import DomainObject
+from eventsourcing.EventSourceRepository import InMemoryEventSourceRepository, DomainEventListener
+from eventsourcing.Snapshot import InMemorySnapshotStore, EveryNEventsSnapshotPolicy, EveryTSecondsSnapshotPolicy
+
+
+class AddDomainObject(DomainObject):
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+        self.nb_applied = 0
+
+    def add(self, a, b):
+        self.mutate("adding", a + b)
+
+    def on_adding(self, event):
+        self.value = event
+        self.nb_applied += 1
+
+    def snapshot_state(self):
+        return {"value": self.value}
+
+    def restore_snapshot_state(self, state):
+        self.value = state["value"]
+
+
+class AddInMemoryRepository(InMemoryEventSourceRepository):
+
+    def __init__(self, snapshot_store=None, snapshot_policy=None):
+        super().__init__(snapshot_store, snapshot_policy)
+
+    def create_blank_domain_object(self):
+        return AddDomainObject()
+
+
+def test_take_snapshot():
+    obj = AddDomainObject()
+    obj.add(2, 3)
+
+    snapshot = obj.take_snapshot()
+    assert snapshot["object_id"] == obj.object_id
+    assert snapshot["version"] == 2
+    assert snapshot["state"] == {"value": 5}
+
+
+def test_every_n_events():
+    store = InMemorySnapshotStore()
+    repo = AddInMemoryRepository(store, EveryNEventsSnapshotPolicy(100))
+
+    obj = AddDomainObject()
+    for i in range(0, 98):
+        obj.add(i, 1)
+    repo.save(obj)
+    assert store.get_latest_snapshot(obj.object_id) is None
+
+    for i in range(0, 150):
+        obj.add(i, 1)
+    repo.save(obj)
+    assert store.get_latest_snapshot(obj.object_id)["version"] == 249
+    assert store.get_latest_snapshot(obj.object_id)["state"] == {"value": 150}
+
+
+def test_load_from_snapshot():
+    store = InMemorySnapshotStore()
+    repo = AddInMemoryRepository(store, EveryNEventsSnapshotPolicy(100))
+
+    obj = AddDomainObject()
+    for i in range(0, 150):
+        obj.add(i, 1)
+    repo.save(obj)
+    for i in range(0, 10):
+        obj.add(i, 2)
+    repo.save(obj)
+
+    reloaded = repo.load(obj.object_id)
+    assert reloaded.object_id == obj.object_id
+    assert reloaded.version_number == obj.version_number
+    assert reloaded.value == obj.value
+    assert reloaded.nb_applied == 10
+    assert reloaded.event_stream == obj.event_stream[-10:]
+
+    reloaded.add(1, 1)
+    repo.save(reloaded)
+    assert repo.max_version_for_object(obj.object_id) == 162
+
+
+def test_every_t_seconds():
+    store = InMemorySnapshotStore()
+    repo = AddInMemoryRepository(store, EveryTSecondsSnapshotPolicy(3600))
+
+    obj = AddDomainObject()
+    repo.save(obj)
+    assert store.get_latest_snapshot(obj.object_id)["version"] == 1
+
+    obj.add(1, 1)
+    repo.save(obj)
+    assert store.get_latest_snapshot(obj.object_id)["version"] == 1
+
+
+def test_every_t_seconds_reads_the_store_once():
+    class CountingSnapshotStore(InMemorySnapshotStore):
+        reads = 0
+
+        def get_latest_snapshot(self, object_id):
+            self.reads += 1
+            return super().get_latest_snapshot(object_id)
+
+    store = CountingSnapshotStore()
+    policy = EveryTSecondsSnapshotPolicy(0, min_events=3)
+    repo = AddInMemoryRepository(store, policy)
+
+    obj = AddDomainObject()
+    repo.save(obj)
+    for i in range(0, 6):
+        obj.add(i, 1)
+        repo.save(obj)
+
+    assert store.reads == 1
+    assert store.get_latest_snapshot(obj.object_id)["version"] == 6
+
+    # Another policy reads the last snapshot from the store
+    assert not EveryTSecondsSnapshotPolicy(0, min_events=3).should_snapshot(
+        obj, obj.event_stream[-1:], store)
+
+
+def test_no_snapshot_policy():
+    store = InMemorySnapshotStore()
+    repo = AddInMemoryRepository(store)
+
+    obj = AddDomainObject()
+    obj.add(1, 1)
+    repo.save(obj)
+    assert store.get_latest_snapshot(obj.object_id) is None
+    assert repo.load(obj.object_id).value == 2
+
+
+def test_load_many_from_snapshots():
+    store = InMemorySnapshotStore()
+    repo = AddInMemoryRepository(store, EveryNEventsSnapshotPolicy(10))
+
+    obj1 = AddDomainObject()
+    for i in range(0, 14):
+        obj1.add(i, 1)
+    repo.save(obj1)
+    for i in range(0, 3):
+        obj1.add(i, 2)
+    obj2 = AddDomainObject()
+    obj2.add(1, 1)
+    repo.save_all([obj1, obj2])
+
+    loaded = repo.load_many([obj1.object_id, obj2.object_id])
+    assert loaded[obj1.object_id].value == obj1.value
+    assert loaded[obj1.object_id].version_number == 18
+    assert loaded[obj1.object_id].nb_applied == 3
+    assert loaded[obj2.object_id].value == obj2.value
+    assert loaded[obj2.object_id].nb_applied == 1
+
+
+def test_snapshot_failure_after_publishing():
+    class NoSnapshotDomainObject(DomainObject):
+        def on_adding(self, event):
+            pass
+
+    class NoSnapshotRepository(InMemoryEventSourceRepository):
+        def create_blank_domain_object(self):
+            return NoSnapshotDomainObject()
+
+    class VersionsListener(DomainEventListener):
+        def __init__(self):
+            self.versions = list()
+
+        def domainEventPublished(self, event):
+            self.versions.append(event["version"])
+
+    store = InMemorySnapshotStore()
+    repo = NoSnapshotRepository(store, EveryNEventsSnapshotPolicy(2))
+    listener = VersionsListener()
+    repo.register_listener(listener)
+
+    obj = NoSnapshotDomainObject()
+    obj.mutate("adding", 1)
+    with pytest.raises(NotImplementedError):
+        repo.save(obj)
+    # The stored events have been published all the same
+    assert listener.versions == [1, 2]
+    assert obj.committed_version == 2
+
+    other = NoSnapshotDomainObject()
+    other.mutate("adding", 1)
+    with pytest.raises(NotImplementedError):
+        repo.save_all([other])
+    assert listener.versions == [1, 2, 1, 2]
@@ -0,0 +1,131 @@
+import pytest
+
+from eventsourcing.CachedRepository import CachedRepository
+from eventsourcing.DomainObject import DomainObject
+from eventsourcing.EventSourceRepository import InMemoryEventSourceRepository, DomainEventListener, \
+    ConcurrencyError
+
+
+class AddDomainObject(DomainObject):
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def add(self, a, b):
+        self.mutate("adding", a + b)
+
+    def on_adding(self, event):
+        self.value = event
+
+
+class AddInMemoryRepository(InMemoryEventSourceRepository):
+
+    def __init__(self):
+        super().__init__()
+
+    def create_blank_domain_object(self):
+        return AddDomainObject()
+
+
+class AddDomainEventListener(DomainEventListener):
+
+    def __init__(self):
+        self.events = list()
+
+    def domainEventPublished(self, event):
+        self.events.append(event)
+
+
+def test_save_all():
+    listener = AddDomainEventListener()
+    repo = AddInMemoryRepository()
+    repo.register_listener(listener)
+
+    objs = [AddDomainObject() for _ in range(0, 10)]
+    for i, obj in enumerate(objs):
+        obj.add(i, 1)
+    repo.save_all(objs)
+
+    assert len(listener.events) == 20
+    for obj in objs:
+        assert repo.get_event_stream_for(obj.object_id) == obj.event_stream
+
+    objs[0].add(5, 5)
+    repo.save_all(objs)
+    assert len(listener.events) == 21
+    assert listener.events[-1]["version"] == 3
+
+
+def test_save_all_conflict_saves_nothing():
+    listener = AddDomainEventListener()
+    repo = AddInMemoryRepository()
+    repo.register_listener(listener)
+
+    obj1 = AddDomainObject()
+    obj2 = AddDomainObject()
+    repo.save_all([obj1, obj2])
+    assert len(listener.events) == 2
+
+    obj1.add(1, 1)
+    obj2.add(2, 2)
+    with pytest.raises(ConcurrencyError) as e:
+        repo.save_all([obj1, obj2], {obj1.object_id: 1, obj2.object_id: 0})
+    assert e.value.object_id == obj2.object_id
+
+    assert len(listener.events) == 2
+    assert repo.max_version_for_object(obj1.object_id) == 1
+    assert repo.max_version_for_object(obj2.object_id) == 1
+
+
+def test_unit_of_work():
+    listener = AddDomainEventListener()
+    repo = AddInMemoryRepository()
+    repo.register_listener(listener)
+
+    obj1 = AddDomainObject()
+    obj2 = AddDomainObject()
+    with repo.unit_of_work() as uow:
+        obj1.add(1, 2)
+        obj2.add(3, 4)
+        uow.register(obj1, 0)
+        uow.register(obj2)
+        assert len(listener.events) == 0
+
+    assert len(listener.events) == 4
+    assert repo.load(obj1.object_id).value == 3
+    assert repo.load(obj2.object_id).value == 7
+
+
+def test_unit_of_work_rollback():
+    repo = AddInMemoryRepository()
+    obj = AddDomainObject()
+
+    with pytest.raises(RuntimeError):
+        with repo.unit_of_work() as uow:
+            uow.register(obj)
+            raise RuntimeError()
+
+    assert not repo.exists(obj.object_id)
+
+
+def test_cached_unit_of_work():
+    inner = AddInMemoryRepository()
+    repo = CachedRepository(inner)
+
+    obj = AddDomainObject()
+    with repo.unit_of_work() as uow:
+        uow.register(obj)
+
+    assert inner.exists(obj.object_id)
+    assert repo.load(obj.object_id) is obj
+
+
+def test_max_versions_for_objects():
+    repo = AddInMemoryRepository()
+    obj1 = AddDomainObject()
+    obj2 = AddDomainObject()
+    obj2.add(1, 1)
+    repo.save_all([obj1, obj2])
+
+    assert repo.max_versions_for_objects([obj1.object_id, obj2.object_id, "unknown"]) == {
+        obj1.object_id: 1, obj2.object_id: 2}